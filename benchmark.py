@@ -0,0 +1,375 @@
+"""
+benchmark.py - Times the acquisition and logging hot paths of DRIP.
+
+Every benchmark runs against simulator.py, so results do not depend on the
+wiring and runs on different days or machines can be compared. Results are
+written as JSON; pass an earlier result file with --baseline to report
+regressions (the script then exits with status 1).
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --baseline bench.json --threshold 0.15
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics as stat
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from functools import lru_cache
+
+import simulator
+
+# the simulated drivers have to be in place before hx711 and drip are imported.
+# Conversions are always ready and buses have no latency, so the benchmarks
+# time our code and not the simulated hardware.
+SIM = simulator.install(
+    seed=0,
+    hx711={"rate_sps": 1_000_000},
+    nau7802={"rate_sps": 320, "latency": 0},
+    si7021={"latency": 0},
+    pzem={"latency": 0, "baudrate": None},
+)
+
+import pzem  # noqa: E402
+from binlog import BinaryLogReader, BinaryStreamWriter  # noqa: E402
+from drip import DRIP  # noqa: E402
+from efficiency import EfficiencyEstimator  # noqa: E402
+from hx711 import HX711  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from rollup import RollupEngine  # noqa: E402
+from sliding_filter import SlidingOutlierFilter  # noqa: E402
+from stream_writer import StreamWriter  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark setup function. It returns the callable to time,
+    or a (callable, cleanup, items per call) tuple, optionally followed by a
+    function that returns extra metrics for the timing result."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def measure(func, repeats=5, min_time=0.2):
+    """
+    measure times func like timeit: the loop count is grown until one repeat
+    takes at least min_time, then the loop is repeated.
+
+    Returns: dict with best and median seconds per call
+    """
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    loops = max(1, int(loops * min_time / 0.2))
+    times = [t / loops for t in timer.repeat(repeat=repeats, number=loops)]
+    return {
+        "best": min(times),
+        "median": stat.median(times),
+        "loops": loops,
+        "repeats": repeats,
+    }
+
+
+@lru_cache(maxsize=None)
+def _hx711(backend="rpi"):
+    # creating an HX711 waits a second for the channel and gain to settle, share one
+    hx = HX711(dout_pin=SIM.hx711.dout_pin, pd_sck_pin=SIM.hx711.pd_sck_pin,
+               gain_channel_A=64, select_channel='A', gpio_backend=backend)
+    return hx
+
+
+def _bench_hx711_read(backend, stall_rate):
+    """
+    Times HX711._read and counts how many reads return data. With a stall
+    rate the simulated GPIO is preempted now and then, and a pulse that
+    stays HIGH for 60 us powers the chip down.
+    """
+    hx = _hx711(backend)
+    counts = {"reads": 0, "valid": 0}
+
+    def read():
+        counts["reads"] += 1
+        if hx._read() is not False:
+            counts["valid"] += 1
+
+    def cleanup():
+        SIM.gpio.stall_rate = 0.0
+
+    def stats(result):
+        success_rate = counts["valid"] / counts["reads"]
+        return {"success_rate": success_rate,
+                "samples_per_sec": result["ops_per_sec"] * success_rate}
+
+    SIM.gpio.stall_rate = stall_rate
+    return read, cleanup, 1, stats
+
+
+for _backend in ("rpi", "lgpio"):
+    _suffix = "" if _backend == "rpi" else f"_{_backend}"
+    benchmark(f"hx711_read{_suffix}")(lambda backend=_backend: _bench_hx711_read(backend, 0.0))
+    benchmark(f"hx711_read_stalled{_suffix}")(lambda backend=_backend: _bench_hx711_read(backend, 0.002))
+
+
+def _outliers_data(size):
+    rng = random.Random(size)
+    data = [int(rng.gauss(-4_000_000, 50)) for _ in range(size)]
+    for i in range(0, size, 10):
+        data[i] += rng.choice((-1, 1)) * 5_000  # a few outliers
+    return data
+
+
+def _bench_outliers_filter(size):
+    hx = _hx711()
+    data = _outliers_data(size)
+    return lambda: hx.outliers_filter(data)
+
+
+for _size in (5, 15, 45, 99):
+    benchmark(f"hx711_outliers_filter_{_size}")(lambda size=_size: _bench_outliers_filter(size))
+
+
+@benchmark("sliding_filter_push_45")
+def bench_sliding_filter_push():
+    sliding = SlidingOutlierFilter(window=45)
+    samples = iter(_outliers_data(100_000) * 1_000)
+    for _ in range(45):
+        sliding.push(next(samples))
+    return lambda: sliding.push(next(samples))
+
+
+def _pzem_blocks(count):
+    rng = random.Random(count)
+    return [[rng.randrange(0, 1 << 16) for _ in range(10)] for _ in range(count)]
+
+
+@benchmark("pzem_decode")
+def bench_pzem_decode():
+    block = _pzem_blocks(1)[0]
+    return lambda: pzem.decode(block)
+
+
+@benchmark("pzem_decode_batch_1000")
+def bench_pzem_decode_batch():
+    blocks = _pzem_blocks(1000)
+    return lambda: pzem.decode_batch(blocks)
+
+
+def _log_row():
+    fields = ['Time', 'Grams', 'Temperature', 'Humidity', 'Voltage', 'Current', 'Power',
+              'Energy', 'Frequency', 'Power_Factor', 'Threshold', 'Alarm_Status']
+    row = {
+        'Time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'Grams': 1034.5629871,
+        'Temperature': 24.31298828125, 'Humidity': 55.2783203125, 'Voltage': 230.1,
+        'Current': 1.602, 'Power': 350.7, 'Energy': 1234, 'Frequency': 50.0,
+        'Power_Factor': 0.95, 'Threshold': 50000, 'Alarm_Status': 0
+    }
+    return fields, row
+
+
+def _bench_write_row(writer_class, name):
+    fields, row = _log_row()
+    directory = tempfile.TemporaryDirectory()
+    writer = writer_class(os.path.join(directory.name, name), fields)
+
+    def cleanup():
+        writer.close()
+        directory.cleanup()
+
+    return (lambda: writer.write(row)), cleanup, 1
+
+
+@benchmark("csv_write_row")
+def bench_csv_write_row():
+    return _bench_write_row(StreamWriter, "bench.csv")
+
+
+@benchmark("binlog_write_row")
+def bench_binlog_write_row():
+    return _bench_write_row(BinaryStreamWriter, "bench.drip")
+
+
+@benchmark("binlog_read_column_100000")
+def bench_binlog_read_column():
+    fields, row = _log_row()
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "bench.drip")
+    with BinaryStreamWriter(path, fields, flush_rows=10_000) as writer:
+        for _ in range(100_000):
+            writer.write(row)
+
+    def read():
+        with BinaryLogReader(path) as log:
+            log['Grams'].mean()
+
+    return read, directory.cleanup, 1
+
+
+@benchmark("rollup_add_3_windows")
+def bench_rollup_add():
+    fields, row = _log_row()
+    rollups = RollupEngine(fields, lambda seconds, rollup_fields: [], windows=(60, 900, 3600))
+    clock = itertools.count(1_700_000_000, 0.5)
+    return lambda: rollups.add(row, next(clock))
+
+
+@benchmark("efficiency_add_600s")
+def bench_efficiency_add():
+    estimator = EfficiencyEstimator(window=600)
+    rng = random.Random(0)
+    clock = itertools.count(1_700_000_000, 2.0)
+
+    def add():
+        t = next(clock)
+        estimator.add(t, 0.14 * t + rng.gauss(0, 0.5), power=350.0)
+
+    for _ in range(400):  # fill the window
+        add()
+    return add
+
+
+@benchmark("metrics_observe")
+def bench_metrics_observe():
+    histogram = Metrics().histogram("read_seconds", sensor="NAU7802")
+    rng = random.Random(0)
+    values = itertools.cycle([rng.lognormvariate(-4, 1) for _ in range(1000)])
+    return lambda: histogram.observe(next(values))
+
+
+@benchmark("metrics_render")
+def bench_metrics_render():
+    metrics = Metrics(labels={"drip_id": "0"})
+    for name in ("NAU7802", "Si7021", "PZEM"):
+        histogram = metrics.histogram("read_seconds", sensor=name)
+        for i in range(100):
+            histogram.observe(i / 1000)
+        metrics.count("i2c_transactions_total", 1000, sensor=name)
+    return metrics.render
+
+
+@benchmark("drip_run_all")
+def bench_drip_run_all():
+    directory = tempfile.TemporaryDirectory()
+    with contextlib.redirect_stdout(io.StringIO()):
+        drip = DRIP(
+            drip_id=0,
+            si7021_i2c_bus=10,
+            pzem_interface_path=SIM.pzem_path,
+            nau7802_offset=SIM.nau7802.offset,
+            nau7802_ratio=SIM.nau7802.ratio,
+            nau7802_readings=2,
+            file_export=os.path.join(directory.name, "bench.csv")
+        )
+
+    iterations = 20
+
+    def run_all():
+        with contextlib.redirect_stdout(io.StringIO()):
+            drip.run_all(iterations=iterations, sleep=0)
+
+    def cleanup():
+        with contextlib.redirect_stdout(io.StringIO()):
+            drip.close_sensors()
+        directory.cleanup()
+
+    return run_all, cleanup, iterations
+
+
+def run(names, repeats, min_time):
+    results = {}
+    for name in names:
+        setup = BENCHMARKS[name]()
+        func, cleanup, items, stats = setup, None, 1, None
+        if isinstance(setup, tuple):
+            func, cleanup, items, *rest = setup
+            stats = rest[0] if rest else None
+        try:
+            result = measure(func, repeats=repeats, min_time=min_time)
+        finally:
+            if cleanup:
+                cleanup()
+        # for benchmarks that do several items per call (e.g. run_all
+        # iterations) the rate is per item
+        result["items_per_call"] = items
+        result["ops_per_sec"] = items / result["median"]
+        if stats:
+            result.update(stats(result))
+        results[name] = result
+        line = f"{name:<32} {result['median'] / items * 1e6:>12.2f} us/op {result['ops_per_sec']:>14.1f} ops/s"
+        if "success_rate" in result:
+            line += f" {result['success_rate'] * 100:>6.1f} % valid"
+        print(line)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    compare returns the benchmarks whose median time per call grew by more
+    than threshold (a fraction) against the baseline results.
+    """
+    regressions = {}
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        change = result["median"] / old["median"] - 1
+        if change > threshold:
+            regressions[name] = change
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the DRIP hot paths against simulated sensors.")
+    parser.add_argument("-o", "--output", dest="output", type=str, default="bench.json",
+                        help="JSON file for the results, defaults to bench.json")
+    parser.add_argument("-b", "--baseline", dest="baseline", type=str, default=None,
+                        help="Earlier results to compare against")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, default=0.10,
+                        help="Slowdown counted as a regression, defaults to 0.10 (10 %%)")
+    parser.add_argument("-r", "--repeats", dest="repeats", type=int, default=5,
+                        help="Repeats per benchmark, defaults to 5")
+    parser.add_argument("--min-time", dest="min_time", type=float, default=0.2,
+                        help="Minimum seconds per repeat, defaults to 0.2")
+    parser.add_argument("-k", "--only", dest="only", type=str, default="",
+                        help="Only run benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.only in name]
+    results = run(names, args.repeats, args.min_time)
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"--- results written to {args.output}")
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, change in regressions.items():
+            print(f"--- REGRESSION {name}: {change * 100:.1f} % slower than {args.baseline}")
+        if regressions:
+            status = 1
+        else:
+            print(f"--- no regressions against {args.baseline}")
+    SIM.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""
+This file holds the binary log format of DRIP, its writer, reader and CSV converter.
+
+A log file is a fixed schema header followed by fixed size records:
+
+    8 bytes     magic b"DRIPLOG1"
+    4 bytes     header length N, little endian uint32
+    N bytes     JSON header {"version", "fields": [{"name", "dtype", ...}]},
+                padded with spaces so the records start at a multiple of 8
+    records     one per row, the fields in header order, little endian,
+                not padded: numpy dtype [(name, dtype), ...]
+
+Timestamps are int64 nanoseconds since the epoch, values are float32,
+float64 or int64. Missing values are NaN for floats and INT64_MIN for
+integers (the NaT value of numpy datetime64). The file is only ever
+appended to, so a reader can map it while a run is still writing.
+
+Usage:
+    python binlog.py to-binary data.csv data.drip
+    python binlog.py to-csv data.drip data.csv
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from stream_writer import StreamWriter
+
+MAGIC = b"DRIPLOG1"
+VERSION = 1
+EXTENSION = ".drip"
+NULL_INT = np.iinfo(np.int64).min
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# address suffix of extra PZEM meters and statistic suffix of rollups, e.g. Power_2_Mean
+_SUFFIX = re.compile(r"(_\d+)?(_(Mean|Min|Max|First|Last))?$")
+
+
+def default_field(name):
+    """
+    default_field returns the column type DRIP uses for a field name.
+
+    Returns: dict with name, dtype and kind ("time" || "value"). Time fields
+        also have precision, the fractional digits of their CSV text.
+    """
+    if name in ('Time', 'Window_End') or name.endswith('_Time'):
+        return {"name": name, "dtype": "<i8", "kind": "time",
+                "precision": 0 if name in ('Time', 'Window_End') else 3}
+    suffix = _SUFFIX.search(name)
+    base = name[:suffix.start()]
+    if base in ('Energy', 'Threshold', 'Alarm_Status', 'Samples', 'Complete', 'Grams_Samples') or base.endswith('_Quality'):
+        dtype = "<i8"
+    elif base.startswith('Grams') or base in ('Temperature', 'Humidity') or suffix.group(3) == 'Mean':
+        dtype = "<f8"  # computed values, float32 would change their text
+    else:
+        dtype = "<f4"  # meter readings with 1 to 3 decimals
+    return {"name": name, "dtype": dtype, "kind": "value"}
+
+
+def make_schema(fields, dtypes=None, precision=None):
+    """
+    make_schema returns the header field list for the given columns.
+
+    Args:
+        fields([str]): column names
+        dtypes(dict): Optional. field name -> numpy dtype string
+            ("<f4" || "<f8" || "<i8") overriding the defaults
+        precision(dict): Optional. time field name -> fractional digits
+            overriding the defaults
+    """
+    schema = []
+    for name in fields:
+        field = default_field(name)
+        if field["kind"] == "time":
+            if precision and name in precision:
+                field["precision"] = precision[name]
+        elif dtypes and name in dtypes:
+            field["dtype"] = np.dtype(dtypes[name]).newbyteorder('<').str
+        schema.append(field)
+    return schema
+
+
+def schema_dtype(schema):
+    return np.dtype([(field["name"], field["dtype"]) for field in schema])
+
+
+def encode_header(schema):
+    header = json.dumps({"version": VERSION, "fields": schema}).encode()
+    # records start 8 byte aligned
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+    return MAGIC + struct.pack("<I", len(header)) + header
+
+
+def read_header(f):
+    """
+    read_header reads the header at the start of an open binary file.
+
+    Returns: (list of field dicts, offset of the first record)
+
+    Raises:
+        ValueError: if the file is not a DRIP binary log
+    """
+    start = f.read(len(MAGIC) + 4)
+    if len(start) < len(MAGIC) + 4 or start[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a DRIP binary log: {}'.format(getattr(f, 'name', f)))
+    (length,) = struct.unpack("<I", start[len(MAGIC):])
+    header = json.loads(f.read(length))
+    if header.get("version") != VERSION:
+        raise ValueError('unsupported DRIP binary log version: {}'.format(header.get("version")))
+    return header["fields"], len(MAGIC) + 4 + length
+
+
+def to_nanoseconds(value):
+    """
+    to_nanoseconds converts a timestamp to int64 nanoseconds since the epoch.
+
+    Args:
+        value(str || datetime || float): ISO text as written by run_all
+            (local time), a datetime or seconds since the epoch
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    return int(round(value * 1e6)) * 1000  # a double holds microseconds exactly
+
+
+def format_time(nanoseconds, precision=0):
+    """
+    format_time turns nanoseconds since the epoch back into run_all's text.
+    """
+    seconds, nanos = divmod(int(nanoseconds), 1_000_000_000)
+    text = datetime.fromtimestamp(seconds).strftime(TIME_FORMAT)
+    if precision:
+        text += '.' + f'{nanos:09d}'[:precision]
+    return text
+
+
+class BinaryStreamWriter(StreamWriter):
+    """
+    BinaryStreamWriter appends rows to a DRIP binary log. It takes the same
+    commit and rotation policies as StreamWriter; the rows of one commit
+    are converted in a single numpy call and written as one chunk.
+    """
+
+    def __init__(self, path, fields, dtypes=None, precision=None, **kwargs):
+        """
+        Init a new instance of BinaryStreamWriter
+
+        Args:
+            path(str): file to write, see StreamWriter.
+            fields([str]): column names, stored in the header of every file.
+            dtypes(dict): Optional. field name -> numpy dtype overriding the
+                default column types (see default_field).
+            precision(dict): Optional. time field name -> fractional digits
+                of its text when converted back to CSV.
+            **kwargs: flush_interval, flush_rows, fsync, rotate_bytes and
+                rotate_seconds as for StreamWriter.
+        """
+        self.schema = make_schema(fields, dtypes, precision)
+        self.dtype = schema_dtype(self.schema)
+        self._chunk = []  # rows of the current commit, as tuples
+        self._converters = [self._converter(field) for field in self.schema]
+        super().__init__(path, fields, **kwargs)
+
+    @staticmethod
+    def _converter(field):
+        if field["kind"] == "time":
+            convert, null = to_nanoseconds, NULL_INT
+        elif field["dtype"] == "<i8":
+            convert, null = (lambda value: int(float(value)) if isinstance(value, str) else int(value)), NULL_INT
+        else:
+            convert, null = float, float("nan")
+        name = field["name"]
+
+        def get(row):
+            value = row.get(name)
+            if value is None or value == '':
+                return null
+            return convert(value)
+        return get
+
+    def _appendable(self, path):
+        # new, empty or written with the same schema
+        if not os.path.exists(path) or os.stat(path).st_size == 0:
+            return True
+        with open(path, 'rb') as f:
+            schema, _ = read_header(f)
+        return [(field["name"], field["dtype"]) for field in schema] == self.dtype.descr
+
+    def _open_file(self, path):
+        if os.path.exists(path) and os.stat(path).st_size > 0:
+            with open(path, 'rb') as f:
+                _, offset = read_header(f)
+            # a power cut can leave half a record at the end, drop it so the
+            # next record lands on a record boundary
+            records = (os.stat(path).st_size - offset) // self.dtype.itemsize
+            os.truncate(path, offset + records * self.dtype.itemsize)
+        return open(path, 'ab')
+
+    def _make_writer(self, f):
+        return f
+
+    def _write_header(self):
+        self._file.write(encode_header(self.schema))
+
+    def _write_row(self, row):
+        self._chunk.append(tuple(get(row) for get in self._converters))
+
+    def commit(self):
+        """
+        commit writes the pending rows as one chunk and flushes it.
+        """
+        if self._chunk:
+            self._file.write(np.array(self._chunk, dtype=self.dtype).tobytes())
+            self._chunk = []
+        super().commit()
+
+
+class BinaryLogReader:
+    """
+    BinaryLogReader memory-maps a DRIP binary log. Columns are numpy views
+    into the mapping, nothing is copied or parsed up front.
+    """
+
+    def __init__(self, path):
+        """
+        Init a new instance of BinaryLogReader
+
+        Args:
+            path(str): the binary log. Rows appended after this point are
+                not visible, open a new reader to see them.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.schema, self.offset = read_header(f)
+        self.dtype = schema_dtype(self.schema)
+        self.fields = [field["name"] for field in self.schema]
+        size = os.stat(path).st_size - self.offset
+        count = size // self.dtype.itemsize  # a half written record is left out
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r',
+                                     offset=self.offset, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, name):
+        """
+        Returns the column as a read-only numpy view.
+        """
+        return self.records[name]
+
+    def column(self, name):
+        """
+        column returns a column, time columns as datetime64[ns] (UTC) views.
+        """
+        values = self.records[name]
+        if self._field(name)["kind"] == "time":
+            return values.view('datetime64[ns]')
+        return values
+
+    def columns(self):
+        """
+        columns returns a dict of field name -> column.
+        """
+        return {name: self.column(name) for name in self.fields}
+
+    def _field(self, name):
+        for field in self.schema:
+            if field["name"] == name:
+                return field
+        raise KeyError(name)
+
+    def close(self):
+        mmap = getattr(self.records, '_mmap', None)
+        self.records = np.empty(0, dtype=self.dtype)
+        if mmap is not None:
+            mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def binary_path(path):
+    """
+    binary_path returns the binary log name that goes with a CSV path.
+    """
+    return os.path.splitext(path)[0] + EXTENSION
+
+
+def csv_to_binary(csv_path, bin_path, dtypes=None, chunk_rows=4096):
+    """
+    csv_to_binary converts a CSV log written by run_all to a binary log
+    with the same columns. An existing bin_path is replaced.
+
+    Returns: number of rows converted
+    """
+    with open(csv_path, newline='') as f:
+        reader = csv.DictReader(f)
+        first = next(reader, None)
+        # keep as many fractional digits as the CSV timestamps have
+        precision = {}
+        for name in reader.fieldnames or []:
+            if first and first.get(name) and default_field(name)["kind"] == "time":
+                precision[name] = len(first[name].partition('.')[2])
+        if os.path.exists(bin_path):
+            os.remove(bin_path)
+        with BinaryStreamWriter(bin_path, reader.fieldnames or [], dtypes=dtypes, precision=precision,
+                                flush_rows=chunk_rows, flush_interval=float("inf")) as writer:
+            if first is not None:
+                writer.write(first)
+            for row in reader:
+                writer.write(row)
+        return writer.rows_written
+
+
+def _format_column(field, values):
+    if field["kind"] == "time":
+        precision = field.get("precision", 0)
+        return ['' if value == NULL_INT else format_time(value, precision) for value in values.tolist()]
+    if field["dtype"] == "<i8":
+        return ['' if value == NULL_INT else str(value) for value in values.tolist()]
+    if field["dtype"] == "<f4":
+        # numpy prints the shortest text that reads back to the same float32
+        return ['' if np.isnan(value) else str(value) for value in values]
+    return ['' if value != value else repr(value) for value in values.tolist()]
+
+
+def binary_to_csv(bin_path, csv_path, chunk_rows=4096):
+    """
+    binary_to_csv converts a binary log back to run_all's CSV layout.
+
+    Returns: number of rows converted
+    """
+    with BinaryLogReader(bin_path) as log, open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(log.fields)
+        for start in range(0, len(log), chunk_rows):
+            chunk = log.records[start:start + chunk_rows]
+            columns = [_format_column(field, chunk[field["name"]]) for field in log.schema]
+            writer.writerows(zip(*columns))
+        return len(log)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts DRIP logs between CSV and the binary format.")
+    parser.add_argument("direction", choices=("to-binary", "to-csv"))
+    parser.add_argument("source", type=str, help="File to convert")
+    parser.add_argument("target", type=str, help="File to write")
+    args = parser.parse_args()
+
+    if args.direction == "to-binary":
+        rows = csv_to_binary(args.source, args.target)
+    else:
+        rows = binary_to_csv(args.source, args.target)
+    print(f"--- converted {rows} rows from {args.source} to {args.target}")
@@ -0,0 +1,268 @@
+"""
+This file holds the NAU7802 calibration solver.
+
+A calibration session tares the empty scale and then reads one or more
+known weights. Every point keeps its mean raw reading, the number of
+conversions and their standard deviation (nau7802_calibrate.py appends
+them to nau_calibrate_points.csv). The solver fits
+
+    raw = offset_s + gain * grams
+
+by weighted least squares over all sessions: one gain for the load cell and
+one offset per session, since the zero drifts between sessions while the
+gain does not. Sessions whose own gain is far from the others (a wrong
+weight typed in, a weight touching the frame) are rejected with a median /
+MAD test before the final fit. DRIP computes grams = (raw - offset) * ratio,
+so ratio = 1 / gain, and offset is the offset of the last kept session,
+the zero closest to the scale as it is now (or the mean of the kept
+sessions). The spread of the session offsets is reported on its own.
+
+The old single point file nau_calibrate.csv (Weight, Offset, Ratio) is read
+as one session of two points per row.
+
+Usage:
+    python calibration.py nau_calibrate_points.csv nau_calibrate.csv -o nau7802_calibration.json
+"""
+import argparse
+import csv
+import json
+import math
+import os
+from datetime import datetime
+
+import numpy as np
+
+from stream_writer import StreamWriter
+
+POINT_FIELDS = ['Session', 'Time', 'Weight', 'Raw', 'Samples', 'Stdev']
+POINTS_FILE = "nau_calibrate_points.csv"
+CONFIG_FILE = "nau7802_calibration.json"
+OUTLIER_THRESHOLD = 3.5  # robust z score of a session gain that rejects the session
+MAD_TO_STDEV = 1.4826
+
+
+def read_points(path):
+    """
+    read_points reads calibration points from a points file or from the
+    old single point file.
+
+    Returns: [dict] with session, weight, raw, samples and stdev (None if unknown)
+    """
+    points = []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        legacy = 'Ratio' in fields and 'Raw' not in fields
+        for number, row in enumerate(reader, start=1):
+            if legacy:
+                # a tare and one known weight, the raw reading follows from the ratio
+                session = f"{os.path.basename(path)}:{number}"
+                weight, offset, ratio = float(row['Weight']), float(row['Offset']), float(row['Ratio'])
+                points.append({"session": session, "weight": 0.0, "raw": offset, "samples": None, "stdev": None})
+                points.append({"session": session, "weight": weight, "raw": offset + weight / ratio,
+                               "samples": None, "stdev": None})
+            else:
+                points.append({
+                    "session": row['Session'],
+                    "weight": float(row['Weight']),
+                    "raw": float(row['Raw']),
+                    "samples": int(row['Samples']) if row.get('Samples') else None,
+                    "stdev": float(row['Stdev']) if row.get('Stdev') else None,
+                })
+    return points
+
+
+def write_points(points, path=POINTS_FILE):
+    """
+    write_points appends points (dicts as returned by read_points, plus an
+    optional time) to a points file.
+    """
+    with StreamWriter(path, POINT_FIELDS, flush_rows=len(points) or 1) as writer:
+        for point in points:
+            writer.write({
+                'Session': point["session"],
+                'Time': point.get("time", ''),
+                'Weight': point["weight"],
+                'Raw': point["raw"],
+                'Samples': point["samples"] if point["samples"] is not None else '',
+                'Stdev': point["stdev"] if point["stdev"] is not None else '',
+            })
+
+
+def _variances(points):
+    # variance of every mean raw reading; points without statistics get the
+    # median of the known ones, or 1 if none is known (ordinary least squares)
+    known = [max(p["stdev"] ** 2, 1.0) / p["samples"] for p in points
+             if p["stdev"] is not None and p["samples"]]
+    default = float(np.median(known)) if known else 1.0
+    return np.array([max(p["stdev"] ** 2, 1.0) / p["samples"] if p["stdev"] is not None and p["samples"]
+                     else default for p in points])
+
+
+def _within(sessions):
+    # weighted least squares of a common gain with one offset per session
+    sxx = sxy = 0.0
+    for s in sessions:
+        if s["span"]:
+            dw = s["w"] - s["w_mean"]
+            sxx += np.sum(s["v"] * dw * dw)
+            sxy += np.sum(s["v"] * dw * (s["r"] - s["r_mean"]))
+    return sxy / sxx, sxx
+
+
+def fit(points, threshold=OUTLIER_THRESHOLD, offset="last"):
+    """
+    fit solves the calibration.
+
+    Args:
+        points([dict]): see read_points, in the order the sessions were taken
+        threshold(float): Optional, by default 3.5. Robust z score (median and
+            MAD of the session gains) above which a session is rejected.
+            None keeps every session.
+        offset(str): Optional, by default "last". Options ("last" || "mean")
+            the offset of the last kept session or the mean of the kept sessions.
+
+    Returns: dict with offset and ratio for DRIP, gain (counts per gram) and
+        gain_se, full_scale (grams), max_residual (grams), linearity_error
+        (% of full scale, None without a session of three or more weights),
+        zero_drift (grams, standard deviation of the session offsets),
+        offset_spread (counts, largest minus smallest session offset), residuals
+        [(session, weight, grams)], sessions [dict] and rejected [session]
+
+    Raises:
+        ValueError: if no session has two different weights
+    """
+    if offset not in ("last", "mean"):
+        raise ValueError('offset has to be "last" or "mean". Received: {}'.format(offset))
+    variances = _variances(points)
+    sessions = {}
+    for point, variance in zip(points, variances):
+        session = sessions.setdefault(point["session"], {"session": point["session"], "points": []})
+        session["points"].append((point["weight"], point["raw"], 1 / variance))
+    sessions = list(sessions.values())
+    for s in sessions:
+        s["w"], s["r"], s["v"] = (np.array(column) for column in zip(*s["points"]))
+        s["w_mean"] = np.sum(s["v"] * s["w"]) / np.sum(s["v"])
+        s["r_mean"] = np.sum(s["v"] * s["r"]) / np.sum(s["v"])
+        s["span"] = bool(np.ptp(s["w"]) > 0)  # a session of tares only gives no gain
+        s["gain"] = _within([s])[0] if s["span"] else None
+        s["rejected"] = False
+
+    gains = np.array([s["gain"] for s in sessions if s["span"]])
+    if not gains.size:
+        raise ValueError('no session has two different weights, the gain cannot be fitted')
+    if threshold is not None and gains.size >= 3:
+        median = np.median(gains)
+        scale = max(MAD_TO_STDEV * np.median(np.abs(gains - median)), 1e-9 * abs(median))
+        for s in sessions:
+            if s["span"]:
+                s["z"] = abs(s["gain"] - median) / scale
+                s["rejected"] = bool(s["z"] > threshold)
+
+    kept = [s for s in sessions if not s["rejected"]]
+    gain, sxx = _within(kept)
+    residuals = []
+    weighted_sum = 0.0
+    for s in kept:
+        s["offset"] = s["r_mean"] - gain * s["w_mean"]
+        errors = s["r"] - s["offset"] - gain * s["w"]
+        weighted_sum += np.sum(s["v"] * errors * errors)
+        residuals += [(s["session"], float(w), float(e / gain)) for w, e in zip(s["w"], errors)]
+    # a single session of two weights fits exactly and leaves no degrees of freedom
+    dof = sum(len(s["w"]) for s in kept) - len(kept) - 1
+    gain_se = math.sqrt(weighted_sum / dof / sxx) if dof > 0 else None
+
+    offsets = np.array([s["offset"] for s in kept])
+    ratio = 1 / gain
+    full_scale = max(float(np.max(np.abs(s["w"]))) for s in kept)
+    multi = [r for s in kept if len(np.unique(s["w"])) >= 3 for r in residuals if r[0] == s["session"]]
+    return {
+        "offset": int(round(offsets.mean() if offset == "mean" else offsets[-1])),
+        "ratio": float(ratio),
+        "gain": float(gain),
+        "gain_se": gain_se,
+        "full_scale": full_scale,
+        "max_residual": max(abs(r[2]) for r in residuals),
+        "linearity_error": (max(abs(r[2]) for r in multi) / full_scale * 100) if multi and full_scale else None,
+        "zero_drift": float(np.std(offsets, ddof=1) * abs(ratio)) if len(offsets) > 1 else 0.0,
+        "offset_spread": int(round(np.ptp(offsets))),
+        "residuals": residuals,
+        "sessions": [dict({key: s.get(key) for key in ("session", "gain", "offset", "z", "rejected")},
+                          points=len(s["w"])) for s in sessions],
+        "rejected": [s["session"] for s in sessions if s["rejected"]],
+    }
+
+
+def report(result):
+    """
+    report prints the fit, the sessions and the residuals.
+    """
+    print("\n--- NAU7802 calibration ---")
+    for s in result["sessions"]:
+        gain = f"{s['gain']:.4f} counts/g" if s["gain"] is not None else "tare only"
+        status = "REJECTED" if s["rejected"] else "kept"
+        z = f", z {s['z']:.1f}" if s.get("z") is not None else ""
+        print(f"- session {s['session']}: {s['points']} points, {gain}{z}, {status}")
+    gain_se = f" +/- {result['gain_se']:.4f}" if result["gain_se"] is not None else ""
+    print(f"Gain: {result['gain']:.4f}{gain_se} counts per gram")
+    print(f"Offset: {result['offset']}")
+    print(f"Ratio: {result['ratio']}")
+    print(f"Zero drift between sessions: {result['zero_drift']:.3f} g "
+          f"(offsets {result['offset_spread']} counts apart, "
+          f"{result['offset_spread'] * abs(result['ratio']):.3f} g)")
+    print(f"Largest residual: {result['max_residual']:.3f} g")
+    if result["linearity_error"] is not None:
+        print(f"Linearity error: {result['linearity_error']:.4f} % of {result['full_scale']:g} g")
+    else:
+        print("Linearity error: needs a session with three or more weights")
+
+
+def save_config(result, path=CONFIG_FILE):
+    """
+    save_config writes the fit as a config DRIP loads (calibration_file).
+    """
+    config = {
+        "nau7802_offset": result["offset"],
+        "nau7802_ratio": result["ratio"],
+        "fitted": datetime.now().isoformat(timespec='seconds'),
+        "gain_se": result["gain_se"],
+        "linearity_error": result["linearity_error"],
+        "zero_drift": result["zero_drift"],
+        "offset_spread": result["offset_spread"],
+        "sessions": sum(1 for s in result["sessions"] if not s["rejected"]),
+        "rejected": result["rejected"],
+    }
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def load_config(path=CONFIG_FILE):
+    """
+    load_config reads a config written by save_config.
+
+    Returns: dict of DRIP arguments (nau7802_offset, nau7802_ratio)
+    """
+    with open(path) as f:
+        config = json.load(f)
+    return {key: config[key] for key in ("nau7802_offset", "nau7802_ratio")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fits the NAU7802 offset and ratio from calibration sessions.")
+    parser.add_argument("files", type=str, nargs="*", default=[POINTS_FILE],
+                        help=f"Points files or old nau_calibrate.csv files, defaults to {POINTS_FILE}")
+    parser.add_argument("-o", "--output", dest="output", type=str, default=None,
+                        help=f"Write the config DRIP loads, e.g. {CONFIG_FILE}")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, default=OUTLIER_THRESHOLD,
+                        help=f"Robust z score that rejects a session, defaults to {OUTLIER_THRESHOLD}")
+    parser.add_argument("--offset", dest="offset", choices=("last", "mean"), default="last",
+                        help="Offset of the last kept session or the mean of the kept sessions, defaults to last")
+    args = parser.parse_args()
+
+    points = [point for path in args.files for point in read_points(path)]
+    result = fit(points, threshold=args.threshold, offset=args.offset)
+    report(result)
+    if args.output:
+        save_config(result, args.output)
+        print(f"\n--- saved to {args.output}")
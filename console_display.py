@@ -0,0 +1,152 @@
+"""
+This file holds ConsoleDisplay class
+"""
+import collections
+import shutil
+import sys
+import threading
+import time
+
+CLEAR = "\033[2J\033[;H"  # clear the screen and move to the top left corner
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def compact(values, width=80):
+    """
+    compact formats values as "Name value" pairs, as many per line as fit in
+    width. Text columns ending in _Time are left out.
+    """
+    lines, line = [], ""
+    for key, value in values.items():
+        if key.endswith('_Time') or key == 'Time':
+            continue
+        item = f"{key} {_format_value(value)}"
+        if line and len(line) + 2 + len(item) > width:
+            lines.append(line)
+            line = item
+        else:
+            line = f"{line}  {item}" if line else item
+    if line:
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class ConsoleDisplay:
+    """
+    ConsoleDisplay shows the latest values of an acquisition loop without
+    slowing it down. update() only keeps a reference to the values; a
+    background thread redraws a compact status view at most `refresh` times
+    per second, in one write per frame. Values that were replaced between
+    two frames are never printed, so the loop does not depend on how fast
+    the console (serial line, SSH session) is.
+    """
+
+    def __init__(self, refresh=1.0, title="D.R.I.P", formatter=None, stream=None, clear=None, messages=5):
+        """
+        Init a new instance of ConsoleDisplay and start its thread.
+
+        Args:
+            refresh(float): Optional, by default 1. Most frames per second.
+            title(str): Optional, by default "D.R.I.P". First word of the header.
+            formatter(function): Optional, by default compact(). Turns the
+                values into the body of a frame.
+            stream(file): Optional, by default sys.stdout.
+            clear(bool): Optional, by default True if stream is a terminal.
+                Redraw in place instead of appending frames.
+            messages(int): Optional, by default 5. Status messages kept
+                below the values.
+        """
+        if refresh <= 0:
+            raise ValueError('refresh has to be greater than 0. Received: {}'.format(refresh))
+        self.refresh = refresh
+        self.title = title
+        self.stream = stream or sys.stdout
+        self.clear = self.stream.isatty() if clear is None else clear
+        self.formatter = formatter or (lambda values: compact(values, shutil.get_terminal_size().columns))
+        self.frames = 0
+        self.updates = 0
+        self._values = None
+        self._status = ""
+        self._messages = collections.deque(maxlen=messages)
+        self._changed = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="drip-display", daemon=True)
+        self._thread.start()
+
+    def update(self, values, status=""):
+        """
+        update replaces the values shown. Cheap, called from the acquisition loop.
+
+        Args:
+            values(dict): the latest values, e.g. a row. Not copied, do not
+                change it afterwards.
+            status(str): Optional. Shown in the header, e.g. the time of the row.
+        """
+        self._values = values
+        self._status = status
+        self.updates += 1
+        self._changed.set()
+
+    def message(self, text):
+        """
+        message adds a status line (overrun, failed read, ...) below the values.
+        """
+        self._messages.append(f"{time.strftime('%H:%M:%S')} {text.strip().strip('-').strip()}")
+        self._changed.set()
+
+    def render(self):
+        """
+        render returns the current frame.
+        """
+        header = f"{self.title} | {self.updates} updates"
+        if self._status:
+            header += f" | {self._status}"
+        parts = [header]
+        if self._values is not None:
+            parts.append(self.formatter(self._values))
+        if self._messages:
+            parts.append("\n".join(self._messages))
+        return "\n".join(parts) + "\n"
+
+    def draw(self):
+        """
+        draw writes the current frame to the stream.
+        """
+        frame = self.render()
+        self.stream.write((CLEAR if self.clear else "\n") + frame)
+        self.stream.flush()
+        self.frames += 1
+
+    def _draw_safely(self):
+        try:
+            self.draw()
+        except (OSError, ValueError):
+            pass  # a closed or broken console must not stop the acquisition
+
+    def _run(self):
+        interval = 1 / self.refresh
+        while not self._closed.is_set():
+            self._changed.wait()
+            if self._closed.is_set():
+                break
+            self._changed.clear()
+            started = time.monotonic()
+            self._draw_safely()
+            # the cap on the frame rate: updates meanwhile are shown by the next frame
+            self._closed.wait(max(interval - (time.monotonic() - started), 0))
+
+    def close(self):
+        """
+        close stops the thread and draws the last frame. Calling it again does nothing.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._changed.set()
+        self._thread.join()
+        self._draw_safely()
@@ -0,0 +1,145 @@
+"""
+This file holds DeadlineReader class and the quality flags of a reading.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+QUALITY_OK = 0  # read in time for this row
+QUALITY_STALE = 1  # the read missed its deadline, the last good value is held
+QUALITY_ERROR = 2  # the read failed and is retried, the last good value is held
+QUALITY_MISSING = 3  # no read has succeeded yet
+
+
+class DeadlineReader:
+    """
+    DeadlineReader reads one sensor on its own worker thread and waits at
+    most deadline seconds for each read. A read that misses its deadline
+    keeps running in the background and its value is used once it arrives;
+    no new read starts before it ends, so a stuck device ties up only its
+    own thread. A failed read is retried in the background every
+    retry_delay seconds until it succeeds. Meanwhile the last good value is
+    held with a quality flag.
+    """
+
+    def __init__(self, name, read, deadline, retry_delay=1.0, clock=time.monotonic, report=print):
+        """
+        Init a new instance of DeadlineReader
+
+        Args:
+            name(str): sensor name, used for the thread name
+            read(function): takes one reading, returns (values, timestamp)
+            deadline(float): seconds a row waits for a read
+            retry_delay(float): Optional, by default 1 s. Wait before a
+                failed read is tried again.
+            clock(function): Optional, by default time.monotonic.
+            report(function): Optional, by default print. Gets the message
+                of a failed read.
+        """
+        if deadline <= 0:
+            raise ValueError('deadline has to be greater than 0. Received: {}'.format(deadline))
+        self.name = name
+        self.deadline = deadline
+        self.retry_delay = retry_delay
+        self._read = read
+        self._clock = clock
+        self._report = report
+        self._future = None
+        self._started = None
+        self._closed = threading.Event()
+        self.last = None  # (values, timestamp) of the last good read
+        self.error = None  # error of the last attempt, None after a good read
+        self.misses = 0  # rows that held the value because the read was late
+        self.errors = 0  # failed attempts, retries included
+        self._requests = queue.SimpleQueue()
+        # a daemon thread: a read stuck in the driver must not keep the process from exiting,
+        # which the (non-daemon) workers of a ThreadPoolExecutor would
+        self._thread = threading.Thread(target=self._serve, name=f"drip-{name}", daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        # the worker thread: runs the reads start() asks for until close()
+        while True:
+            future = self._requests.get()
+            if future is None:
+                return
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._run())
+                except BaseException as error:
+                    future.set_exception(error)
+
+    def _run(self):
+        # runs on the worker thread: read, and retry until the read succeeds
+        while not self._closed.is_set():
+            try:
+                result = self._read()
+            except Exception as error:
+                if self._closed.is_set():
+                    break  # failed after close(), the run that reports it is over
+                self.errors += 1
+                if self.error is None or repr(error) != repr(self.error):
+                    self._report(f"\n--- {self.name} read failed: {error!r}, retrying in the background ---")
+                self.error = error
+                self._closed.wait(self.retry_delay)
+            else:
+                self.error = None
+                return result
+        return None
+
+    def start(self):
+        """
+        start begins a read, unless the previous one is still running. The
+        value of a late read that has finished since is kept first.
+        """
+        if self._future is not None and self._future.done():
+            result = self._future.result()
+            if result is not None:
+                self.last = result
+            self._future = None
+        if self._future is None:
+            self._started = self._clock()
+            self._future = Future()
+            self._requests.put(self._future)
+
+    def result(self):
+        """
+        result waits for the running read until its deadline.
+
+        Returns: (values, timestamp, quality) with the values and time of the
+            last good read (None, None if there is none) and a QUALITY_ flag
+        """
+        if self._future is not None:
+            remaining = self._started + self.deadline - self._clock()
+            try:
+                result = self._future.result(timeout=max(remaining, 0))
+            except TimeoutError:
+                if self.error is None:
+                    self.misses += 1
+            else:
+                self._future = None
+                if result is not None:
+                    self.last = result
+                    return (*result, QUALITY_OK)
+        if self.last is None:
+            return None, None, QUALITY_MISSING
+        return (*self.last, QUALITY_ERROR if self.error is not None else QUALITY_STALE)
+
+    def read(self):
+        """
+        read starts a read and waits for it until its deadline, see result().
+        """
+        self.start()
+        return self.result()
+
+    def close(self):
+        """
+        close stops the retries and the worker thread. A read that is stuck
+        in the driver is not waited for, neither here nor when the process
+        exits, and reports nothing when it fails later.
+        """
+        self._closed.set()
+        if self._future is not None:
+            self._future.cancel()  # only cancels a read that has not started
+        self._requests.put(None)
@@ -1,227 +1,606 @@
-import RPi.GPIO as GPIO
-from hx711 import HX711
-from adafruit_extended_bus import ExtendedI2C as I2C
-import adafruit_si7021
-import modbus_tk.defines as flags
-from modbus_tk import modbus_rtu
-from serial import Serial
+# the sensor drivers (RPi.GPIO, hx711, board, cedargrove_nau7802, adafruit_si7021,
+# modbus_tk) and numpy are imported by the sensors and outputs that need them,
+# so a sensor that is not used costs no import time
 import time
-import csv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from cedargrove_nau7802 import NAU7802
-import board
+from deadline_reader import DeadlineReader, QUALITY_OK, QUALITY_STALE
+from scheduler import RateScheduler
+from sensors import DEFAULT_SENSORS, SENSORS, Sensor
+from stream_writer import StreamWriter
+import rollup
+from rollup import RollupEngine
+from efficiency import EfficiencyEstimator
+from metrics import Metrics, StatsFile, serve
+from temperature_compensation import TemperatureCompensation, TemperatureCoefficientEstimator, idle
 
 
 class DRIP:
-    def __init__(self, drip_id, si7021_i2c_bus, pzem_interface_path = "/dev/ttyS0", hx711_pins = (3, 2), hx711_readings = 45, hx711_offset = -4143700, hx711_ratio = 105.521408839779, nau7802_offset = "-309977", nau7802_ratio = "0.0039372056834247006", nau7802_readings = 15, nau7802_i2c_bus = "1", file_export = 'data.csv'):
+    def __init__(self, drip_id, si7021_i2c_bus, pzem_interface_path = "/dev/ttyS0", hx711_pins = (3, 2), hx711_backend = "rpi", hx711_readings = 45, hx711_offset = -4143700, hx711_ratio = 105.521408839779, nau7802_offset = "-309977", nau7802_ratio = "0.0039372056834247006", nau7802_readings = 15, nau7802_i2c_bus = "1", pzem_slaves = (1,), file_export = 'data.csv', flush_interval = 5.0, flush_rows = 10, fsync = False, rotate_bytes = None, rotate_seconds = None, log_format = "csv", rollups = None, efficiency_window = None, efficiency_energy = "power", adaptive_se = None, adaptive_budget = 1.0, calibration_file = None, temperature_compensation = False, temperature_coefficients = (0.0, 0.0), temperature_reference = 25.0, temperature_learning = False, self_test = "quick", parallel_init = True, sensors = DEFAULT_SENSORS, metrics_port = None, metrics_file = None, metrics_interval = 10.0, live_buffer = None, live_capacity = 4096):
         self.drip_id = drip_id
         self.si7021_i2c_bus = si7021_i2c_bus
         self.pzem_interface_path = pzem_interface_path
         self.hx711_out = hx711_pins[0]
         self.hx711_sck = hx711_pins[1]
+        self.hx711_backend = hx711_backend
         self.hx711_readings = hx711_readings
         self.hx711_offset = hx711_offset
         self.hx711_ratio = hx711_ratio
         self.nau7802_offset = int(nau7802_offset)
         self.nau7802_ratio = float(nau7802_ratio)
+        self.calibration_file = calibration_file
+        if calibration_file:
+            # a fit from calibration.py replaces nau7802_offset and nau7802_ratio
+            import calibration
+            fitted = calibration.load_config(calibration_file)
+            self.nau7802_offset = int(fitted["nau7802_offset"])
+            self.nau7802_ratio = float(fitted["nau7802_ratio"])
         self.nau7802_readings = nau7802_readings
         self.nau7802_i2c_bus = nau7802_i2c_bus
+        self.pzem_slaves = tuple(pzem_slaves)
         self.file_export = file_export
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        if log_format not in ("csv", "binary", "both"):
+            raise ValueError(f"log_format has to be 'csv', 'binary' or 'both'. Received: {log_format}")
+        self.log_format = log_format
+        self.rollups = tuple(rollups) if rollups else ()  # window lengths in seconds
+        self.efficiency_window = efficiency_window
+        self.efficiency_energy = efficiency_energy
+        # name of the shared memory ring the rows are published to for live readers
+        self.live_buffer = live_buffer
+        self.live_capacity = live_capacity
+        # target standard error in grams of a weight reading; None averages a fixed number of readings
+        self.adaptive_se = adaptive_se
+        self.adaptive_budget = adaptive_budget
+        # temperature compensation of the weight (zero g/C, span per C), the raw
+        # weight is kept as Grams_Raw; learning fits the coefficients while idle
+        self.compensation = None
+        self.temperature_estimator = None
+        if temperature_compensation:
+            self.compensation = TemperatureCompensation(*temperature_coefficients, reference=temperature_reference)
+            if temperature_learning:
+                self.temperature_estimator = TemperatureCoefficientEstimator()
+        self.last_temperature = None  # latest Si7021 temperature, used by the compensation
+        self._learned_stamp = None
+        self.schedule_stats = {}
+        if self_test not in ("full", "quick", None):
+            raise ValueError(f"self_test has to be 'full', 'quick' or None. Received: {self_test}")
+        self.self_test = self_test
+        self.parallel_init = parallel_init
+        self.startup_times = {}  # phase -> seconds, see startup_report()
+        startup = time.perf_counter()
         
-        # Sensor object initializations
-        self.hx711_sensor = None
-        self.nau7802_sensor = None
-        self.si7021_sensor = None
-        self.pzem_sensor = None
+        # only the listed sensors are built, imported, polled and written:
+        # names from sensors.SENSORS or Sensor instances
+        self.sensors = {}  # sensor name -> Sensor, in column order
+        for sensor in sensors:
+            if not isinstance(sensor, Sensor):
+                if sensor not in SENSORS:
+                    raise ValueError(f"sensors has to list Sensor instances or one of {', '.join(SENSORS)}. Received: {sensor}")
+                sensor = SENSORS[sensor](self)
+            self.sensors[sensor.name] = sensor
+        if not self.sensors:
+            raise ValueError(f"sensors has to list at least one sensor. Received: {sensors}")
+        fields = [field for sensor in self.sensors.values() for field in sensor.fields()]
+        repeated = sorted({field for field in fields if fields.count(field) > 1})
+        if repeated:
+            # e.g. NAU7802 and HX711 both write Grams
+            raise ValueError(f"sensors have to write different columns. Received: {', '.join(repeated)} more than once")
+        # the sensor that writes Grams, its read time is the time of the weight
+        self.weight_sensor = next((name for name, sensor in self.sensors.items() if 'Grams' in sensor.fields()), None)
+
+        # Every sensor sits on its own bus (I2C 1, I2C si7021_i2c_bus and the UART),
+        # so they can be read in parallel without sharing a bus
+        self.sensor_buses = [(name, sensor.read) for name, sensor in self.sensors.items()]
+
+        # read latencies and the driver counters are always recorded, they cost a
+        # few additions per read; metrics_port and metrics_file export them
+        self.metrics = Metrics(labels={"drip_id": drip_id})
+        self.metrics.add_collector(self._sensor_counters)
+        self._latency = {name: self.metrics.histogram("read_seconds", sensor=name) for name in self.sensors}
+        self._iteration_latency = self.metrics.histogram("iteration_seconds")
+        self.metrics_server = None
+        self.stats_file = None
+        self.display = None  # ConsoleDisplay of the current run, see run_all(display=...)
+        self._efficiency_printed = None  # time of the last printed efficiency
 
         print("Welcome!")
         print("Your D.R.I.P (Dehumidifier Response & Integration Package) unit is initialized")
         print(" - DRIP ID:", self.drip_id)
-        print(" - Si7021 I2C bus number:", self.si7021_i2c_bus)
-        print(" - PZEM-004T interface path:", self.pzem_interface_path)
-        # print(f" - HX711 data pin: {self.hx711_out}, HX711 sck pin: {self.hx711_sck}\n")
-        print(f" - NAU7802 I2C: {self.nau7802_i2c_bus} \n")
-        print("-------- starting sensor initialization and resets -------- \n")
-        # self.init_hx711()
-        self.init_nau7802()
-        self.init_si7021()
-        self.init_pzem()
+        print(" - Sensors:", ", ".join(self.sensors))
+        if self.calibration_file:
+            print(" - NAU7802 calibration:", self.calibration_file)
+        print("\n-------- starting sensor initialization and resets -------- \n")
+        with self._timed("init"):
+            try:
+                if parallel_init:
+                    # the sensors are on independent buses, so their (slow) resets and
+                    # calibrations overlap; the first error is raised once all have ended
+                    with ThreadPoolExecutor(max_workers=len(self.sensors), thread_name_prefix="drip-init") as executor:
+                        futures = [executor.submit(self._init_sensor, sensor) for sensor in self.sensors.values()]
+                    for future in futures:
+                        future.result()
+                else:
+                    for sensor in self.sensors.values():
+                        self._init_sensor(sensor)
+            except BaseException:
+                # release the devices the other sensors opened (ports, pins), then raise
+                for sensor in self.sensors.values():
+                    try:
+                        sensor.close()
+                    except Exception:
+                        pass
+                raise
         print("---- all sensors have been initialized and all sensor objects have been created ---- \n")
-       
-        print("-------- running preliminary test on all sensors --------") 
-        # print("--- hx711 ---")
-        # self.run_hx711(print_out = True)
-        print("--- nau7802 ---")
-        self.run_nau7802(print_out = True)
-        print("\n\n--- si702 ---")
-        self.run_si7021(print_out = True)
-        print("\n--- pzem ---\n")
-        self.run_pzem(print_out = True)
-        print("\n---- all sensors have passed their initial test ---- \n")
-
-    def init_hx711(self):
-        print("--- Initializing HX711 ---")
-        GPIO.setmode(GPIO.BCM) 
-        self.hx711_sensor = HX711(dout_pin=self.hx711_out, pd_sck_pin=self.hx711_sck, gain_channel_A=64, select_channel='A')
-
-        err = self.hx711_sensor.reset()
-        while err:
-            print('not ready')
-            err = self.hx711_sensor.reset()
-        print('Ready to use')
-
-        self.hx711_sensor.set_gain_A(gain=64)
-        self.hx711_sensor.select_channel(channel='A')
-        self.hx711_sensor.set_offset(offset=self.hx711_offset, channel='A', gain_A=64)
-        self.hx711_sensor.set_scale_ratio(self.hx711_ratio)
-
-        print(" - HX711 sensor has been initialized with OFFSETTT and RATIO")
-
-    def init_nau7802(self):
-        print("--- Initializing NAU7802 ---")
-        # Instantiate 24-bit load sensor ADC; two channels, default gain of 128
-        self.nau7802_sensor = NAU7802(board.I2C(), address=0x2A, active_channels=1)
-        print(self.nau7802_sensor.calibrate("INTERNAL"))
-        enabled = self.nau7802_sensor.enable(True)
-        self.nau7802_sensor.channel = 1
-        print(" - NAU7802 sensor has been initialized ")
-
-    def init_si7021(self):
-        print("--- Initializing Si7021 ---")
-        self.si7021_sensor = adafruit_si7021.SI7021(I2C(self.si7021_i2c_bus))
-        print(" - Si7021 sensor has been initialized with I2C bus", self.si7021_i2c_bus)
-
-    def init_pzem(self, threshold = 50000):
-        print("--- Initializing PZEM-004T ---")
-        serial_int = Serial(
-            port=self.pzem_interface_path,
-            baudrate=9_600,
-            bytesize=8,
-            parity="N",
-            stopbits=1,
-            xonxoff=False,
-            write_timeout=2
-        )
-        self.pzem_sensor = modbus_rtu.RtuMaster(serial_int)
-        self.pzem_sensor.set_timeout(2.0)
-        self.pzem_sensor.execute(1, flags.WRITE_SINGLE_REGISTER, 1, output_value=threshold)
-        print(" - PZEM-004T sensor has been initialized")
 
-    def run_nau7802(self, print_out = False):
-        
-        sample_sum = 0
-        for _ in range(self.nau7802_readings):
-            while not self.nau7802_sensor.available():
-                pass
-            sample_sum += self.nau7802_sensor.read()
-        raw = int(sample_sum / self.nau7802_readings)
+        with self._timed("self-test"):
+            if self_test == "full":
+                print("-------- running preliminary test on all sensors --------")
+                for name, sensor in self.sensors.items():
+                    print(f"\n--- {name} ---")
+                    sensor.read(print_out = True)
+                    print()
+                print("\n---- all sensors have passed their initial test ---- \n")
+            elif self_test == "quick":
+                self.health_check()
+        self.startup_times["total"] = time.perf_counter() - startup
+        self.startup_report()
+
+        if metrics_port is not None:
+            self.metrics_server = serve(self.metrics, metrics_port)
+            print(f"--- metrics on http://127.0.0.1:{metrics_port}/metrics")
+        if metrics_file is not None:
+            self.stats_file = StatsFile(self.metrics, metrics_file, metrics_interval)
+            print(f"--- metrics written to {metrics_file} every {metrics_interval:g} s")
+
+    @contextmanager
+    def _timed(self, phase):
+        # adds the seconds the block took to startup_times[phase]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_times[phase] = self.startup_times.get(phase, 0.0) + time.perf_counter() - start
+
+    def _message(self, text):
+        # status lines of a run go to its display, if it has one
+        if self.display is not None:
+            self.display.message(text)
+        else:
+            print(text)
 
-        grams = (raw - self.nau7802_offset) * self.nau7802_ratio
+    def _open_display(self, refresh):
+        if refresh:
+            from console_display import ConsoleDisplay
+            self.display = ConsoleDisplay(refresh=refresh, title=f"D.R.I.P {self.drip_id}")
 
-        output = {"Grams": grams}
+    def _close_display(self):
+        if self.display is not None:
+            self.display.close()
+            self.display = None
 
-        if print_out:
-            print(f"\nGrams: {grams:.2f} g", end = "")
-        return output
+    def _sensor_counters(self):
+        # collector of the metrics: the totals every sensor's driver keeps
+        return [(name, {"sensor": sensor_name}, value)
+                for sensor_name, sensor in self.sensors.items()
+                for name, value in sensor.counters().items()]
+
+    def _init_sensor(self, sensor):
+        # the driver import is part of the init of its sensor
+        with self._timed(f"{sensor.name} init"):
+            sensor.init()
+
+    def health_check(self):
+        """
+        Quick self-test: one conversion or reading of every sensor, all at once,
+        without printing the values. Raises the first error.
+        """
+        with ThreadPoolExecutor(max_workers=len(self.sensors), thread_name_prefix="drip-check") as executor:
+            futures = [(name, executor.submit(self._timed_read, sensor.check, name)) for name, sensor in self.sensors.items()]
+            for name, future in futures:
+                values, _ = future.result()
+                print(f" - {name} ok")
+        print("---- all sensors have passed the health check ---- \n")
+
+    def startup_report(self):
+        """
+        Prints how long each startup phase took: the init of every sensor
+        (with its driver import), all sensor inits together (parallel), the self-test and the total.
+        """
+        print("---- startup took %.2f s ----" % self.startup_times["total"])
+        for phase, seconds in self.startup_times.items():
+            if phase != "total":
+                print(f" - {phase}: {seconds * 1000:.0f} ms")
+        print()
+
+    def run_nau7802(self, print_out = False):
+        return self.sensors["NAU7802"].read(print_out)
 
     def run_hx711(self, print_out = False):
-        data = self.hx711_sensor.get_weight_mean(self.hx711_readings)
-        
-        output = {"Grams": data}
+        return self.sensors["HX711"].read(print_out)
 
-        if print_out:
-            print("\nGrams: %0.2f g" % data, end = "")
-        return output
-    
-    def run_si7021(self, print_out = False,):
+    def run_si7021(self, print_out = False):
+        return self.sensors["Si7021"].read(print_out)
 
-        output = {
-            "Temperature": self.si7021_sensor.temperature,
-            "Humidity": self.si7021_sensor.relative_humidity
-        }
-        
-        if print_out:
-            print("\nTemperature: %0.1f C" % self.si7021_sensor.temperature)
-            print("Humidity: %0.1f %%" % self.si7021_sensor.relative_humidity)
-        
-        return output
+    def run_pzem(self, print_out = False):
+        return self.sensors["PZEM"].read(print_out)
 
-    def run_pzem(self, print_out = False, threshold=50_000):
+    def _timed_read(self, read, name = None):
+        # midpoint of the read is the best estimate of when the sample was taken;
+        # with a sensor name the duration goes to its latency histogram
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            values = read()
+        except Exception:
+            if name is not None:
+                self.metrics.count("read_errors_total", sensor=name)
+            raise
+        if name is not None:
+            self._latency[name].observe(time.perf_counter() - started)
+        end = time.time()
+        return values, (start + end) / 2
 
-        raw_data = self.pzem_sensor.execute(1, flags.READ_INPUT_REGISTERS, 0, 10)
+    def read_concurrent(self, executor, sensors):
+        """
+        Reads the given sensors at once, one thread per bus, so an iteration takes
+        as long as the slowest sensor instead of the sum of all of them.
+        Returns a dict of sensor name -> (values, timestamp of the read).
+        """
+        futures = [
+            (name, executor.submit(self._timed_read, read, name))
+            for name, read in sensors
+        ]
+        return {name: future.result() for name, future in futures}
 
-        clean_data = (
-            raw_data[0] / 10,
-            (raw_data[1] + (raw_data[2] << 16)) / 1_000,
-            (raw_data[3] + (raw_data[4] << 16)) / 10,
-            raw_data[5] + (raw_data[6] << 16),
-            raw_data[7] / 10,
-            raw_data[8] / 100,
-            0 if raw_data[9] == 0 else 1
+    def open_writers(self, fields, path = None, **overrides):
+        """
+        Opens the outputs of a run: the CSV file_export, the binary log next to
+        it (file_export with the .drip extension) or both, as set by log_format.
+        path replaces file_export, overrides replace writer settings.
+        """
+        path = path or self.file_export
+        options = dict(
+            flush_interval=self.flush_interval,
+            flush_rows=self.flush_rows,
+            fsync=self.fsync,
+            rotate_bytes=self.rotate_bytes,
+            rotate_seconds=self.rotate_seconds
         )
-        output = {
-            "Voltage": clean_data[0],
-            "Current": clean_data[1],
-            "Power": clean_data[2],
-            "Energy": clean_data[3],
-            "Frequency": clean_data[4],
-            "Power_Factor": clean_data[5],
-            "Threshold": threshold,
-            "Alarm_Status": clean_data[6]
-        }
+        options.update(overrides)
+        writers = []
+        if self.log_format in ("csv", "both"):
+            writers.append(StreamWriter(path, fields, **options))
+        if self.log_format in ("binary", "both"):
+            # imported here so CSV users do not need numpy
+            import binlog
+            from binlog import BinaryStreamWriter
+            writers.append(BinaryStreamWriter(binlog.binary_path(path), fields, **options))
+        return writers
+
+    def open_live(self, fields):
+        """
+        Opens the shared memory ring live_buffer, which keeps the last
+        live_capacity rows of the run for other processes (shared_ring.py).
+        Returns [] if live_buffer is not set.
+        """
+        if not self.live_buffer:
+            return []
+        from shared_ring import SharedRingWriter
+        return [SharedRingWriter(self.live_buffer, fields, capacity=self.live_capacity)]
+
+    def open_rollups(self, fields):
+        """
+        Opens the rollup outputs, one per window length in rollups, named after
+        file_export (data.csv -> data_1min.csv, data_15min.csv, data_1h.csv).
+        Every closed window is committed right away.
+        """
+        return RollupEngine(
+            fields,
+            lambda seconds, rollup_fields: self.open_writers(
+                rollup_fields, rollup.rollup_path(self.file_export, seconds), flush_rows=1),
+            windows=self.rollups
+        )
+
+    def _run_fields(self, timestamps, guarded = ()):
+        """
+        Columns of a run and the efficiency estimator, if efficiency_window is set.
+        timestamps adds the read time of every sensor ({name}_Time), guarded the
+        age and quality of the values of the sensors read with a deadline.
+        """
+        fields = ['Time', *(field for sensor in self.sensors.values() for field in sensor.fields())]
+        if timestamps:
+            fields += [f"{name}_Time" for name, _ in self.sensor_buses]
+        for name in guarded:
+            fields += [f"{name}_Age", f"{name}_Quality"]
+        efficiency = None
+        if self.efficiency_window:
+            efficiency = EfficiencyEstimator(window=self.efficiency_window, energy=self.efficiency_energy)
+            fields += ['Water_Rate', 'Efficiency', 'Efficiency_Low', 'Efficiency_High']
+        return fields, efficiency
 
-        if print_out:
-            print("Voltage: %.1f V" % clean_data[0])
-            print("Current: %.3f A" % clean_data[1])
-            print("Power: %.1f W" % clean_data[2])
-            print("Energy: %d Wh" % clean_data[3])
-            print("Frequency: %.1f Hz" % clean_data[4])
-            print("Power Factor: %.2f" % clean_data[5])
-            print("Threshold: %d" % threshold)
-            print("Alarm Status:", "ON" if clean_data[6] else "OFF")
+    def _build_row(self, latest, now, efficiency = None, quality = None):
+        """
+        Builds the row of time now from the latest reading of every sensor
+        (sensor name -> (values, timestamp)), with the efficiency estimate.
+        quality (sensor name -> QUALITY_ flag) adds the flag and the age in
+        seconds of the value of those sensors.
+        """
+        row = {'Time': datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')}
+        for name, (values, stamp) in latest.items():
+            row.update(values)
+            row[f"{name}_Time"] = datetime.fromtimestamp(stamp).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        for name, flag in (quality or {}).items():
+            row[f"{name}_Quality"] = flag
+            if name in latest:
+                row[f"{name}_Age"] = round(now - latest[name][1], 3)
+        if self.temperature_estimator is not None:
+            self._learn_temperature(row, latest)
+        if efficiency is not None:
+            # the fit uses the time of the weight reading, a held weight is skipped
+            estimate = efficiency.add(latest.get(self.weight_sensor, (None, now))[1], row.get('Grams'),
+                                      power=row.get('Power'), energy=row.get('Energy'))
+            if estimate is not None:
+                row.update({key: estimate[key] for key in ('Water_Rate', 'Efficiency', 'Efficiency_Low', 'Efficiency_High')})
+                # in the rows (and the display) every time, printed once per window
+                if (estimate['Efficiency'] is not None and self.display is None
+                        and (self._efficiency_printed is None or now - self._efficiency_printed >= efficiency.window)):
+                    self._efficiency_printed = now
+                    print(f"Efficiency: {estimate['Efficiency']:.3f} L/kWh "
+                          f"({estimate['Efficiency_Low']:.3f} - {estimate['Efficiency_High']:.3f})")
+        return row
 
-        return output
+    def _learn_temperature(self, row, latest):
+        # every weight reading once, a held weight is skipped
+        stamp = latest.get(self.weight_sensor, (None, None))[1]
+        if stamp is None or stamp == self._learned_stamp:
+            return
+        self._learned_stamp = stamp
+        # the tank only keeps its weight while the dehumidifier is off
+        estimator = self.temperature_estimator
+        if estimator.add(row.get('Temperature'), row.get('Grams_Raw'), constant=idle(row.get('Power'))):
+            zero_tc, span_tc = self.compensation.coefficients = estimator.coefficients()
+            self._message(f"--- temperature coefficients from {estimator.periods} idle period(s): "
+                          f"zero {zero_tc:.4f} g/C, span {span_tc * 1e6:.1f} ppm/C")
 
-    def run_all(self, iterations = 50, infinite = False, sleep = 2):
+    def _emit_row(self, row, now, writers, rollups, on_row):
+        for writer in writers:
+            writer.write(row)
+        if rollups is not None:
+            rollups.add(row, now)
+        if on_row is not None:
+            on_row(row)
+        if self.display is not None:
+            self.display.update(row, row['Time'])
+
+    def _close_run(self, writers, rollups, scheduler):
+        for writer in writers:
+            writer.close()
+            print(f"--- exported {writer.rows_written} rows to {', '.join(writer.paths)}")
+        if rollups is not None:
+            rollups.close()
+            print(f"--- rollups in {', '.join(rollups.paths)}")
+        if self.compensation is not None:
+            zero_tc, span_tc = self.compensation.coefficients
+            print(f"--- temperature compensation: zero {zero_tc:.4f} g/C, span {span_tc * 1e6:.1f} ppm/C")
+        self.schedule_stats = scheduler.stats()
+        for name, stats in self.schedule_stats.items():
+            print(f"--- {name}: {stats['runs']} reads, {stats['overruns']} overruns, "
+                  f"jitter mean {stats['jitter_mean'] * 1000:.1f} ms, "
+                  f"std {stats['jitter_std'] * 1000:.1f} ms, max {stats['jitter_max'] * 1000:.1f} ms")
+
+    def run_all(self, iterations = 50, infinite = False, sleep = 2, concurrent = False, rates = None, on_row = None, deadlines = None, retry_delay = 1.0, display = None):
         iteration = 1
         i = 1
-        records = []
-        fields = ['Time', 'Grams', 'Temperature', 'Humidity', 'Voltage', 'Current', 'Power', 'Energy', 'Frequency', 'Power_Factor', 'Threshold', 'Alarm_Status']
+        # display (redraws per second) replaces the prints of every iteration with a
+        # status view drawn by its own thread, so a slow console does not slow the loop
+        verbose = not display
+        # sensors with a deadline are read on their own thread; a late or failing
+        # read holds the last good value (with its age and quality) instead of
+        # stalling the row, and is finished or retried in the background
+        if deadlines is not None and not isinstance(deadlines, dict):
+            deadlines = {name: deadlines for name in self.sensors}
+        deadlines = deadlines or {}
+        for name in deadlines:
+            if name not in self.sensors:
+                raise ValueError(f"deadlines has to name sensors of this unit ({', '.join(self.sensors)}). Received: {name}")
+        readers = {
+            name: DeadlineReader(name, lambda name=name, read=read: self._timed_read(read, name),
+                                 deadlines[name], retry_delay=retry_delay, report=self._message)
+            for name, read in self.sensor_buses if name in deadlines
+        }
+        quality = {}  # sensor name -> QUALITY_ flag of its latest value
+        fields, efficiency = self._run_fields(concurrent or rates or readers, readers)
+        executor = None
+        if concurrent:
+            executor = ThreadPoolExecutor(max_workers=len(self.sensor_buses), thread_name_prefix="drip-bus")
+
+        # every sensor has its own deadline on the monotonic clock, `sleep` is the
+        # period of the sensors that have no rate of their own (0 runs back to back)
+        rates = rates or {}
+        scheduler = RateScheduler({
+            name: 1 / rates[name] if name in rates else sleep
+            for name, _ in self.sensor_buses
+        })
+        latest = {}  # sensor name -> (values, timestamp), held between reads
+        # rows go straight to disk, nothing from the run is kept in memory
+        writers = self.open_writers(fields) + self.open_live(fields)
+        rollups = self.open_rollups(fields) if self.rollups else None
+        self._open_display(display)
 
         try:
             while i < (iterations + 1) or infinite:
+                due = scheduler.wait()
+                for name, missed in scheduler.missed.items():
+                    self._message(f"\n--- {name} overran its period, skipped {missed} deadline(s) ---")
                 start_time = time.time()
-                print(f"\n--- Iteration {iteration} ---")
-                row = {'Time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-                # row.update(self.run_hx711(print_out = True))
-                row.update(self.run_nau7802(print_out = True))
-                row.update(self.run_si7021(print_out = True))
-                row.update(self.run_pzem(print_out = True))
-                records.append(row)
+                if verbose:
+                    print(f"\n--- Iteration {iteration} ---")
+                for name in due:
+                    if name in readers:
+                        readers[name].start()
+                sensors = [(name, read) for name, read in self.sensor_buses if name in due and name not in readers]
+                if concurrent:
+                    latest.update(self.read_concurrent(executor, sensors))
+                    if verbose:
+                        for name, _ in sensors:
+                            for key, value in latest[name][0].items():
+                                print(f"{key}: {value}")
+                else:
+                    for name, read in sensors:
+                        latest[name] = self._timed_read(lambda: read(print_out = verbose), name)
+                for name in due:
+                    if name in readers:
+                        values, stamp, quality[name] = readers[name].result()
+                        if values is None:
+                            self._message(f"--- {name}: no value yet ---")
+                            continue
+                        latest[name] = (values, stamp)
+                        if quality[name] == QUALITY_OK:
+                            if verbose:
+                                for key, value in values.items():
+                                    print(f"{key}: {value}")
+                        else:
+                            if quality[name] == QUALITY_STALE:
+                                self.metrics.count("deadline_misses_total", sensor=name)
+                            state = "late" if quality[name] == QUALITY_STALE else "failing"
+                            self._message(f"--- {name} {state}, holding its value from {time.time() - stamp:.1f} s ago ---")
+
+                now = time.time()
+                row = self._build_row(latest, now, efficiency, quality)
+                self._emit_row(row, now, writers, rollups, on_row)
                 end_time = time.time()
-                print("\nTime elapsed: ", end_time-start_time)
-                time.sleep(sleep)
+                self._iteration_latency.observe(end_time - start_time)
+                if verbose:
+                    print("\nTime elapsed: ", end_time-start_time)
                 iteration += 1
                 if not infinite:
                     i += 1
         except KeyboardInterrupt:
             print("\n--- KeyboardInterrupt detected. Exiting gracefully ---")
         finally:
+            if executor is not None:
+                executor.shutdown()
+            for reader in readers.values():
+                reader.close()
+            self._close_display()
             print(f"\n----- Successfully ran {iteration - 1} iterations -----")
-            with open(self.file_export, 'w', newline = '') as f:
-                writer = csv.DictWriter(f, fieldnames = fields)
-                writer.writeheader()
-                for record in records:
-                    writer.writerow(record)
-
-            print(f'--- exported data to {self.file_export}')
+            self._close_run(writers, rollups, scheduler)
             if infinite:
                 self.close_sensors()
-            return records   
+        # after the finally block, a return in it would swallow the error of a failed read
+        return writers[0].rows_written
+
+    async def run_all_async(self, iterations = 50, infinite = False, sleep = 2, rates = None, max_threads = None, buffer = 16, on_row = None, display = None):
+        """
+        Async version of run_all for trio. Every sensor is read by its own task at its
+        own rate (rates, else every `sleep` seconds), the blocking driver call runs in
+        a worker thread, at most max_threads (by default one per sensor) at a time.
+        The readings go through a memory channel of `buffer` readings to a consumer,
+        which writes a row every `sleep` seconds (0: on every reading) from the latest
+        reading of every sensor, once every sensor has been read.
+        A slow or failing sensor, e.g. a Modbus timeout, only holds its own columns;
+        the other sensors keep their rate. Cancelling the caller's scope stops the run and
+        closes the outputs. display (redraws per second) shows a status view instead of
+        printing every row, see run_all.
+        Returns the number of rows written.
+        """
+        import trio  # only the async API needs trio
+
+        fields, efficiency = self._run_fields(True)
+        rates = rates or {}
+        # the scheduler only keeps the deadlines and timing stats, the tasks sleep on trio's clock
+        scheduler = RateScheduler({
+            name: 1 / rates[name] if name in rates else sleep
+            for name, _ in self.sensor_buses
+        }, clock=trio.current_time)
+        limiter = trio.CapacityLimiter(max_threads or len(self.sensor_buses))
+        send_channel, receive_channel = trio.open_memory_channel(buffer)
+        latest = {}  # sensor name -> (values, timestamp), held between reads
+        writers = self.open_writers(fields) + self.open_live(fields)
+        rollups = self.open_rollups(fields) if self.rollups else None
+        rows = 0
+
+        async def sample(name, read, send):
+            task = scheduler.tasks[name]
+            async with send:
+                while True:
+                    await trio.sleep_until(task.deadline)
+                    missed = task.release(trio.current_time())
+                    if missed:
+                        self._message(f"\n--- {name} overran its period, skipped {missed} deadline(s) ---")
+                    try:
+                        values, stamp = await trio.to_thread.run_sync(self._timed_read, read, name, limiter=limiter)
+                    except Exception as error:
+                        # keep the other sensors going, the row holds this sensor's last reading
+                        self._message(f"\n--- {name} read failed: {error!r} ---")
+                        continue
+                    try:
+                        await send.send((name, values, stamp))
+                    except trio.BrokenResourceError:
+                        return  # the consumer is done
+
+        def write_row():
+            nonlocal rows
+            rows += 1
+            now = time.time()
+            if self.display is None:
+                print(f"\n--- Row {rows} ---")
+                for name, (values, _) in latest.items():
+                    for key, value in values.items():
+                        print(f"{key}: {value}")
+            row = self._build_row(latest, now, efficiency)
+            self._emit_row(row, now, writers, rollups, on_row)
+
+        async def consume(receive, cancel_scope):
+            async with receive:
+                # the first row waits for a reading of every sensor
+                while len(latest) < len(self.sensor_buses):
+                    name, values, stamp = await receive.receive()
+                    latest[name] = (values, stamp)
+                next_row = trio.current_time()
+                while rows < iterations or infinite:
+                    if sleep > 0:
+                        with trio.move_on_at(next_row):
+                            async for name, values, stamp in receive:
+                                latest[name] = (values, stamp)
+                        next_row = max(next_row + sleep, trio.current_time())
+                    else:
+                        name, values, stamp = await receive.receive()
+                        latest[name] = (values, stamp)
+                    write_row()
+                # stop the readers before the channel closes under them
+                cancel_scope.cancel()
+
+        self._open_display(display)
+        try:
+            async with trio.open_nursery() as nursery:
+                async with send_channel:
+                    for name, read in self.sensor_buses:
+                        nursery.start_soon(sample, name, read, send_channel.clone())
+                nursery.start_soon(consume, receive_channel, nursery.cancel_scope)
+        finally:
+            self._close_display()
+            print(f"\n----- Successfully wrote {rows} rows -----")
+            self._close_run(writers, rollups, scheduler)
+        return rows
 
     def close_sensors(self):
-        self.pzem_sensor.close()
-        GPIO.cleanup()
+        # every sensor releases only what it opened, e.g. the HX711 its own pins
+        for sensor in self.sensors.values():
+            sensor.close()
+        if self.stats_file is not None:
+            self.stats_file.close()  # with the final counts
+            self.stats_file = None
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
         print("\n----- Closed sensors -----")
 
 if __name__ == '__main__':
@@ -237,8 +616,9 @@ if __name__ == '__main__':
         'nau7802_ratio': -0.0007049150751308024, 
         'nau7802_readings': 2,
         'nau7802_i2c_bus': 1,
-        'file_export': "data_test.csv"
+        'file_export': "data_test.csv",
+        'sensors': ("NAU7802", "Si7021", "PZEM")  # or "HX711" instead of "NAU7802"
     }
 
     drip = DRIP(**DRIP_CONFIG)
-    drip.run_all(iterations=50, infinite=True, sleep=2)
+    drip.run_all(iterations=50, infinite=True, sleep=2, display=1)
@@ -0,0 +1,330 @@
+"""
+This file holds EfficiencyEstimator, the streaming water removal efficiency
+(liters per kWh) of the dehumidifier under test.
+
+The collection rate is the slope of a least squares line through the load
+cell readings of a sliding time window. The line is kept as running sums,
+so every sample costs O(1) however long the window is. The energy of the
+window is the difference of a cumulative energy: the PZEM Energy register
+or the integral of Power.
+
+Usage:
+    python efficiency.py data.csv --window 600 --output efficiency.csv
+"""
+import argparse
+import math
+import os
+from collections import deque
+from datetime import datetime
+from statistics import NormalDist
+
+ENERGY_SOURCES = ("power", "register")
+WEIGHT_TIME_FIELDS = ('NAU7802_Time', 'HX711_Time')  # read times of the built-in weight sensors
+FIELDS = ['Water_Rate', 'Water_Rate_SE', 'Average_Power', 'Efficiency',
+          'Efficiency_Low', 'Efficiency_High', 'Samples']
+
+
+def t_quantile(p, df):
+    """
+    t_quantile returns the p quantile of Student's t distribution with df
+    degrees of freedom: exact up to df = 4, above that a Cornish-Fisher
+    expansion (within 0.1 % of the exact quantile for p up to 0.995).
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    if df == 4:
+        alpha = 4 * p * (1 - p)
+        q = math.cos(math.acos(math.sqrt(alpha)) / 3) / math.sqrt(alpha)
+        return math.copysign(2 * math.sqrt(q - 1), p - 0.5)
+    if df == 3:
+        # no closed form, Newton steps on the closed form distribution function
+        t = _cornish_fisher(p, 5)
+        for _ in range(6):
+            theta = math.atan(t / math.sqrt(3))
+            cdf = 0.5 + (theta + math.sin(theta) * math.cos(theta)) / math.pi
+            pdf = 6 * math.sqrt(3) / (math.pi * (3 + t * t) ** 2)
+            t -= (cdf - p) / pdf
+        return t
+    return _cornish_fisher(p, df)
+
+
+def _cornish_fisher(p, df):
+    z = NormalDist().inv_cdf(p)
+    if math.isinf(df):
+        return z
+    z3, z5, z7, z9 = z ** 3, z ** 5, z ** 7, z ** 9
+    return (z
+            + (z3 + z) / (4 * df)
+            + (5 * z5 + 16 * z3 + 3 * z) / (96 * df ** 2)
+            + (3 * z7 + 19 * z5 + 17 * z3 - 15 * z) / (384 * df ** 3)
+            + (79 * z9 + 776 * z7 + 1482 * z5 - 1920 * z3 - 945 * z) / (92160 * df ** 4))
+
+
+class EfficiencyEstimator:
+    """
+    EfficiencyEstimator turns a stream of weight and power readings into
+    liters of water removed per kWh, with a confidence interval.
+    """
+
+    def __init__(self,
+                 window=600.0,
+                 energy="power",
+                 confidence=0.95,
+                 min_samples=10,
+                 reset_drop=200.0,
+                 energy_resolution=1.0):
+        """
+        Init a new instance of EfficiencyEstimator
+
+        Args:
+            window(float): Optional, by default 600. Seconds of readings in the fit.
+            energy(str): Optional, by default "power". Options ("power" || "register")
+                "power" integrates Power (W), "register" uses the Energy register (Wh).
+            confidence(float): Optional, by default 0.95. Level of the interval.
+            min_samples(int): Optional, by default 10. Readings needed for an estimate.
+            reset_drop(float): Optional, by default 200. A weight drop of more grams
+                than this (the bucket was emptied) restarts the window. None disables it.
+            energy_resolution(float): Optional, by default 1. Wh resolution of the
+                Energy register, widens the interval with energy="register".
+
+        Raises:
+            ValueError: if energy is not a known source
+        """
+        if energy not in ENERGY_SOURCES:
+            raise ValueError('energy has to be "power" or "register". '
+                             'Received: {}'.format(energy))
+        self.window = window
+        self.energy = energy
+        self.confidence = confidence
+        self.min_samples = max(3, min_samples)
+        self.reset_drop = reset_drop
+        self.energy_resolution = energy_resolution if energy == "register" else 0.0
+
+        self._integral = 0.0  # Wh of integrated Power since the start
+        self._power = None  # (timestamp, W) of the last Power reading
+        self.reset()
+
+    def reset(self):
+        """
+        reset empties the window, e.g. after the bucket was emptied.
+        """
+        self._samples = deque()  # (timestamp, grams, cumulative Wh)
+        # running sums of the fit, in coordinates shifted to (_t0, _y0)
+        # so they do not lose precision to large timestamps and offsets
+        self._t0 = 0.0
+        self._y0 = 0.0
+        self._st = self._sy = self._stt = self._sty = self._syy = 0.0
+
+    def _include(self, t, y, sign):
+        t -= self._t0
+        y -= self._y0
+        self._st += sign * t
+        self._sy += sign * y
+        self._stt += sign * t * t
+        self._sty += sign * t * y
+        self._syy += sign * y * y
+
+    def _rebase(self, t0, y0):
+        # move the sums to a new origin in O(1)
+        n = len(self._samples)
+        dt, dy = t0 - self._t0, y0 - self._y0
+        self._stt += -2 * dt * self._st + n * dt * dt
+        self._syy += -2 * dy * self._sy + n * dy * dy
+        self._sty += -dt * self._sy - dy * self._st + n * dt * dy
+        self._st -= n * dt
+        self._sy -= n * dy
+        self._t0, self._y0 = t0, y0
+
+    def add(self, timestamp, grams, power=None, energy=None):
+        """
+        add includes one reading and returns the estimate it leads to.
+
+        Args:
+            timestamp(float): seconds since the epoch of the weight reading
+            grams(float): weight on the load cell
+            power(float): Power in W, needed with energy="power"
+            energy(float): Energy register in Wh, needed with energy="register"
+
+        Returns: (dict || None) see estimate(). None while the window is too
+            short or if the reading was skipped (missing value, repeated timestamp).
+        """
+        if grams is None or power is None and self.energy == "power" \
+                or energy is None and self.energy == "register":
+            return None
+        if self._samples and timestamp <= self._samples[-1][0]:
+            return None  # the weight was held from an earlier read
+
+        if self.energy == "power":
+            if self._power is not None:
+                last_time, last_power = self._power
+                self._integral += (last_power + power) / 2 * (timestamp - last_time) / 3600
+            self._power = (timestamp, power)
+            cumulative = self._integral
+        else:
+            cumulative = energy
+
+        if (self.reset_drop is not None and self._samples
+                and grams < self._samples[-1][1] - self.reset_drop):
+            self.reset()
+        if not self._samples:
+            self._t0, self._y0 = timestamp, grams
+        self._samples.append((timestamp, grams, cumulative))
+        self._include(timestamp, grams, 1)
+
+        while self._samples[0][0] < timestamp - self.window:
+            t, y, _ = self._samples.popleft()
+            self._include(t, y, -1)
+        if timestamp - self._t0 > 2 * self.window:
+            self._rebase(self._samples[0][0], self._samples[0][1])
+        return self.estimate()
+
+    def estimate(self):
+        """
+        estimate returns the current estimate.
+
+        Returns: (dict || None) with Water_Rate (L/h) and its standard error
+            Water_Rate_SE, Average_Power (W), Efficiency (L/kWh) with
+            Efficiency_Low and Efficiency_High and the Samples in the window.
+            None with fewer than min_samples readings.
+        """
+        n = len(self._samples)
+        if n < self.min_samples:
+            return None
+        sxx = self._stt - self._st * self._st / n
+        sxy = self._sty - self._st * self._sy / n
+        syy = self._syy - self._sy * self._sy / n
+        if sxx <= 0:
+            return None
+        slope = sxy / sxx  # grams per second
+        residual = max(syy - slope * sxy, 0.0) / (n - 2)
+        slope_se = math.sqrt(residual / sxx)
+        margin = t_quantile(0.5 + self.confidence / 2, n - 2) * slope_se
+
+        first, last = self._samples[0], self._samples[-1]
+        duration = last[0] - first[0]
+        energy = last[2] - first[2]  # Wh in the window
+        result = {
+            'Water_Rate': slope * 3.6,  # g/s -> L/h
+            'Water_Rate_SE': slope_se * 3.6,
+            'Average_Power': energy * 3600 / duration,
+            'Efficiency': None,
+            'Efficiency_Low': None,
+            'Efficiency_High': None,
+            'Samples': n,
+        }
+        if energy > 0:
+            # grams over the window / 1000 per Wh / 1000 = L/kWh
+            result['Efficiency'] = slope * duration / energy
+            result['Efficiency_Low'] = (slope - margin) * duration / (energy + self.energy_resolution)
+            low_energy = energy - self.energy_resolution
+            result['Efficiency_High'] = ((slope + margin) * duration / low_energy
+                                         if low_energy > 0 else math.inf)
+        return result
+
+
+def _seconds(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def _number(value):
+    if value is None or value == '':
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def estimate_log(path, time_field=None, **options):
+    """
+    estimate_log runs an EfficiencyEstimator over a finished log, a CSV
+    written by run_all or a binary log (.drip).
+
+    Args:
+        path(str): the log
+        time_field(str): Optional, by default the read time column of the
+            weight sensor in the log (NAU7802_Time or HX711_Time), else Time.
+        **options: arguments for EfficiencyEstimator
+
+    Returns: generator of (timestamp, estimate dict) for every reading that
+        gave an estimate. Rows without a weight reading time use Time.
+    """
+    estimator = EfficiencyEstimator(**options)
+    for row in _read_rows(path, (time_field,) if time_field else WEIGHT_TIME_FIELDS):
+        if time_field is None:
+            # the columns of the first row tell which weight sensor wrote the log
+            time_field = next((name for name in WEIGHT_TIME_FIELDS if name in row), 'Time')
+        stamp = row.get(time_field) or row.get('Time')
+        if stamp is None:
+            continue
+        timestamp = _seconds(stamp)
+        result = estimator.add(timestamp, _number(row.get('Grams')),
+                               power=_number(row.get('Power')),
+                               energy=_number(row.get('Energy')))
+        if result is not None:
+            yield timestamp, result
+
+
+def _read_rows(path, time_fields):
+    if os.path.splitext(path)[1] == '.drip':
+        # imported here so CSV users do not need numpy
+        import binlog
+        with binlog.BinaryLogReader(path) as log:
+            names = [name for name in ('Time', *time_fields, 'Grams', 'Power', 'Energy')
+                     if name in log.fields]
+            columns = [log[name].tolist() for name in names]
+            for values in zip(*columns):
+                row = dict(zip(names, values))
+                for name in ('Time', *time_fields):
+                    if name in row:
+                        row[name] = None if row[name] == binlog.NULL_INT else row[name] / 1e9
+                if row.get('Energy') == binlog.NULL_INT:
+                    row['Energy'] = None
+                yield row
+    else:
+        import csv
+        with open(path, newline='') as f:
+            yield from csv.DictReader(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes liters of water removed per kWh from a DRIP log.")
+    parser.add_argument("log", type=str, help="CSV or binary (.drip) log written by run_all")
+    parser.add_argument("-w", "--window", dest="window", type=float, default=600.0,
+                        help="Seconds of readings in the fit, defaults to 600")
+    parser.add_argument("-e", "--energy", dest="energy", choices=ENERGY_SOURCES, default="power",
+                        help="Integrate Power or use the Energy register, defaults to power")
+    parser.add_argument("-c", "--confidence", dest="confidence", type=float, default=0.95,
+                        help="Level of the confidence interval, defaults to 0.95")
+    parser.add_argument("-t", "--time-field", dest="time_field", type=str, default=None,
+                        help="Column with the weight reading time, defaults to NAU7802_Time or HX711_Time if the log has one")
+    parser.add_argument("-o", "--output", dest="output", type=str, default=None,
+                        help="CSV file for every estimate, otherwise only the last one is printed")
+    args = parser.parse_args()
+
+    writer = None
+    if args.output:
+        from stream_writer import StreamWriter
+        writer = StreamWriter(args.output, ['Time', *FIELDS], flush_rows=1000)
+    last = None
+    for timestamp, result in estimate_log(args.log, time_field=args.time_field, window=args.window,
+                                          energy=args.energy, confidence=args.confidence):
+        last = timestamp, result
+        if writer:
+            writer.write({'Time': datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+                          **result})
+    if writer:
+        writer.close()
+        print(f"--- {writer.rows_written} estimates written to {args.output}")
+    if last is None:
+        print("--- not enough readings for an estimate")
+    else:
+        timestamp, result = last
+        print(f"--- {datetime.fromtimestamp(timestamp)}: {result['Water_Rate']:.3f} L/h "
+              f"at {result['Average_Power']:.1f} W")
+        if result['Efficiency'] is not None:
+            print(f"--- efficiency {result['Efficiency']:.3f} L/kWh "
+                  f"({args.confidence * 100:.0f} % interval {result['Efficiency_Low']:.3f} "
+                  f"to {result['Efficiency_High']:.3f})")
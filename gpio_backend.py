@@ -0,0 +1,234 @@
+"""
+This file holds the GPIO backends HX711 bit-bangs its serial interface with.
+
+Every backend drives the PD_SCK pin and samples the DOUT pin, and shifts a
+whole HX711 word in one tight loop. The loop calls pre-bound functions only,
+and it is timed once per word instead of once per bit.
+
+ - RPiGPIOBackend: RPi.GPIO, the default
+ - LgpioBackend: lgpio, talks to /dev/gpiochip directly (Pi 5, Bookworm)
+ - GpiodBackend: libgpiod v2 Python bindings
+"""
+import time
+from functools import partial
+
+
+class GPIOBackend:
+    """
+    GPIOBackend is the base of the HX711 GPIO backends. Subclasses claim the
+    pins in setup() and set _high, _low and _read to functions without
+    arguments that raise PD_SCK, lower PD_SCK and return DOUT as 0 or 1.
+    """
+
+    name = None
+
+    def __init__(self):
+        self._high = None
+        self._low = None
+        self._read = None
+
+    def setup(self, dout_pin, pd_sck_pin):
+        """
+        setup claims dout_pin as input and pd_sck_pin as output, low.
+        """
+        raise NotImplementedError
+
+    def clock(self, level):
+        """
+        clock sets PD_SCK high (True) or low (False).
+        """
+        if level:
+            self._high()
+        else:
+            self._low()
+
+    def dout(self):
+        """
+        dout returns the level of DOUT, 0 when the HX711 has data ready.
+        """
+        return self._read()
+
+    def shift_in(self, bits=24, pulses=1):
+        """
+        shift_in clocks out a word MSB first and then sends the extra
+        pulses that choose the channel and gain of the next conversion.
+
+        Args:
+            bits(int): Optional, by default 24. Bits to read.
+            pulses(int): Optional, by default 1. Pulses after the data (1 || 2 || 3)
+
+        Returns: (int, float) the word and the seconds the whole transfer took
+        """
+        high, low, read = self._high, self._low, self._read
+        data_in = 0
+        start = time.perf_counter()
+        for _ in range(bits):
+            high()
+            low()
+            data_in = (data_in << 1) | read()
+        for _ in range(pulses):
+            high()
+            low()
+        return data_in, time.perf_counter() - start
+
+    def bit_time(self, bits=32):
+        """
+        bit_time times the GPIO calls shift_in makes for one bit, with
+        pd_sck held LOW so nothing is clocked out of the chip.
+
+        Args:
+            bits(int): Optional, by default 32. Bits per run, the fastest of 5 runs counts.
+
+        Returns: float seconds per bit
+        """
+        low, read = self._low, self._read
+        best = None
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(bits):
+                low()
+                low()
+                read()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best / bits
+
+    def close(self):
+        """
+        close releases the pins.
+        """
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """
+    RPiGPIOBackend drives the pins through RPi.GPIO. The numbering mode set
+    by the caller is kept, BCM is used if none was set.
+    """
+
+    name = "rpi"
+
+    def __init__(self, gpio=None):
+        """
+        Args:
+            gpio(module): Optional. RPi.GPIO or a stand-in, imported if not given.
+        """
+        super().__init__()
+        if gpio is None:
+            import RPi.GPIO as gpio
+        self.gpio = gpio
+        self._pins = ()
+
+    def setup(self, dout_pin, pd_sck_pin):
+        gpio = self.gpio
+        if gpio.getmode() is None:
+            gpio.setmode(gpio.BCM)
+        gpio.setup(pd_sck_pin, gpio.OUT)  # pin pd_sck is output only
+        gpio.setup(dout_pin, gpio.IN)  # pin dout is input only
+        self._pins = (dout_pin, pd_sck_pin)
+        self._high = partial(gpio.output, pd_sck_pin, True)
+        self._low = partial(gpio.output, pd_sck_pin, False)
+        self._read = partial(gpio.input, dout_pin)
+
+    def close(self):
+        if self._pins:
+            self.gpio.cleanup(self._pins)
+            self._pins = ()
+
+
+class LgpioBackend(GPIOBackend):
+    """
+    LgpioBackend drives the pins through lgpio. Pin numbers are the
+    gpiochip line offsets, which match BCM numbering on the Pi.
+    """
+
+    name = "lgpio"
+
+    def __init__(self, chip=0):
+        """
+        Args:
+            chip(int): Optional, by default 0. /dev/gpiochip number.
+                Use 4 on a Raspberry Pi 5 with an older kernel.
+        """
+        super().__init__()
+        import lgpio
+        self.lgpio = lgpio
+        self.chip = chip
+        self._handle = None
+
+    def setup(self, dout_pin, pd_sck_pin):
+        lgpio = self.lgpio
+        self._handle = handle = lgpio.gpiochip_open(self.chip)
+        lgpio.gpio_claim_output(handle, pd_sck_pin, 0)
+        lgpio.gpio_claim_input(handle, dout_pin)
+        self._high = partial(lgpio.gpio_write, handle, pd_sck_pin, 1)
+        self._low = partial(lgpio.gpio_write, handle, pd_sck_pin, 0)
+        self._read = partial(lgpio.gpio_read, handle, dout_pin)
+
+    def close(self):
+        if self._handle is not None:
+            self.lgpio.gpiochip_close(self._handle)
+            self._handle = None
+
+
+class GpiodBackend(GPIOBackend):
+    """
+    GpiodBackend drives the pins through the libgpiod v2 Python bindings.
+    """
+
+    name = "gpiod"
+
+    def __init__(self, chip="/dev/gpiochip0"):
+        """
+        Args:
+            chip(str): Optional, by default "/dev/gpiochip0". Path of the GPIO chip.
+        """
+        super().__init__()
+        import gpiod
+        self.gpiod = gpiod
+        self.chip = chip
+        self._request = None
+
+    def setup(self, dout_pin, pd_sck_pin):
+        gpiod = self.gpiod
+        from gpiod.line import Direction, Value
+        self._request = request = gpiod.request_lines(
+            self.chip,
+            consumer="hx711",
+            config={
+                pd_sck_pin: gpiod.LineSettings(direction=Direction.OUTPUT,
+                                               output_value=Value.INACTIVE),
+                dout_pin: gpiod.LineSettings(direction=Direction.INPUT),
+            })
+        active = Value.ACTIVE
+        get_value = request.get_value
+        self._high = partial(request.set_value, pd_sck_pin, Value.ACTIVE)
+        self._low = partial(request.set_value, pd_sck_pin, Value.INACTIVE)
+        self._read = lambda: 1 if get_value(dout_pin) is active else 0
+
+    def close(self):
+        if self._request is not None:
+            self._request.release()
+            self._request = None
+
+
+BACKENDS = {backend.name: backend for backend in (RPiGPIOBackend, LgpioBackend, GpiodBackend)}
+
+
+def make_backend(backend="rpi"):
+    """
+    make_backend returns a GPIO backend.
+
+    Args:
+        backend(str || GPIOBackend): Optional, by default "rpi".
+            Options ("rpi" || "lgpio" || "gpiod") or a backend instance.
+
+    Raises:
+        ValueError: if backend is not a known name
+    """
+    if isinstance(backend, GPIOBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError('backend has to be one of {}. '
+                         'Received: {}'.format(', '.join(BACKENDS), backend))
+    return BACKENDS[backend]()
@@ -6,7 +6,26 @@ This file holds HX711 class
 import statistics as stat
 import time
 
-import RPi.GPIO as GPIO
+import numpy as np
+
+from gpio_backend import make_backend
+
+# PD_SCK high for 60 us or longer powers the HX711 down
+POWER_DOWN_TIME = 0.00006
+
+
+def invalid_readings(values):
+    """
+    invalid_readings tells which raw readings the outlier filters drop:
+    -1 (no signal) and the booleans of a failed read. False == 0 and
+    True == 1, so the readings 0 and 1 are dropped too.
+
+    Args:
+        values(int || numpy.ndarray): one reading or an array of readings
+
+    Returns: bool, or a bool array for an array
+    """
+    return (values == -1) | (values == 0) | (values == 1)
 
 
 class HX711:
@@ -18,7 +37,8 @@ class HX711:
                  dout_pin,
                  pd_sck_pin,
                  gain_channel_A=128,
-                 select_channel='A'):
+                 select_channel='A',
+                 gpio_backend='rpi'):
         """
         Init a new instance of HX711
 
@@ -27,9 +47,12 @@ class HX711:
             pd_sck_pin(int): Raspberry Pi pin number where the Clock pin of HX711 is connected.
             gain_channel_A(int): Optional, by default value 128. Options (128 || 64)
             select_channel(str): Optional, by default 'A'. Options ('A' || 'B')
+            gpio_backend(str || GPIOBackend): Optional, by default 'rpi'.
+                Options ('rpi' || 'lgpio' || 'gpiod') or a backend instance.
 
         Raises:
             TypeError: if pd_sck_pin or dout_pin are not int type
+            ValueError: if gpio_backend is not a known backend
         """
         if (isinstance(dout_pin, int)):
             if (isinstance(pd_sck_pin, int)):
@@ -56,9 +79,16 @@ class HX711:
         self._scale_ratio_B = 1  # scale ratio for channel B
         self._debug_mode = False
         self._data_filter = self.outliers_filter  # default it is used outliers_filter
-
-        GPIO.setup(self._pd_sck, GPIO.OUT)  # pin _pd_sck is output only
-        GPIO.setup(self._dout, GPIO.IN)  # pin _dout is input only
+        self._word_time = {}  # pulses per word -> typical transfer time in seconds
+        self._slow_words = 0  # slow transfers in a row
+        self._resync = False  # True after a power down, the gain has to be sent again
+        self.reads = 0  # word transfers started by _read
+        self.invalid_reads = 0  # of them returned False
+
+        self._gpio = make_backend(gpio_backend)
+        self._gpio.setup(self._dout, self._pd_sck)
+        # seeds the typical transfer time, so a stalled first word stands out too
+        self._bit_time = self._gpio.bit_time()
         self.select_channel(select_channel)
         self.set_gain_A(gain_channel_A)
 
@@ -306,42 +336,51 @@ class HX711:
         Returns: bool True if ready else False when not ready        
         """
         # if DOUT pin is low data is ready for reading
-        if GPIO.input(self._dout) == 0:
+        if self._gpio.dout() == 0:
             return True
         else:
             return False
 
-    def _set_channel_gain(self, num):
+    def _gain_pulses(self):
+        """
+        _gain_pulses returns how many pulses follow the 24 data bits.
+        They set the channel and gain of the next reading.
+
+        Returns: int 1 for channel A gain 128, 3 for A gain 64, 2 for B
         """
-        _set_channel_gain is called only from _read method.
-        It finishes the data transmission for HX711 which sets
-        the next required gain and channel.
+        if self._wanted_channel == 'A' and self._gain_channel_A == 128:
+            return 1
+        elif self._wanted_channel == 'A' and self._gain_channel_A == 64:
+            return 3
+        else:
+            return 2
+
+    def _slow_word(self, pulses, elapsed):
+        """
+        _slow_word tells from the duration of a whole transfer if
+        pd_sck could have been HIGH for 60 us, which powers the HX711 down.
+        Single pulses are not timed, so a transfer is slow when it took
+        longer than a typical one by more than a HIGH phase stretched
+        to 60 us adds to it. The stall may as well have been in a LOW
+        phase, which does no harm.
 
         Args:
-            num(int): how many ones it sends to HX711
-                options (1 || 2 || 3)
-        
-        Returns: bool True if HX711 is ready for the next reading
-            False if HX711 is not ready for the next reading
-        """
-        for _ in range(num):
-            start_counter = time.perf_counter()
-            GPIO.output(self._pd_sck, True)
-            GPIO.output(self._pd_sck, False)
-            end_counter = time.perf_counter()
-            # check if hx 711 did not turn off...
-            if end_counter - start_counter >= 0.00006:
-                # if pd_sck pin is HIGH for 60 us and more than the HX 711 enters power down mode.
-                if self._debug_mode:
-                    print('Not enough fast while setting gain and channel')
-                    print(
-                        'Time elapsed: {}'.format(end_counter - start_counter))
-                # hx711 has turned off. First few readings are inaccurate.
-                # Despite it, this reading was ok and data can be used.
-                result = self.get_raw_data_mean(6)  # set for the next reading.
-                if result == False:
-                    return False
-        return True
+            pulses(int): pulses in the transfer
+            elapsed(float): seconds the transfer took
+
+        Returns: bool True if the HX711 may have powered down
+        """
+        # before the first transfer the typical time is the one of the GPIO calls alone
+        typical = self._word_time.get(pulses, self._bit_time * pulses)
+        # moving average of the transfer time. It falls fast and rises slowly,
+        # so a single stall does not hide power downs.
+        if elapsed < typical:
+            self._word_time[pulses] = typical + 0.5 * (elapsed - typical)
+        else:
+            self._word_time[pulses] = typical + 0.1 * min(elapsed - typical, POWER_DOWN_TIME)
+        if elapsed < POWER_DOWN_TIME:
+            return False  # no single pulse can have been that long
+        return elapsed - typical >= POWER_DOWN_TIME - typical / (2 * pulses)
 
     def _read(self):
         """
@@ -351,52 +390,59 @@ class HX711:
         Returns: (bool || int) if it returns False then it is false reading.
             if it returns int then the reading was correct
         """
-        GPIO.output(self._pd_sck, False)  # start by setting the pd_sck to 0
+        if self._resync:
+            # after a power down the chip is back on channel A gain 128.
+            # This reading sets our channel and gain again, its data is dropped.
+            self._resync = False
+            if self._read() is False:
+                return False
+
+        self.reads += 1
+        self._gpio.clock(False)  # start by setting the pd_sck to 0
         ready_counter = 0
-        while (not self._ready() and ready_counter <= 40):
-            time.sleep(0.01)  # sleep for 10 ms because data is not ready
-            ready_counter += 1
+        while not self._ready():
+            # 50 trials are longer than the 400 ms the chip settles after a reset
             if ready_counter == 50:  # if counter reached max value then return False
                 if self._debug_mode:
-                    print('self._read() not ready after 40 trials\n')
+                    print('self._read() not ready after 50 trials\n')
+                # the chip may be stuck halfway through a word, reset it
+                self.power_down()
+                self.power_up()
+                self._resync = True
+                self.invalid_reads += 1
                 return False
+            time.sleep(0.01)  # sleep for 10 ms because data is not ready
+            ready_counter += 1
 
-        # read first 24 bits of data
-        data_in = 0  # 2's complement data from hx 711
-        for _ in range(24):
-            start_counter = time.perf_counter()
-            # request next bit from hx 711
-            GPIO.output(self._pd_sck, True)
-            GPIO.output(self._pd_sck, False)
-            end_counter = time.perf_counter()
-            if end_counter - start_counter >= 0.00006:  # check if the hx 711 did not turn off...
-                # if pd_sck pin is HIGH for 60 us and more than the HX 711 enters power down mode.
-                if self._debug_mode:
-                    print('Not enough fast while reading data')
-                    print(
-                        'Time elapsed: {}'.format(end_counter - start_counter))
+        # read 24 bits of data and send the pulses for the next channel and gain
+        num = self._gain_pulses()
+        data_in, elapsed = self._gpio.shift_in(24, num)  # 2's complement data from hx 711
+        if self._slow_word(24 + num, elapsed):
+            self._slow_words += 1
+            if self._debug_mode:
+                print('Not enough fast while reading data')
+                print('Time elapsed: {}'.format(elapsed))
+            # the next reading sends the channel and gain again in case the chip was reset
+            self._resync = True
+            if self._slow_words > 1:
+                # slow again, reset the chip so it does not stop halfway through a word
+                self._slow_words = 0
+                self.power_down()
+                self.power_up()
+                self.invalid_reads += 1
+                return False
+            if data_in & 1:
+                # after a power down DOUT stays HIGH for the rest of the word,
+                # a word that ends in 0 was clocked out completely
+                self.invalid_reads += 1
                 return False
-            # Shift the bits as they come to data_in variable.
-            # Left shift by one bit then bitwise OR with the new bit.
-            data_in = (data_in << 1) | GPIO.input(self._dout)
+        else:
+            self._slow_words = 0
 
-        if self._wanted_channel == 'A' and self._gain_channel_A == 128:
-            if not self._set_channel_gain(1):  # send only one bit which is 1
-                return False  # return False because channel was not set properly
-            else:
-                self._current_channel = 'A'  # else set current channel variable
-                self._gain_channel_A = 128  # and gain
-        elif self._wanted_channel == 'A' and self._gain_channel_A == 64:
-            if not self._set_channel_gain(3):  # send three ones
-                return False  # return False because channel was not set properly
-            else:
-                self._current_channel = 'A'  # else set current channel variable
-                self._gain_channel_A = 64
+        if num == 2:
+            self._current_channel = 'B'
         else:
-            if not self._set_channel_gain(2):  # send two ones
-                return False  # return False because channel was not set properly
-            else:
-                self._current_channel = 'B'  # else set current channel variable
+            self._current_channel = 'A'
 
         if self._debug_mode:  # print 2's complement value
             print('Binary value as received: {}'.format(bin(data_in)))
@@ -408,6 +454,7 @@ class HX711:
            ):  # 0x800000 is the lowest possible value from hx711
             if self._debug_mode:
                 print('Invalid data detected: {}\n'.format(data_in))
+            self.invalid_reads += 1
             return False  # rturn false because the data is invalid
 
         # calculate int from 2's complement
@@ -503,6 +550,29 @@ class HX711:
         else:
             return False
 
+    def get_weight_adaptive(self, oversampler):
+        """
+        get_weight_adaptive returns the weight averaged over as many readings
+        as the oversampler needs to reach its target standard error.
+        Invalid readings are skipped, the data filter is not used.
+
+        Args:
+            oversampler(AdaptiveOversampler): sets the target and the time
+                budget and keeps the number of readings used
+
+        Returns: (bool || float) False if no reading was ok.
+            If it returns float then reading was ok
+        """
+        backup_channel = self._current_channel
+        backup_gain = self._gain_channel_A
+        offset = self.get_current_offset()
+        scale_ratio = self.get_current_scale_ratio()
+        data_mean = oversampler.sample(self._read, scale=1 / scale_ratio)
+        if data_mean is None:
+            return False
+        self._save_last_raw_data(backup_channel, backup_gain, data_mean)
+        return float((data_mean - offset) / scale_ratio)
+
     def get_current_channel(self):
         """
         get current channel returns the value of current channel.
@@ -633,15 +703,15 @@ class HX711:
         """
         power down method turns off the hx711.
         """
-        GPIO.output(self._pd_sck, False)
-        GPIO.output(self._pd_sck, True)
+        self._gpio.clock(False)
+        self._gpio.clock(True)
         time.sleep(0.01)
 
     def power_up(self):
         """
         power up function turns on the hx711.
         """
-        GPIO.output(self._pd_sck, False)
+        self._gpio.clock(False)
         time.sleep(0.01)
 
     def reset(self):
@@ -658,6 +728,12 @@ class HX711:
         else:
             return True
 
+    def close(self):
+        """
+        close releases the GPIO pins.
+        """
+        self._gpio.close()
+
 
     def outliers_filter(self, data_list, stdev_thresh = 1.0):
         """
@@ -666,27 +742,34 @@ class HX711:
         Outliers are compared to the standard deviation from the median
         Default filter is of 1.0 standard deviation from the median
 
+        The arithmetic is done with NumPy arrays. For a continuous stream
+        use SlidingOutlierFilter from sliding_filter.py instead, it does not
+        rescan the whole window for every sample.
+
         Args:
             data_list([int]): List of int. It can contain Bool False that is removed.
         
         Returns: list of filtered data. Excluding outliers.
         """
-        # filter out -1 which indicates no signal
-        # filter out booleans
-        data = [num for num in data_list if (num != -1 and num != False and num != True)] 
-        if not data:
+        # filter out -1 which indicates no signal and the booleans
+        data = np.asarray(data_list)
+        data = data[~invalid_readings(data)]
+        if not data.size:
             return []
-
-        median = stat.median(data)
-        dists_from_median = [(abs(measurement - median)) for measurement in data]
-        stdev = stat.stdev(dists_from_median)
-        if stdev:
-            ratios_to_stdev = [(dist / stdev) for dist in dists_from_median]
+        if data.size == 1:
+            return data.tolist()
+
+        # median the same way as statistics.median, mean of the two middle
+        # values for an even count
+        ordered = np.sort(data)
+        middle = data.size // 2
+        if data.size % 2:
+            median = ordered[middle].item()
         else:
+            median = (ordered[middle - 1].item() + ordered[middle].item()) / 2
+        dists_from_median = np.abs(data - median)
+        stdev = dists_from_median.std(ddof=1)
+        if not stdev:
             # stdev is 0. Therefore return just the median
             return [median]
-        filtered_data = []
-        for i in range(len(data)):
-            if ratios_to_stdev[i] < stdev_thresh:
-                filtered_data.append(data[i])
-        return filtered_data
+        return data[dists_from_median / stdev < stdev_thresh].tolist()
@@ -0,0 +1,283 @@
+"""
+This file holds the metrics of DRIP: Histogram, Metrics and the exporters
+serve() (Prometheus text over HTTP) and StatsFile (a file rewritten every
+few seconds).
+
+Recording is meant to stay on in production: a histogram observation is a
+bisect over a dozen bucket bounds and three additions, and counters kept by
+the drivers (I2C transactions, Modbus requests, invalid HX711 reads) are
+plain integers that are only read when the metrics are exported.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# seconds, from a single I2C conversion (~1 ms) to a Modbus timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HELP = {
+    "read_seconds": "Duration of one sensor read",
+    "iteration_seconds": "Duration of one run_all iteration",
+    "read_errors_total": "Sensor reads that raised an error",
+    "deadline_misses_total": "Rows that held the last value of a sensor because its read missed the deadline",
+    "i2c_transactions_total": "I2C transactions of the sensor",
+    "modbus_requests_total": "Modbus requests sent",
+    "modbus_retries_total": "Modbus requests sent again after reopening the serial port",
+    "modbus_failures_total": "Modbus requests that raised an error",
+    "modbus_skipped_writes_total": "Holding register writes skipped because the value was stored",
+    "hx711_reads_total": "HX711 word transfers",
+    "hx711_invalid_reads_total": "HX711 reads that returned False",
+}
+
+
+class Histogram:
+    """
+    Histogram counts observations in fixed buckets, like a Prometheus
+    histogram. Each instance is meant to be updated by one thread (one
+    sensor), so it takes no lock.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Init a new instance of Histogram
+
+        Args:
+            buckets((float)): Optional, by default LATENCY_BUCKETS. Sorted
+                upper bounds, an observation above the last one goes to +Inf.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # per bucket, not cumulative
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        observe adds one value.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        quantile estimates a quantile by linear interpolation within its
+        bucket, as Prometheus histogram_quantile does.
+
+        Returns: (float || None) None without observations
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.max  # in +Inf, the largest value is the best bound
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = min(self.buckets[index], self.max)
+                return lower + (upper - lower) * max(rank - seen, 0) / count
+            seen += count
+        return self.max
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Metrics holds the histograms and counters of a DRIP unit and renders
+    them as Prometheus text or as a dict. Values owned by other objects are
+    pulled by collectors when the metrics are rendered.
+    """
+
+    def __init__(self, prefix="drip", labels=None):
+        """
+        Init a new instance of Metrics
+
+        Args:
+            prefix(str): Optional, by default "drip". Put before every metric name.
+            labels(dict): Optional. Labels of every metric, e.g. {"drip_id": "2"}.
+        """
+        self.prefix = prefix
+        self.labels = tuple((labels or {}).items())
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> int
+        self._collectors = []
+        self._lock = threading.Lock()  # taken to create a histogram and to list them
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        """
+        histogram returns the histogram of name and labels, created on first
+        use. Keep the returned object to observe without a lookup.
+        """
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            return self.histograms[key]
+
+    def count(self, name, n=1, **labels):
+        """
+        count adds n to a counter.
+        """
+        key = (name, tuple(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_collector(self, collect):
+        """
+        add_collector adds a function called on every export. It returns
+        [(name, labels dict, value)] of counters kept elsewhere.
+        """
+        self._collectors.append(collect)
+
+    def _histograms(self):
+        with self._lock:
+            return sorted(self.histograms.items())
+
+    def _counters(self):
+        counters = dict(self.counters)
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                counters[(name, tuple(labels.items()))] = value
+        return counters
+
+    def render(self):
+        """
+        render returns every metric in the Prometheus text format.
+        """
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {self.prefix}_{name} {HELP[name]}")
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, labels), histogram in self._histograms():
+            header(name, "histogram")
+            labels = self.labels + labels
+            full = f"{self.prefix}_{name}"
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_sum{_labels(labels)} {histogram.sum!r}")
+            lines.append(f"{full}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(self._counters().items()):
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name}{_labels(self.labels + labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        snapshot returns the metrics as a dict: per histogram the count, sum,
+        mean, max and the 50, 90 and 99 % quantiles, per counter its value.
+        """
+        histograms = []
+        for (name, labels), histogram in self._histograms():
+            histograms.append(dict(
+                name=name,
+                labels=dict(labels),
+                count=histogram.count,
+                sum=histogram.sum,
+                mean=histogram.sum / histogram.count if histogram.count else None,
+                max=histogram.max,
+                p50=histogram.quantile(0.5),
+                p90=histogram.quantile(0.9),
+                p99=histogram.quantile(0.99),
+            ))
+        counters = [dict(name=name, labels=dict(labels), value=value)
+                    for (name, labels), value in sorted(self._counters().items())]
+        return {"time": time.time(), "labels": dict(self.labels), "histograms": histograms, "counters": counters}
+
+
+def serve(metrics, port=9105, host="127.0.0.1"):
+    """
+    serve exports metrics in the Prometheus text format on
+    http://host:port/metrics from a background thread.
+
+    Returns: ThreadingHTTPServer, call shutdown() and server_close() to stop it
+    """
+    # imported here so a unit that does not serve its metrics does not load it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # a scrape every few seconds would fill the console
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="drip-metrics", daemon=True).start()
+    return server
+
+
+class StatsFile:
+    """
+    StatsFile rewrites a stats file from a background thread every interval
+    seconds. A .json path gets snapshot(), any other path the Prometheus
+    text (e.g. a .prom file for the node_exporter textfile collector). The
+    file is replaced in one step, so a reader never sees half of it.
+    """
+
+    def __init__(self, metrics, path, interval=10.0):
+        """
+        Init a new instance of StatsFile and start writing.
+
+        Args:
+            metrics(Metrics): the metrics to write
+            path(str): the stats file
+            interval(float): Optional, by default 10 s.
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="drip-stats", daemon=True)
+        self._thread.start()
+
+    def write(self):
+        """
+        write rewrites the file now.
+        """
+        if self.path.endswith(".json"):
+            text = json.dumps(self.metrics.snapshot(), indent=2)
+        else:
+            text = self.metrics.render()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        """
+        close stops the thread and writes the file a last time.
+        """
+        self._stop.set()
+        self._thread.join()
+        self.write()
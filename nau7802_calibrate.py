@@ -1,77 +1,89 @@
-import time
+"""
+nau7802_calibrate.py runs a multi-point calibration session of the NAU7802 load cell.
+
+The empty scale is tared, then any number of known weights are read. Every
+point (mean raw reading, number of conversions, standard deviation) is
+appended to nau_calibrate_points.csv. The offset and ratio are then fitted
+over all sessions recorded so far (calibration.py) and saved to
+nau7802_calibration.json, which DRIP loads with calibration_file.
+
+Usage:
+    python nau7802_calibrate.py --samples 50
+"""
+import argparse
+from datetime import datetime
+
 import board
 from cedargrove_nau7802 import NAU7802
-import csv
-import os
-import pandas as pd
-
-def read_raw_value(samples=5):
-    """Read and average consecutive raw sample values. Return average raw value."""
-    sample_sum = 0
-    sample_count = samples
-    while sample_count > 0:
-        while not nau7802.available():
-            pass
-        sample_sum = sample_sum + nau7802.read()
-        sample_count -= 1
-    return int(sample_sum / samples)
+
+import calibration
+from nau7802_sampler import NAU7802Sampler
+from running_stats import RunningStats
+
+
+def read_point(sampler, samples):
+    """Read consecutive conversions. Return (mean raw value, standard deviation)."""
+    stats = RunningStats()
+    for _ in range(samples):
+        stats.add(sampler.read())
+    return stats.mean, stats.stdev()
+
+
+parser = argparse.ArgumentParser(description="Runs a multi-point NAU7802 calibration session.")
+parser.add_argument("-n", "--samples", dest="samples", type=int, default=50,
+                    help="Conversions averaged per point, defaults to 50")
+parser.add_argument("-p", "--points", dest="points", type=str, default=calibration.POINTS_FILE,
+                    help=f"File the points are appended to, defaults to {calibration.POINTS_FILE}")
+parser.add_argument("-o", "--output", dest="output", type=str, default=calibration.CONFIG_FILE,
+                    help=f"Config file DRIP loads, defaults to {calibration.CONFIG_FILE}")
+args = parser.parse_args()
+
+session = datetime.now().isoformat(timespec='seconds')
+points = []
 
 try:
     nau7802 = NAU7802(board.I2C(), address=0x2A, active_channels=1)
     nau7802.calibrate("INTERNAL")
     nau7802.channel = 1
+    sampler = NAU7802Sampler(nau7802)
 
     print("*** Instantiate and calibrate load cells")
     print("Digital and analog power enabled:", nau7802.enable(True))
 
-    print("\n--- Calibration Step ---")
+    print(f"\n--- Calibration session {session} ---")
     print("REMOVE WEIGHTS FROM LOAD CELLS")
     input("Make sure the scale is EMPTY and press Enter to tare...")
+    weight = 0.0
+    while True:
+        raw, stdev = read_point(sampler, args.samples)
+        points.append({"session": session, "time": datetime.now().isoformat(timespec='seconds'),
+                       "weight": weight, "raw": raw, "samples": args.samples, "stdev": stdev})
+        print(f"{weight:g} g: raw {raw:.1f} (stdev {stdev:.1f} over {args.samples} conversions)")
 
-    zero_raw = read_raw_value()
-    print(f"Tare complete. Zero raw value: {zero_raw}")
-
-    input("Now place a known weight on the scale and press Enter...")
-    known_weight_grams = float(input("Enter the weight you placed (in grams): "))
-    known_raw = read_raw_value()
-    print(f"Raw value with known weight: {known_raw}")
+        # more weights make the fit better and show the linearity, 0 checks the return to zero
+        text = input("\nPlace a known weight and enter its grams (Enter to finish): ").strip()
+        if not text:
+            break
+        weight = float(text)
 
-    scale_factor = known_weight_grams / (known_raw - zero_raw)
-    print(f"Calculated scale factor: {scale_factor} grams per raw unit")
-    print(f"Offset (zero_raw): {zero_raw}")
+except KeyboardInterrupt:
+    print("\n--- KeyboardInterrupt detected. Exiting gracefully ---")
+finally:
+    if len({point["weight"] for point in points}) >= 2:
+        calibration.write_points(points, args.points)
+        print(f"\n Saved {len(points)} points to {args.points}")
+    else:
+        print("\n No known weight was read, nothing saved")
 
-    print("--- Calibration Complete ---\n")
+if len({point["weight"] for point in points}) >= 2:
+    result = calibration.fit(calibration.read_points(args.points))
+    calibration.report(result)
+    calibration.save_config(result, args.output)
+    print(f"\n Saved calibration to {args.output}")
 
     print("READY")
-
     for i in range(5):
         print("=====")
-        nau7802.channel = 1
-        raw = read_raw_value()
-        grams = (raw - zero_raw) * scale_factor
+        raw = sampler.read_mean(5)
+        grams = (raw - result["offset"]) * result["ratio"]
         print(f"channel {nau7802.channel:1.0f} weight: {grams:.2f} g")
-
-except KeyboardInterrupt:
-            print("\n--- KeyboardInterrupt detected. Exiting gracefully ---")
-finally:
-    try:
-        fields = ['Weight', 'Offset', 'Ratio']
-        record = {
-            'Weight': known_weight_grams,
-            'Offset': zero_raw,
-            'Ratio': scale_factor
-        }
-
-        file_path = "nau_calibrate.csv"
-        write_header = not os.path.exists(file_path) or os.stat(file_path).st_size == 0
-
-        # with open("nau_calibrate.csv", 'w', newline='') as f:
-        with open(file_path, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fields)
-            if write_header:
-                writer.writeheader()
-            writer.writerow(record)
-            
-        print("\n Saved calibration to nau_calibrate.csv")
-    except Exception as e:
-        print(f"Failed to write calibration file: {e}")
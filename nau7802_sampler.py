@@ -0,0 +1,103 @@
+"""
+This file holds NAU7802Sampler class
+"""
+import time
+
+from running_stats import RunningStats
+
+# CTRL2 CRS register bits -> conversions per second
+CONVERSION_RATES = {0: 10, 1: 20, 2: 40, 3: 80, 7: 320}
+
+
+def conversion_rate(sensor, default=10):
+    """
+    conversion_rate reads the configured conversion rate from the chip.
+
+    Args:
+        sensor(NAU7802): the NAU7802 driver object
+        default(int): Optional, by default 10. Returned if the rate cannot be read.
+
+    Returns: int conversions per second
+    """
+    try:
+        return CONVERSION_RATES.get(sensor.poll_rate, default)
+    except (AttributeError, OSError):
+        return default
+
+
+class NAU7802Sampler:
+    """
+    NAU7802Sampler waits for NAU7802 conversions without spinning on the
+    I2C bus. It sleeps through most of the conversion period and then polls
+    available() with a backoff, so the CPU is free for the serial and I2C
+    work of the other sensors.
+    """
+
+    def __init__(self, sensor, rate_sps=None, min_sleep=0.0005, max_sleep=None):
+        """
+        Init a new instance of NAU7802Sampler
+
+        Args:
+            sensor(NAU7802): the NAU7802 driver object
+            rate_sps(int): Optional, by default it is read from the chip.
+                Conversions per second.
+            min_sleep(float): Optional, by default 0.5 ms. First sleep between polls.
+            max_sleep(float): Optional, by default 1/8 of the conversion period.
+                The backoff never sleeps longer than this between polls.
+        """
+        self.sensor = sensor
+        self.rate_sps = rate_sps if rate_sps else conversion_rate(sensor)
+        self.period = 1 / self.rate_sps
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep if max_sleep else self.period / 8
+        self._last_ready = None  # monotonic time the last conversion was read
+
+        self.transactions = 0  # I2C transactions: available() polls and conversion reads
+        self.last_polls = 0  # available() calls for the last sample
+        self.last_cpu = 0.0  # CPU seconds spent on the last sample
+        self.polls = RunningStats()
+        self.cpu = RunningStats()
+
+    def read(self):
+        """
+        read waits for the next conversion and returns it.
+
+        Returns: int raw ADC value
+        """
+        cpu_start = time.thread_time()
+        if self._last_ready is not None:
+            # the next conversion lands one period after the last one,
+            # sleep through most of it before asking the chip
+            remaining = self._last_ready + self.period * 0.9 - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+        polls = 1
+        delay = self.min_sleep
+        while not self.sensor.available():
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_sleep)
+            polls += 1
+        self._last_ready = time.monotonic()
+        value = self.sensor.read()
+
+        self.transactions += polls + 1
+        self.last_polls = polls
+        self.last_cpu = time.thread_time() - cpu_start
+        self.polls.add(polls)
+        self.cpu.add(self.last_cpu)
+        return value
+
+    def read_mean(self, samples):
+        """
+        read_mean reads consecutive conversions and returns their average.
+
+        Args:
+            samples(int): number of conversions to average
+
+        Returns: int average raw value
+        """
+        sample_sum = 0
+        for _ in range(samples):
+            sample_sum += self.read()
+        return int(sample_sum / samples)
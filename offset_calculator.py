@@ -1,12 +1,13 @@
-import pandas as pd
+import os
 
-df = pd.read_csv("nau_calibrate.csv")
-raw_estimates = df['Weight'] / df['Ratio']
-offsets = df['Offset']
-residuals = raw_estimates - offsets
-optimal_offset = int(round((raw_estimates - residuals).mean()))
+import calibration
 
-optimal_ratio = (df['Weight'] / (raw_estimates - optimal_offset)).mean()
+# the old single point sessions and the multi-point sessions, if there are any
+files = [path for path in ("nau_calibrate.csv", calibration.POINTS_FILE) if os.path.exists(path)]
+points = [point for path in files for point in calibration.read_points(path)]
+result = calibration.fit(points)
+
+calibration.report(result)
 print("\n--- Recalculated Optimal Calibration ---")
-print(f"Offset: {optimal_offset}")
-print(f"Ratio: {optimal_ratio}")
+print(f"Offset: {result['offset']}")
+print(f"Ratio: {result['ratio']}")
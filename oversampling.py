@@ -0,0 +1,88 @@
+"""
+This file holds AdaptiveOversampler class
+"""
+import math
+import time
+
+from running_stats import RunningStats
+
+
+class AdaptiveOversampler:
+    """
+    AdaptiveOversampler averages load cell conversions until the standard
+    error of the mean reaches a target in grams. The variance is kept with
+    Welford's algorithm, so every conversion costs O(1). A stable weight
+    stops after a few conversions, a noisy one (compressor vibration, water
+    pouring in) takes more, up to a time budget.
+    """
+
+    def __init__(self, target_se, budget=1.0, min_samples=4, max_samples=None, clock=time.monotonic):
+        """
+        Init a new instance of AdaptiveOversampler
+
+        Args:
+            target_se(float): standard error of the mean in grams to stop at
+            budget(float): Optional, by default 1.0. Seconds a reading may take.
+                No conversion is started that would be expected to end after it.
+            min_samples(int): Optional, by default 4. Conversions before the
+                variance is trusted (at least 2).
+            max_samples(int): Optional. Upper limit of conversions.
+            clock(function): Optional, by default time.monotonic.
+
+        Raises:
+            ValueError: if target_se is not positive
+        """
+        if not target_se or target_se <= 0:
+            raise ValueError('Parameter "target_se" has to be a positive number of grams. '
+                             'Received: {}'.format(target_se))
+        self.target_se = target_se
+        self.budget = budget
+        self.min_samples = max(2, min_samples)
+        self.max_samples = max_samples
+        self._clock = clock
+
+        self.last_samples = 0  # valid conversions in the last reading
+        self.last_invalid = 0  # conversions the read function rejected
+        self.last_se = math.inf  # standard error in grams of the last reading
+        self.last_elapsed = 0.0
+        self.samples = RunningStats()  # conversions per reading over the run
+
+    def sample(self, read, scale=1.0):
+        """
+        sample calls read until the mean is good enough or the budget is spent.
+
+        Args:
+            read(function): returns one raw conversion, None or False if it was invalid
+            scale(float): Optional, by default 1.0. Grams per raw count.
+
+        Returns: (float || None) mean raw value, None if no conversion was valid
+        """
+        stats = RunningStats()
+        invalid = 0
+        scale = abs(scale)
+        target_variance = (self.target_se / scale) ** 2 if scale else math.inf
+        start = self._clock()
+        elapsed = 0.0
+        while True:
+            value = read()
+            elapsed = self._clock() - start
+            if value is None or value is False:
+                invalid += 1
+            else:
+                stats.add(value)
+            n = stats.count
+            if self.max_samples and n >= self.max_samples:
+                break
+            # the variance of the mean is variance / n, compared without a square root
+            if n >= self.min_samples and stats.variance() <= target_variance * n:
+                break
+            # expect the next conversion to take as long as the ones so far
+            if elapsed + elapsed / (n + invalid) > self.budget:
+                break
+
+        self.last_samples = stats.count
+        self.last_invalid = invalid
+        self.last_se = math.sqrt(stats.variance() / stats.count) * scale if stats.count > 1 else math.inf
+        self.last_elapsed = elapsed
+        self.samples.add(stats.count)
+        return stats.mean if stats.count else None
@@ -0,0 +1,310 @@
+"""
+This file holds the PZEM-004T register decoder, the PZEMBus class and connect()
+"""
+import struct
+import threading
+import time
+
+import modbus_tk.defines as flags
+from modbus_tk import modbus_rtu
+from serial import Serial, SerialException
+
+# Order of the values decoded from the 10 input registers
+FIELDS = ("Voltage", "Current", "Power", "Energy", "Frequency", "Power_Factor", "Alarm_Status")
+
+ALARM_REGISTER = 1  # holding register with the power alarm threshold in W
+ADDRESS_REGISTER = 2  # holding register with the Modbus slave address
+RESET_ENERGY = 0x42  # PZEM specific function code that clears the Energy counter
+
+_buses = {}  # serial port -> PZEMBus, see connect()
+_buses_lock = threading.Lock()
+
+
+def decode(registers):
+    """
+    decode converts the 10 raw input registers of one reading to standard units.
+
+    Args:
+        registers([int]): input registers 0..9 as returned by modbus_tk
+
+    Returns: dict with Voltage (V), Current (A), Power (W), Energy (Wh),
+        Frequency (Hz), Power_Factor and Alarm_Status (0 || 1)
+    """
+    r = registers
+    return {
+        "Voltage": r[0] / 10,
+        "Current": (r[1] | r[2] << 16) / 1_000,
+        "Power": (r[3] | r[4] << 16) / 10,
+        "Energy": r[5] | r[6] << 16,
+        "Frequency": r[7] / 10,
+        "Power_Factor": r[8] / 100,
+        "Alarm_Status": 1 if r[9] else 0
+    }
+
+
+def decode_batch(blocks):
+    """
+    decode_batch converts many readings at once into columns.
+
+    Args:
+        blocks([[int]]): sequence of 10 register blocks, or a (n, 10) array
+
+    Returns: dict of field name -> numpy array with one value per block
+    """
+    # numpy is only needed for batches, keep it out of the import of this module
+    import numpy as np
+
+    r = np.asarray(blocks, dtype=np.uint32).reshape(-1, 10)
+    return {
+        "Voltage": r[:, 0] / 10,
+        "Current": (r[:, 1] | r[:, 2] << 16) / 1_000,
+        "Power": (r[:, 3] | r[:, 4] << 16) / 10,
+        "Energy": (r[:, 5] | r[:, 6] << 16).astype(np.int64),
+        "Frequency": r[:, 7] / 10,
+        "Power_Factor": r[:, 8] / 100,
+        "Alarm_Status": (r[:, 9] != 0).astype(np.int8)
+    }
+
+
+class PZEMBus:
+    """
+    PZEMBus talks to one or more PZEM-004T meters sharing one serial port.
+    Each meter needs its own Modbus slave address (see set_address).
+
+    The port is opened once and kept open, so a poll costs one Modbus round
+    trip. After a serial error (adapter unplugged, port reset) the port is
+    reopened and the request sent again. Holding register writes that would
+    not change the stored value are skipped.
+    """
+
+    def __init__(self, port="/dev/ttyS0", slaves=(1,), timeout=2.0, retries=1, reconnect_delay=0.5):
+        """
+        Init a new instance of PZEMBus
+
+        Args:
+            port(str): Optional, by default "/dev/ttyS0". Serial device of the bus.
+            slaves((int)): Optional, by default (1,). Slave addresses polled by sweep().
+            timeout(float): Optional, by default 2.0. Modbus reply timeout in seconds.
+            retries(int): Optional, by default 1. Times a request is sent again
+                after reopening the port on a serial error.
+            reconnect_delay(float): Optional, by default 0.5. Seconds to wait
+                before reopening the port.
+        """
+        self.port = port
+        self.slaves = tuple(slaves)
+        self.timeout = timeout
+        self.retries = retries
+        self.reconnect_delay = reconnect_delay
+        self.serial = None
+        self.master = None
+        self.requests = 0
+        self.reconnects = 0  # requests sent again after reopening the port
+        self.failures = 0  # requests that raised, timeouts and Modbus errors included
+        self.skipped_writes = 0
+        self._holding = {}  # (slave, register) -> value known to be stored in the meter
+        self._lock = threading.RLock()  # one request on the wire at a time
+        self.open()
+
+    def open(self):
+        """
+        open opens the serial port and the Modbus master, if they are not open.
+        """
+        with self._lock:
+            if self.master is not None:
+                return
+            self.serial = Serial(
+                port=self.port,
+                baudrate=9_600,
+                bytesize=8,
+                parity="N",
+                stopbits=1,
+                xonxoff=False,
+                write_timeout=2
+            )
+            self.master = modbus_rtu.RtuMaster(self.serial)
+            self.master.set_timeout(self.timeout)
+            self.master.open()
+
+    def _drop(self):
+        # forget the broken connection, the next request reopens it
+        master, self.master, self.serial = self.master, None, None
+        self._holding.clear()
+        if master is not None:
+            try:
+                master.close()
+            except (SerialException, OSError):
+                pass
+
+    def _request(self, send):
+        # send(master) runs one request, reopening the port after a serial error
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.open()
+                    self.requests += 1
+                    return send(self.master)
+                except (SerialException, OSError):
+                    self._drop()
+                    if attempt == self.retries:
+                        self.failures += 1
+                        raise
+                    self.reconnects += 1
+                    time.sleep(self.reconnect_delay)
+                except Exception:
+                    self.failures += 1
+                    raise
+
+    def execute(self, slave, function, *args, **kwargs):
+        """
+        execute runs one Modbus request, see modbus_tk Master.execute.
+        """
+        return self._request(lambda master: master.execute(slave, function, *args, **kwargs))
+
+    def read_registers(self, slave=1):
+        """
+        read_registers reads the 10 raw input registers of one meter.
+
+        Returns: tuple of int
+        """
+        return self.execute(slave, flags.READ_INPUT_REGISTERS, 0, 10)
+
+    def read(self, slave=1):
+        """
+        read reads and decodes one meter.
+
+        Returns: dict, see decode()
+        """
+        return decode(self.read_registers(slave))
+
+    def sweep(self, slaves=None):
+        """
+        sweep reads every configured meter one after another on the bus.
+
+        Args:
+            slaves((int)): Optional, by default self.slaves. Addresses to read.
+
+        Returns: dict of slave address -> decoded dict
+        """
+        return {slave: self.read(slave) for slave in (slaves or self.slaves)}
+
+    def sweep_batch(self):
+        """
+        sweep_batch reads every configured meter and decodes them in one go.
+
+        Returns: dict of field name -> numpy array, one value per slave in
+            the order of self.slaves
+        """
+        return decode_batch([self.read_registers(slave) for slave in self.slaves])
+
+    def read_holding(self, register, slave=1):
+        """
+        read_holding reads one holding register of a meter.
+
+        Returns: int
+        """
+        value = self.execute(slave, flags.READ_HOLDING_REGISTERS, register, 1)[0]
+        self._holding[(slave, register)] = value
+        return value
+
+    def write_holding(self, register, value, slave=1, force=False):
+        """
+        write_holding writes one holding register of a meter, unless it
+        already holds value. The stored value is read once and then
+        remembered until the connection is reopened.
+
+        Args:
+            register(int): holding register address
+            value(int): value to store
+            slave(int): Optional, by default 1.
+            force(bool): Optional, by default False. Write without comparing.
+
+        Returns: bool True if the register was written
+        """
+        key = (slave, register)
+        with self._lock:
+            if not force:
+                current = self._holding.get(key)
+                if current is None:
+                    current = self.read_holding(register, slave)
+                if current == value:
+                    self.skipped_writes += 1
+                    return False
+            self.execute(slave, flags.WRITE_SINGLE_REGISTER, register, output_value=value)
+            self._holding[key] = value
+            return True
+
+    def get_alarm(self, slave=1):
+        """
+        get_alarm returns the power (in W) at which the meter's alarm trips.
+        """
+        return self.read_holding(ALARM_REGISTER, slave)
+
+    def set_alarm(self, threshold, slave=1, force=False):
+        """
+        set_alarm sets the power (in W) at which the meter's alarm trips.
+        The register is only written if it holds another value.
+
+        Returns: bool True if the register was written
+        """
+        return self.write_holding(ALARM_REGISTER, threshold, slave, force)
+
+    def set_address(self, new_address, slave=0xF8):
+        """
+        set_address gives a meter a new slave address. Connect only that
+        meter while doing this: by default the general address 0xF8 is used,
+        which every PZEM-004T answers to.
+
+        Args:
+            new_address(int): the new address (1..247)
+            slave(int): Optional, by default 0xF8. Current address of the meter.
+        """
+        if not 1 <= new_address <= 247:
+            raise ValueError('Parameter "new_address" has to be in range 1..247. '
+                             'Received: {}'.format(new_address))
+        with self._lock:
+            self.execute(slave, flags.WRITE_SINGLE_REGISTER, ADDRESS_REGISTER, output_value=new_address)
+            self._holding.clear()  # the old address may now belong to another meter
+
+    def reset_energy(self, slave=1):
+        """
+        reset_energy clears the Energy counter of a meter.
+        """
+        def send(master):
+            query = master._make_query()
+            master._send(query.build_request(struct.pack(">B", RESET_ENERGY), slave))
+            # the meter echoes the address and function code
+            query.parse_response(master._recv(4))
+        self._request(send)
+
+    def close(self):
+        """
+        close closes the Modbus master and its serial port. A bus from
+        connect() is also forgotten, the next connect() opens a new one.
+        """
+        with _buses_lock:
+            if _buses.get(self.port) is self:
+                del _buses[self.port]
+        with self._lock:
+            self._drop()
+
+
+def connect(port="/dev/ttyS0", slaves=(1,), timeout=2.0):
+    """
+    connect returns the open PZEMBus of a serial port, so every part of a
+    process shares one connection. The first call for a port opens it,
+    later calls return the same bus.
+
+    Args:
+        port(str): Optional, by default "/dev/ttyS0". Serial device of the bus.
+        slaves((int)): Optional, by default (1,). Addresses added to the bus's sweep.
+        timeout(float): Optional, by default 2.0. Used when the port is opened.
+
+    Returns: PZEMBus
+    """
+    with _buses_lock:
+        bus = _buses.get(port)
+        if bus is None:
+            bus = _buses[port] = PZEMBus(port, slaves=slaves, timeout=timeout)
+        else:
+            bus.slaves += tuple(slave for slave in slaves if slave not in bus.slaves)
+        return bus
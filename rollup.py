@@ -0,0 +1,190 @@
+"""
+This file holds the online rollups of DRIP: Rollup and RollupEngine.
+
+Rows are aggregated into fixed windows aligned to the clock (a 15 min window
+starts at :00, :15, :30 and :45). When a window closes, one summary row is
+written. Memory use does not depend on how many rows a window holds.
+"""
+import math
+import os
+import re
+from datetime import datetime
+
+from running_stats import RunningStats
+
+STAT_FIELDS = ('Grams', 'Temperature', 'Humidity', 'Power', 'Current')  # mean, min, max, last
+COUNTER_FIELDS = ('Energy',)  # first, last
+DEFAULT_WINDOWS = (60, 900, 3600)
+
+_SUFFIX = re.compile(r"_\d+$")  # address suffix of extra PZEM meters, e.g. Power_2
+
+
+def window_name(seconds):
+    """
+    window_name returns a short name for a window length, e.g. 900 -> "15min".
+    """
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}min"
+    return f"{seconds}s"
+
+
+def rollup_path(path, seconds):
+    """
+    rollup_path returns the output name of a window, e.g. data_15min.csv.
+    """
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{window_name(seconds)}{ext}"
+
+
+def _matching(fields, bases):
+    # the base fields and their suffixed copies for extra meters
+    return [name for name in fields if _SUFFIX.sub('', name) in bases]
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value):
+        return value
+    return None
+
+
+class Rollup:
+    """
+    Rollup aggregates rows into consecutive windows of one length.
+    """
+
+    def __init__(self, seconds, stat_fields=STAT_FIELDS, counter_fields=COUNTER_FIELDS):
+        """
+        Init a new instance of Rollup
+
+        Args:
+            seconds(int): window length in seconds
+            stat_fields([str]): fields to keep mean, min, max and last of
+            counter_fields([str]): fields to keep first and last of
+        """
+        self.seconds = seconds
+        self.stat_fields = list(stat_fields)
+        self.counter_fields = list(counter_fields)
+        self.fields = ['Time', 'Window_End', 'Samples', 'Complete']
+        for name in self.stat_fields:
+            self.fields += [f"{name}_Mean", f"{name}_Min", f"{name}_Max", f"{name}_Last"]
+        for name in self.counter_fields:
+            self.fields += [f"{name}_First", f"{name}_Last"]
+        self.start = None
+        self._reset(None)
+
+    def _reset(self, start):
+        self.start = start
+        self.samples = 0
+        self._stats = {name: RunningStats() for name in self.stat_fields}
+        self._last = {}
+        self._first = {}
+
+    def add(self, row, timestamp):
+        """
+        add includes one row.
+
+        Args:
+            row(dict): values keyed by field name
+            timestamp(float): seconds since the epoch the row belongs to
+
+        Returns: (dict || None) the summary of the window this row closed
+        """
+        start = timestamp - timestamp % self.seconds
+        closed = None
+        if start != self.start:
+            closed = self.close()
+            self._reset(start)
+        self.samples += 1
+        for name in self.stat_fields:
+            value = _number(row.get(name))
+            if value is not None:
+                self._stats[name].add(value)
+                self._last[name] = value
+        for name in self.counter_fields:
+            value = _number(row.get(name))
+            if value is not None:
+                self._first.setdefault(name, value)
+                self._last[name] = value
+        return closed
+
+    def close(self, complete=True):
+        """
+        close returns the summary of the current window and starts none.
+
+        Args:
+            complete(bool): Optional, by default True. False marks a window
+                cut short, e.g. when the run stops.
+
+        Returns: (dict || None) None if the window has no rows
+        """
+        if not self.samples:
+            return None
+        summary = {
+            'Time': datetime.fromtimestamp(self.start).strftime('%Y-%m-%d %H:%M:%S'),
+            'Window_End': datetime.fromtimestamp(self.start + self.seconds).strftime('%Y-%m-%d %H:%M:%S'),
+            'Samples': self.samples,
+            'Complete': 1 if complete else 0,
+        }
+        for name, stats in self._stats.items():
+            if stats.count:
+                summary[f"{name}_Mean"] = stats.mean
+                summary[f"{name}_Min"] = stats.min
+                summary[f"{name}_Max"] = stats.max
+                summary[f"{name}_Last"] = self._last[name]
+        for name in self.counter_fields:
+            if name in self._first:
+                summary[f"{name}_First"] = self._first[name]
+                summary[f"{name}_Last"] = self._last[name]
+        self._reset(None)
+        return summary
+
+
+class RollupEngine:
+    """
+    RollupEngine feeds every row to one Rollup per window length and writes
+    each summary to that window's outputs as soon as the window closes.
+    """
+
+    def __init__(self, fields, open_writers, windows=DEFAULT_WINDOWS):
+        """
+        Init a new instance of RollupEngine
+
+        Args:
+            fields([str]): columns of the raw rows. The STAT_FIELDS and
+                COUNTER_FIELDS among them (with meter suffixes) are rolled up.
+            open_writers(callable): open_writers(seconds, fields) returns the
+                writers of one window length
+            windows([int]): Optional, by default 1 min, 15 min and 1 h.
+                Window lengths in seconds.
+        """
+        stat_fields = _matching(fields, STAT_FIELDS)
+        counter_fields = _matching(fields, COUNTER_FIELDS)
+        self.rollups = [Rollup(seconds, stat_fields, counter_fields) for seconds in windows]
+        self.writers = [open_writers(rollup.seconds, rollup.fields) for rollup in self.rollups]
+
+    def add(self, row, timestamp):
+        """
+        add includes one row in every window.
+        """
+        for rollup, writers in zip(self.rollups, self.writers):
+            summary = rollup.add(row, timestamp)
+            if summary is not None:
+                for writer in writers:
+                    writer.write(summary)
+
+    def close(self):
+        """
+        close writes the windows still open, marked incomplete, and closes the outputs.
+        """
+        for rollup, writers in zip(self.rollups, self.writers):
+            summary = rollup.close(complete=False)
+            for writer in writers:
+                if summary is not None:
+                    writer.write(summary)
+                writer.close()
+
+    @property
+    def paths(self):
+        return [path for writers in self.writers for writer in writers for path in writer.paths]
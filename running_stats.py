@@ -0,0 +1,48 @@
+"""
+This file holds RunningStats class
+"""
+import math
+
+
+class RunningStats:
+    """
+    RunningStats keeps count, mean, variance, min and max of a stream of
+    numbers in constant memory (Welford's algorithm).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0  # sum of squared distances from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """
+        add includes one more value.
+
+        Args:
+            value(float): the new value
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def variance(self):
+        """
+        variance returns the sample variance, 0.0 with fewer than two values.
+        """
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    def stdev(self):
+        """
+        stdev returns the sample standard deviation.
+        """
+        return math.sqrt(self.variance())
@@ -0,0 +1,110 @@
+"""
+This file holds RateScheduler class
+"""
+import time
+
+from running_stats import RunningStats
+
+
+class _Task:
+    """
+    One periodic task with its own deadline.
+    """
+
+    def __init__(self, period, start):
+        self.period = period
+        self.deadline = start
+        self.runs = 0
+        self.overruns = 0  # deadlines that passed without the task being run
+        self.jitter = RunningStats()  # how late each release was, in seconds
+
+    def release(self, now):
+        """
+        release records a run at time now and moves the deadline one period on.
+        Deadlines are multiples of the period from the start time, so a late
+        run does not shift the ones after it.
+
+        Returns: int number of deadlines that were missed and skipped
+        """
+        self.runs += 1
+        if self.period <= 0:
+            # no period, so no deadline to be late for
+            self.deadline = now
+            return 0
+        self.jitter.add(now - self.deadline)
+        self.deadline += self.period
+        if now < self.deadline:
+            return 0
+        # the task fell a whole period behind, skip the missed deadlines
+        # instead of running them back to back
+        missed = int((now - self.deadline) // self.period) + 1
+        self.deadline += missed * self.period
+        self.overruns += missed
+        return missed
+
+
+class RateScheduler:
+    """
+    RateScheduler releases tasks at fixed rates on the monotonic clock.
+    Each task has its own period, timing does not drift with the time spent
+    running the tasks, and overruns and jitter are counted instead of
+    silently stretching the period.
+    """
+
+    def __init__(self, periods, clock=time.monotonic, sleep=time.sleep):
+        """
+        Init a new instance of RateScheduler
+
+        Args:
+            periods(dict): task name -> period in seconds. A period of 0
+                releases the task on every call to wait().
+            clock(function): Optional, by default time.monotonic.
+            sleep(function): Optional, by default time.sleep.
+        """
+        self._clock = clock
+        self._sleep = sleep
+        start = clock()
+        self.tasks = {name: _Task(period, start) for name, period in periods.items()}
+        self.missed = {}  # deadlines missed in the last call to wait()
+
+    def wait(self):
+        """
+        wait sleeps until the earliest deadline and releases every task that
+        is due.
+
+        Returns: [str] names of the tasks to run now
+        """
+        now = self._clock()
+        next_deadline = min(task.deadline for task in self.tasks.values())
+        if next_deadline > now:
+            self._sleep(next_deadline - now)
+            now = self._clock()
+
+        due = []
+        self.missed = {}
+        for name, task in self.tasks.items():
+            if task.deadline <= now:
+                due.append(name)
+                missed = task.release(now)
+                if missed:
+                    self.missed[name] = missed
+        return due
+
+    def stats(self):
+        """
+        stats returns the timing statistics of every task.
+
+        Returns: dict task name -> dict with period, runs, overruns and
+            jitter_mean, jitter_std, jitter_max in seconds
+        """
+        return {
+            name: {
+                "period": task.period,
+                "runs": task.runs,
+                "overruns": task.overruns,
+                "jitter_mean": task.jitter.mean,
+                "jitter_std": task.jitter.stdev(),
+                "jitter_max": task.jitter.max if task.jitter.count else 0.0,
+            }
+            for name, task in self.tasks.items()
+        }
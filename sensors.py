@@ -0,0 +1,342 @@
+"""
+This file holds the sensors DRIP polls: the Sensor interface, the registry
+SENSORS and the built-in NAU7802Sensor, HX711Sensor, Si7021Sensor and
+PZEMSensor.
+
+A sensor declares its columns (fields), imports its driver and opens the
+device (init), returns a dict of those columns per reading (read) and
+releases the device (close). DRIP builds the sensors named in its `sensors`
+argument from SENSORS, so a sensor that is not listed is never imported,
+opened or polled and adds no columns. A new sensor is a subclass registered
+with @register, or an instance passed in `sensors` directly.
+
+Sensors are built with the DRIP instance that owns them and take their
+settings from it (pins, offsets, buses, ...).
+"""
+from nau7802_sampler import NAU7802Sampler
+from oversampling import AdaptiveOversampler
+from si7021_reader import Si7021Reader
+
+SENSORS = {}  # sensor name -> Sensor subclass
+DEFAULT_SENSORS = ("NAU7802", "Si7021", "PZEM")
+
+
+def register(cls):
+    """
+    register adds a Sensor subclass to SENSORS under its name, so it can be
+    listed in the sensors argument of DRIP.
+    """
+    SENSORS[cls.name] = cls
+    return cls
+
+
+class Sensor:
+    """
+    Sensor is one device DRIP polls. Subclasses set name and implement
+    fields and read; the other methods do nothing by default.
+    """
+    name = None
+
+    def __init__(self, drip):
+        self.drip = drip
+
+    def fields(self):
+        """
+        fields returns the column names read() returns, in output order.
+        """
+        raise NotImplementedError
+
+    def init(self):
+        """
+        init imports the driver and opens and configures the device.
+        """
+
+    def read(self, print_out=False):
+        """
+        read takes one reading.
+
+        Returns: dict of column name -> value
+        """
+        raise NotImplementedError
+
+    def check(self):
+        """
+        check takes the cheapest reading that shows the device answers, for
+        the quick self-test. By default a full read.
+        """
+        self.read()
+
+    def counters(self):
+        """
+        counters returns the totals the driver keeps, for the metrics
+        (metrics.py), e.g. {"i2c_transactions_total": 1520}.
+        """
+        return {}
+
+    def close(self):
+        """
+        close releases the device.
+        """
+
+
+class _WeightSensor(Sensor):
+    # the load cell columns: the weight, the raw weight if it is compensated
+    # for temperature and the oversampling statistics if adaptive_se is set
+
+    def __init__(self, drip):
+        super().__init__(drip)
+        self.oversampler = None
+
+    def fields(self):
+        fields = ['Grams']
+        if self.drip.compensation is not None:
+            fields.append('Grams_Raw')
+        if self.drip.adaptive_se:
+            fields += ['Grams_Samples', 'Grams_SE']
+        return fields
+
+    def init(self):
+        if self.drip.adaptive_se:
+            self.oversampler = AdaptiveOversampler(self.drip.adaptive_se, budget=self.drip.adaptive_budget)
+
+    def _output(self, grams, print_out):
+        output = {"Grams": grams}
+        compensation = self.drip.compensation
+        if compensation is not None:
+            grams = compensation.apply(grams, self.drip.last_temperature)
+            output = {"Grams": grams, "Grams_Raw": output["Grams"]}
+        oversampler = self.oversampler
+        if oversampler is not None:
+            output.update({"Grams_Samples": oversampler.last_samples, "Grams_SE": oversampler.last_se})
+
+        if print_out:
+            print("\nGrams: %0.2f g" % grams, end = "")
+            if oversampler is not None:
+                print(f" ({oversampler.last_samples} samples, SE {oversampler.last_se:.3f} g)", end = "")
+        return output
+
+
+@register
+class NAU7802Sensor(_WeightSensor):
+    """
+    NAU7802Sensor reads the load cell through the NAU7802 ADC.
+    """
+    name = "NAU7802"
+
+    def __init__(self, drip):
+        super().__init__(drip)
+        self.device = None
+        self.sampler = None
+
+    def init(self):
+        print("--- Initializing NAU7802 ---")
+        import board
+        from cedargrove_nau7802 import NAU7802
+
+        # Instantiate 24-bit load sensor ADC; two channels, default gain of 128
+        self.device = NAU7802(board.I2C(), address=0x2A, active_channels=1)
+        print(self.device.calibrate("INTERNAL"))
+        self.device.enable(True)
+        self.device.channel = 1
+        self.sampler = NAU7802Sampler(self.device)
+        super().init()
+        print(f" - NAU7802 sensor has been initialized on I2C {self.drip.nau7802_i2c_bus} "
+              f"at {self.sampler.rate_sps} samples per second")
+
+    def read(self, print_out=False):
+        if self.oversampler is not None:
+            # as many conversions as the noise needs for adaptive_se
+            raw = self.oversampler.sample(self.sampler.read, scale=self.drip.nau7802_ratio)
+        else:
+            raw = self.sampler.read_mean(self.drip.nau7802_readings)
+        output = self._output((raw - self.drip.nau7802_offset) * self.drip.nau7802_ratio, print_out)
+        if print_out:
+            print(f" ({self.sampler.last_polls} polls, {self.sampler.last_cpu * 1000:.2f} ms CPU per sample)", end = "")
+        return output
+
+    def check(self):
+        self.sampler.read()
+
+    def counters(self):
+        return {"i2c_transactions_total": self.sampler.transactions} if self.sampler is not None else {}
+
+
+@register
+class HX711Sensor(_WeightSensor):
+    """
+    HX711Sensor reads the load cell through the HX711 ADC.
+    """
+    name = "HX711"
+
+    def __init__(self, drip):
+        super().__init__(drip)
+        self.device = None
+
+    def init(self):
+        print("--- Initializing HX711 ---")
+        from hx711 import HX711
+
+        drip = self.drip
+        # the GPIO backend sets BCM numbering if no mode was set
+        self.device = HX711(dout_pin=drip.hx711_out, pd_sck_pin=drip.hx711_sck, gain_channel_A=64, select_channel='A', gpio_backend=drip.hx711_backend)
+
+        err = self.device.reset()
+        while err:
+            print('not ready')
+            err = self.device.reset()
+        print('Ready to use')
+
+        self.device.set_gain_A(gain=64)
+        self.device.select_channel(channel='A')
+        self.device.set_offset(offset=drip.hx711_offset, channel='A', gain_A=64)
+        self.device.set_scale_ratio(drip.hx711_ratio)
+        super().init()
+        print(f" - HX711 sensor has been initialized on data pin {drip.hx711_out}, sck pin {drip.hx711_sck}")
+
+    def read(self, print_out=False):
+        if self.oversampler is not None:
+            grams = self.device.get_weight_adaptive(self.oversampler)
+        else:
+            grams = self.device.get_weight_mean(self.drip.hx711_readings)
+        return self._output(grams, print_out)
+
+    def check(self):
+        self.device._read()
+
+    def counters(self):
+        if self.device is None:
+            return {}
+        return {"hx711_reads_total": self.device.reads, "hx711_invalid_reads_total": self.device.invalid_reads}
+
+    def close(self):
+        if self.device is not None:
+            # releases only the HX711 pins
+            self.device.close()
+
+
+@register
+class Si7021Sensor(Sensor):
+    """
+    Si7021Sensor reads temperature and humidity. The temperature is kept as
+    drip.last_temperature for the temperature compensation of the weight.
+    """
+    name = "Si7021"
+
+    def __init__(self, drip):
+        super().__init__(drip)
+        self.device = None
+        self.reader = None
+
+    def fields(self):
+        return ['Temperature', 'Humidity']
+
+    def init(self):
+        print("--- Initializing Si7021 ---")
+        import adafruit_si7021
+        from adafruit_extended_bus import ExtendedI2C as I2C
+
+        self.device = adafruit_si7021.SI7021(I2C(self.drip.si7021_i2c_bus))
+        self.reader = Si7021Reader(self.device)
+        print(" - Si7021 sensor has been initialized with I2C bus", self.drip.si7021_i2c_bus)
+
+    def read(self, print_out=False):
+        # one humidity conversion, the temperature comes from the same conversion
+        temperature, humidity = self.reader.read()
+        self.drip.last_temperature = temperature
+
+        output = {
+            "Temperature": temperature,
+            "Humidity": humidity
+        }
+
+        if print_out:
+            print("\nTemperature: %0.1f C" % temperature)
+            print("Humidity: %0.1f %%" % humidity)
+
+        return output
+
+    def counters(self):
+        return {"i2c_transactions_total": self.reader.transactions} if self.reader is not None else {}
+
+
+@register
+class PZEMSensor(Sensor):
+    """
+    PZEMSensor reads every PZEM-004T meter on the serial port in one sweep.
+    The first meter uses the plain column names, every other meter gets its
+    address as suffix, for example Power_2.
+    """
+    name = "PZEM"
+    threshold = 50_000  # alarm threshold in W written to every meter
+
+    def __init__(self, drip):
+        super().__init__(drip)
+        self.bus = None
+
+    def fields(self):
+        from pzem import FIELDS
+        names = [*FIELDS[:-1], "Threshold", FIELDS[-1]]
+        fields = []
+        slaves = self.drip.pzem_slaves
+        for slave in slaves:
+            suffix = "" if slave == slaves[0] else f"_{slave}"
+            fields += [name + suffix for name in names]
+        return fields
+
+    def init(self):
+        print("--- Initializing PZEM-004T ---")
+        import pzem
+
+        slaves = self.drip.pzem_slaves
+        # every meter on the serial port is polled through the same Modbus master,
+        # shared with anything else in the process that uses the port
+        self.bus = pzem.connect(self.drip.pzem_interface_path, slaves=slaves, timeout=2.0)
+        for slave in slaves:
+            # the threshold is kept by the meter, only write it when it changed
+            if self.bus.set_alarm(self.threshold, slave):
+                print(f" - PZEM-004T {slave}: alarm threshold set to {self.threshold} W")
+        print(f" - PZEM-004T sensor has been initialized on {self.drip.pzem_interface_path}, "
+              f"slave addresses {', '.join(str(slave) for slave in slaves)}")
+
+    def read(self, print_out=False):
+        output = {}
+        slaves = self.drip.pzem_slaves
+        # one sweep over every meter on the bus. The suffix follows the slave address,
+        # not the order of the sweep result, so it always matches fields()
+        for slave, data in self.bus.sweep(slaves).items():
+            suffix = "" if slave == slaves[0] else f"_{slave}"
+            output.update({name + suffix: value for name, value in data.items()})
+            output["Threshold" + suffix] = self.threshold
+
+            if print_out:
+                if len(slaves) > 1:
+                    print(f"- slave {slave} -")
+                print("Voltage: %.1f V" % data["Voltage"])
+                print("Current: %.3f A" % data["Current"])
+                print("Power: %.1f W" % data["Power"])
+                print("Energy: %d Wh" % data["Energy"])
+                print("Frequency: %.1f Hz" % data["Frequency"])
+                print("Power Factor: %.2f" % data["Power_Factor"])
+                print("Threshold: %d" % self.threshold)
+                print("Alarm Status:", "ON" if data["Alarm_Status"] else "OFF")
+
+        return output
+
+    def check(self):
+        for slave in self.drip.pzem_slaves:
+            self.bus.read(slave)
+
+    def counters(self):
+        if self.bus is None:
+            return {}
+        # the bus may be shared with other users of the port, the counts include them
+        return {
+            "modbus_requests_total": self.bus.requests,
+            "modbus_retries_total": self.bus.reconnects,
+            "modbus_failures_total": self.bus.failures,
+            "modbus_skipped_writes_total": self.bus.skipped_writes,
+        }
+
+    def close(self):
+        if self.bus is not None:
+            self.bus.close()
@@ -0,0 +1,249 @@
+"""
+This file holds the live sample ring of DRIP: SharedRingWriter and
+SharedRingReader.
+
+The writer keeps the last `capacity` rows of a run in a block of
+multiprocessing.shared_memory, so any number of local processes (plotters,
+alarm checkers) can follow the run without files, pipes or locks. Every
+numeric column is stored as float64, Time as seconds since the epoch; text
+columns ({name}_Time) are left out, {name}_Age carries the staleness.
+
+Layout (little-endian):
+
+    0   magic b"DRIPRING", version (u4), number of fields (u4)
+    16  capacity (u8), rows per ring
+    24  sequence (u8), 2 * rows written, odd while a row is written
+    32  length (u4) of the field names, JSON at FIELDS_OFFSET
+    DATA_OFFSET  capacity x fields float64, row k at slot k % capacity
+
+The sequence is a seqlock: the writer makes it odd, writes the row and makes
+it even again. A reader takes the rows before the sequence it read first and
+checks the sequence again afterwards. The rows are intact if the writer has
+not started to overwrite their slots in the meantime, otherwise the reader
+tries again. The writer never waits for the readers.
+
+Usage:
+    python shared_ring.py drip2 -n 5
+"""
+import argparse
+import json
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+MAGIC = b"DRIPRING"
+VERSION = 1
+FIELDS_OFFSET = 64
+FIELDS_SIZE = 4096  # bytes for the JSON list of field names
+DATA_OFFSET = FIELDS_OFFSET + FIELDS_SIZE
+SEQUENCE_OFFSET = 24
+_HEADER = struct.Struct("<8sIIQQI")
+_SEQUENCE = struct.Struct("<Q")
+
+
+class SharedRingWriter:
+    """
+    SharedRingWriter publishes rows into a shared memory ring. It has the
+    write / close interface of StreamWriter, so DRIP treats it as one more
+    output of a run.
+    """
+
+    def __init__(self, name, fields, capacity=4096):
+        """
+        Init a new instance of SharedRingWriter
+
+        Args:
+            name(str): name of the shared memory block, readers attach with it
+            fields([str]): columns of the rows. Text columns ending in _Time
+                are not stored.
+            capacity(int): Optional, by default 4096. Rows kept.
+        """
+        if capacity < 1:
+            raise ValueError('capacity has to be at least 1. Received: {}'.format(capacity))
+        self.fields = [field for field in fields if not field.endswith('_Time')]
+        names = json.dumps(self.fields).encode()
+        if len(names) > FIELDS_SIZE:
+            raise ValueError('fields have to fit in {} bytes of JSON. Received: {} bytes'.format(FIELDS_SIZE, len(names)))
+        self.name = name
+        self.capacity = capacity
+        self.paths = [f"shared memory {name}"]
+        self.rows_written = 0
+        size = DATA_OFFSET + capacity * len(self.fields) * 8
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a run that did not exit cleanly, readers of it keep their copy
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self._buf = self.shm.buf
+        self._row = struct.Struct(f"<{len(self.fields)}d")
+        self._row_size = self._row.size
+        _HEADER.pack_into(self._buf, 0, MAGIC, VERSION, len(self.fields), capacity, 0, len(names))
+        self._buf[FIELDS_OFFSET:FIELDS_OFFSET + len(names)] = names
+        self._sequence = 0
+
+    @staticmethod
+    def _number(value):
+        if value is None or value is False or isinstance(value, str):
+            return float("nan")
+        return float(value)
+
+    def write(self, row):
+        """
+        write publishes one row. Missing, text and False values are stored as NaN.
+        """
+        values = [time.time() if field == 'Time' else self._number(row.get(field)) for field in self.fields]
+        offset = DATA_OFFSET + (self.rows_written % self.capacity) * self._row_size
+        self._sequence += 1  # odd: the slot is being written
+        _SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, self._sequence)
+        self._row.pack_into(self._buf, offset, *values)
+        self._sequence += 1
+        _SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, self._sequence)
+        self.rows_written += 1
+
+    def flush(self):
+        """
+        flush does nothing, rows are visible as soon as they are written.
+        """
+
+    def close(self):
+        """
+        close removes the shared memory block. Readers that are attached keep
+        their mapping until they close it.
+        """
+        if self.shm is None:
+            return
+        self._buf = None
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class SharedRingReader:
+    """
+    SharedRingReader reads the latest rows of a SharedRingWriter from
+    another process. It only reads the shared memory, the writer is never
+    held up.
+    """
+
+    def __init__(self, name):
+        """
+        Init a new instance of SharedRingReader
+
+        Args:
+            name(str): name of the shared memory block
+
+        Raises:
+            FileNotFoundError: if no run publishes under this name
+            ValueError: if the block is not a DRIP ring
+        """
+        # numpy is only needed to read, the writer in the acquisition process does not use it
+        import numpy as np
+
+        if sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # the resource tracker would remove the writer's block when this process exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        magic, version, n_fields, capacity, _, length = _HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError('shared memory {} has to hold a DRIP ring. Received: {!r} version {}'.format(name, magic, version))
+        self.name = name
+        self.capacity = capacity
+        self.fields = json.loads(bytes(self.shm.buf[FIELDS_OFFSET:FIELDS_OFFSET + length]))
+        self.data = np.ndarray((capacity, n_fields), dtype="<f8", buffer=self.shm.buf, offset=DATA_OFFSET)
+        self._sequence = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=SEQUENCE_OFFSET)
+        self._np = np
+
+    @property
+    def count(self):
+        """
+        count returns the number of rows written so far.
+        """
+        return int(self._sequence[0]) // 2
+
+    def views(self, n):
+        """
+        views returns the latest n rows (fewer while the ring is filling up)
+        without copying them: up to two views into the shared memory, oldest
+        first. Check intact(start, n) after using them.
+
+        Returns: (int, [numpy.ndarray]) index of the first row and the views
+        """
+        count = self.count
+        n = min(n, count, self.capacity)
+        start = count - n
+        first = start % self.capacity
+        if first + n <= self.capacity:
+            return start, [self.data[first:first + n]]
+        return start, [self.data[first:], self.data[:first + n - self.capacity]]
+
+    def intact(self, start, n):
+        """
+        intact returns True if the writer has not started to overwrite any of
+        the n rows from row start since they were taken with views().
+        """
+        started = (int(self._sequence[0]) + 1) // 2  # rows written or being written
+        return started <= start + self.capacity
+
+    def latest(self, n, retries=100):
+        """
+        latest copies the latest n rows (fewer while the ring is filling up).
+
+        Returns: numpy.ndarray of (rows, fields), oldest first
+
+        Raises:
+            RuntimeError: if the writer overwrote the rows on every try
+        """
+        for _ in range(retries):
+            start, views = self.views(n)
+            rows = self._np.concatenate(views) if len(views) > 1 else views[0].copy()
+            if self.intact(start, len(rows)):
+                return rows
+        raise RuntimeError('the ring {} was overwritten on every read, read fewer rows'.format(self.name))
+
+    def column(self, name, n):
+        """
+        column returns the latest n values of one field, see latest().
+        """
+        return self.latest(n)[:, self.fields.index(name)]
+
+    def close(self):
+        """
+        close unmaps the shared memory. The writer's block is not removed.
+        """
+        self.data = self._sequence = None
+        self.shm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the latest rows of a running DRIP unit.")
+    parser.add_argument("name", type=str, help="Name of the shared memory block (live_buffer of DRIP)")
+    parser.add_argument("-n", "--rows", dest="rows", type=int, default=5, help="Rows to print, defaults to 5")
+    parser.add_argument("-f", "--follow", dest="follow", action="store_true", help="Keep printing new rows")
+    args = parser.parse_args()
+
+    reader = SharedRingReader(args.name)
+    print(",".join(reader.fields))
+    shown = reader.count - min(args.rows, reader.count)
+    try:
+        while True:
+            count = reader.count
+            if count > shown:
+                for row in reader.latest(min(count - shown, reader.capacity)):
+                    print(",".join('' if value != value else f"{value:g}" if abs(value) < 1e9 else f"{value:.3f}"
+                                   for value in row.tolist()))
+                shown = count
+            if not args.follow:
+                break
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
@@ -0,0 +1,101 @@
+"""
+This file holds Si7021Reader class
+"""
+import struct
+import time
+
+MEASURE_HUMIDITY = 0xF5  # measure relative humidity, no hold master mode
+READ_PREVIOUS_TEMPERATURE = 0xE0  # temperature measured during the last RH conversion
+
+
+def _crc8(data):
+    """CRC-8 used by the Si7021, polynomial x^8 + x^5 + x^4 + 1."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x131) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+
+class Si7021Reader:
+    """
+    Si7021Reader takes humidity and temperature with a single conversion.
+    Every relative humidity conversion also measures temperature, and that
+    value can be fetched without a new conversion, so one reading costs one
+    conversion instead of two.
+    """
+
+    def __init__(self, sensor, conversion_time=0.02, poll_sleep=0.002, timeout=0.5):
+        """
+        Init a new instance of Si7021Reader
+
+        Args:
+            sensor(SI7021): the adafruit_si7021 driver object. Its I2C device is reused.
+            conversion_time(float): Optional, by default 20 ms. Sleep before the
+                first poll. A 12-bit RH conversion plus its temperature takes up to 23 ms.
+            poll_sleep(float): Optional, by default 2 ms. Sleep between polls
+                while the sensor is still converting.
+            timeout(float): Optional, by default 0.5 s.
+
+        Raises:
+            RuntimeError: from read() if the conversion does not finish in time
+            ValueError: from read() if the humidity checksum does not match
+        """
+        self.i2c_device = sensor.i2c_device
+        self.conversion_time = conversion_time
+        self.poll_sleep = poll_sleep
+        self.timeout = timeout
+        self.transactions = 0  # I2C transactions, polls of a busy sensor included
+
+    def _read_humidity_raw(self):
+        with self.i2c_device as i2c:
+            i2c.write(bytes([MEASURE_HUMIDITY]))
+        self.transactions += 1
+        time.sleep(self.conversion_time)
+
+        data = bytearray(3)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            # while converting the sensor does not acknowledge reads
+            self.transactions += 1
+            try:
+                with self.i2c_device as i2c:
+                    i2c.readinto(data)
+            except OSError:
+                pass
+            else:
+                if data[0] != 0xFF:
+                    break
+            if time.monotonic() > deadline:
+                raise RuntimeError('Si7021 humidity conversion timed out')
+            time.sleep(self.poll_sleep)
+
+        value, checksum = struct.unpack(">HB", data)
+        if checksum != _crc8(data[:2]):
+            raise ValueError('Si7021 humidity CRC mismatch')
+        return value
+
+    def _read_previous_temperature_raw(self):
+        data = bytearray(2)
+        self.transactions += 1
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(bytes([READ_PREVIOUS_TEMPERATURE]), data)
+        return struct.unpack(">H", data)[0]
+
+    def read(self):
+        """
+        read runs one humidity conversion and fetches the temperature
+        measured with it.
+
+        Returns: (float, float) temperature in degrees Celsius and
+            relative humidity in percent
+        """
+        raw_humidity = self._read_humidity_raw()
+        raw_temperature = self._read_previous_temperature_raw()
+        humidity = min(100.0, raw_humidity * 125.0 / 65536.0 - 6.0)
+        temperature = raw_temperature * 175.72 / 65536.0 - 46.85
+        return temperature, humidity
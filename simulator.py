@@ -0,0 +1,1053 @@
+"""
+This file holds the hardware simulator that lets DRIP run off the Raspberry Pi.
+
+It provides stand-ins for every driver drip.py imports:
+ - RPi.GPIO and lgpio with an emulated HX711 that is clocked bit by bit
+ - board / adafruit_extended_bus returning virtual I2C buses
+ - cedargrove_nau7802 and adafruit_si7021 talking to register-level
+   NAU7802 and Si7021 emulations on those buses
+ - a PZEM-004T Modbus RTU slave served on a pseudo terminal, read with the
+   real pyserial and modbus_tk stack
+
+Every simulated part takes noise, latency and fault injection settings.
+
+Usage:
+    import simulator
+    sim = simulator.install()  # before importing drip
+    from drip import DRIP
+    drip = DRIP(drip_id=1, si7021_i2c_bus=10, pzem_interface_path=sim.pzem_path)
+    drip.run_all(iterations=100, sleep=0)
+    sim.close()
+"""
+import argparse
+import math
+import os
+import random
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+import types
+
+
+def _spin(seconds):
+    """Busy wait, time.sleep is far too coarse for microsecond latencies."""
+    if seconds <= 0:
+        return
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _wait(seconds):
+    if seconds <= 0:
+        return
+    if seconds < 0.001:
+        _spin(seconds)
+    else:
+        time.sleep(seconds)
+
+
+class Environment:
+    """
+    Environment is the physical world shared by the simulated sensors:
+    the water collected in the tank, the room climate and the electrical
+    load of the dehumidifier.
+    """
+
+    def __init__(self,
+                 grams=1000.0,
+                 fill_rate=0.05,
+                 temperature=24.0,
+                 humidity=55.0,
+                 power=350.0,
+                 voltage=230.0,
+                 frequency=50.0,
+                 power_factor=0.95):
+        """
+        Init a new instance of Environment
+
+        Args:
+            grams(float): Optional, by default 1000. Water in the tank at the start.
+            fill_rate(float): Optional, by default 0.05. Grams of water collected per second.
+            temperature(float): Optional, by default 24. Mean room temperature in C.
+            humidity(float): Optional, by default 55. Mean relative humidity in %.
+            power(float): Optional, by default 350. Power drawn by the dehumidifier in W.
+            voltage(float), frequency(float), power_factor(float): mains values.
+        """
+        self.start = time.monotonic()
+        self.initial_grams = grams
+        self.fill_rate = fill_rate
+        self.base_temperature = temperature
+        self.base_humidity = humidity
+        self.power_w = power
+        self.voltage_v = voltage
+        self.frequency_hz = frequency
+        self.power_factor = power_factor
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def grams(self):
+        return self.initial_grams + self.fill_rate * self.elapsed()
+
+    def temperature(self):
+        # slow daily-like swing, compressed to one hour
+        return self.base_temperature + math.sin(2 * math.pi * self.elapsed() / 3600)
+
+    def humidity(self):
+        return self.base_humidity + 2 * math.cos(2 * math.pi * self.elapsed() / 3600)
+
+    def power(self):
+        return self.power_w
+
+
+# ----------------------------------------------------------------------------
+# GPIO and HX711
+# ----------------------------------------------------------------------------
+
+class SimHX711:
+    """
+    SimHX711 emulates the HX711 serial interface: DOUT goes low when a
+    conversion is ready, every rising edge of PD_SCK shifts out the next bit,
+    25 to 27 pulses per word select the next channel and gain, and holding
+    PD_SCK high for 60 us or more powers the chip down.
+    """
+
+    def __init__(self,
+                 environment,
+                 dout_pin=3,
+                 pd_sck_pin=2,
+                 rate_sps=10,
+                 offset=-4143700,
+                 ratio=105.521408839779,
+                 noise=40.0,
+                 fault_rate=0.0,
+                 seed=None):
+        """
+        Init a new instance of SimHX711
+
+        Args:
+            environment(Environment): source of the weight on the load cell
+            dout_pin(int), pd_sck_pin(int): Optional, by default 3 and 2.
+            rate_sps(int): Optional, by default 10. Conversions per second (10 || 80).
+            offset(int), ratio(float): raw value = offset + grams * ratio
+            noise(float): Optional, by default 40. Standard deviation in raw counts.
+            fault_rate(float): Optional, by default 0. Probability that a word
+                is the invalid 0x7fffff / 0x800000 value.
+        """
+        self.environment = environment
+        self.dout_pin = dout_pin
+        self.pd_sck_pin = pd_sck_pin
+        self.period = 1 / rate_sps
+        self.offset = offset
+        self.ratio = ratio
+        self.noise = noise
+        self.fault_rate = fault_rate
+        self._random = random.Random(seed)
+
+        self._start = time.perf_counter()  # conversions are counted from here
+        self._consumed = -1  # index of the last conversion shifted out
+        self._word = 0
+        self._pulses = 0  # rising edges since the word started, 0 when idle
+        self._out = 1
+        self._sck = False
+        self._sck_rise = 0.0
+        self._seen_ready = False
+        self.gain_pulses = 1  # 1: A/128, 2: B/32, 3: A/64
+        self.words = 0
+        self.power_downs = 0
+
+    def _ready(self, now):
+        return now >= self._start and int((now - self._start) / self.period) > self._consumed
+
+    def _sample(self):
+        if self.fault_rate and self._random.random() < self.fault_rate:
+            return self._random.choice((0x7fffff, 0x800000))
+        value = self.offset + self.environment.grams() * self.ratio
+        value = int(round(self._random.gauss(value, self.noise)))
+        value = max(-0x7fffff, min(0x7ffffe, value))
+        return value & 0xffffff  # 24-bit two's complement
+
+    def dout(self):
+        if 0 < self._pulses < 25:
+            return self._out
+        # idle, or the word and its gain pulses are done
+        if self._ready(time.perf_counter()):
+            self._seen_ready = True
+            return 0
+        return 1
+
+    def clock(self, level):
+        now = time.perf_counter()
+        if level and not self._sck:
+            self._sck_rise = now
+            # after the gain pulses a new word starts only once the reader
+            # has seen DOUT go low, or after the third gain pulse
+            if self._pulses == 0 or (self._pulses >= 25 and self._ready(now)
+                                     and (self._seen_ready or self._pulses >= 27)):
+                if self._pulses >= 25:
+                    self.gain_pulses = self._pulses - 24
+                    self._pulses = 0
+                if self._ready(now):
+                    self._consumed = int((now - self._start) / self.period)
+                    self._word = self._sample()
+                    self._pulses = 1
+                    self._seen_ready = False
+                    self._out = (self._word >> 23) & 1
+                    self.words += 1
+            else:
+                self._pulses += 1
+                self._out = (self._word >> (24 - self._pulses)) & 1 if self._pulses <= 24 else 1
+        elif not level and self._sck:
+            if now - self._sck_rise >= 0.00006:
+                # PD_SCK was high for 60 us or more: power down, and on power
+                # up the chip resets and needs a few conversions to settle
+                self.power_downs += 1
+                self._pulses = 0
+                self._out = 1
+                self.gain_pulses = 1
+                self._start = now + 3 * self.period
+                self._consumed = -1
+        self._sck = level
+
+
+class SimGPIO:
+    """
+    SimGPIO stands in for the RPi.GPIO module. Pins that belong to an
+    attached SimHX711 are routed to it, every other pin just keeps its level.
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    def __init__(self, latency=0.0, stall_rate=0.0, stall_time=0.0001, seed=None):
+        """
+        Init a new instance of SimGPIO
+
+        Args:
+            latency(float): Optional, by default 0. Seconds each output() and input() call takes.
+            stall_rate(float): Optional, by default 0. Probability that an output() call
+                is preempted, like a busy Pi Zero does.
+            stall_time(float): Optional, by default 100 us. Length of a preemption.
+        """
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self._random = random.Random(seed)
+        self._mode = None
+        self._levels = {}
+        self._clocks = {}  # pd_sck pin -> SimHX711
+        self._douts = {}  # dout pin -> SimHX711
+        self.calls = 0
+
+    def attach(self, chip):
+        self._clocks[chip.pd_sck_pin] = chip
+        self._douts[chip.dout_pin] = chip
+
+    def setmode(self, mode):
+        self._mode = mode
+
+    def getmode(self):
+        return self._mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        if initial is not None:
+            self.output(pin, initial)
+
+    def output(self, pin, value):
+        self.calls += 1
+        level = bool(value)
+        chip = self._clocks.get(pin)
+        if chip is not None:
+            chip.clock(level)
+        else:
+            self._levels[pin] = level
+        _spin(self.latency)
+        if self.stall_rate and self._random.random() < self.stall_rate:
+            _spin(self.stall_time)
+
+    def input(self, pin):
+        self.calls += 1
+        _spin(self.latency)
+        chip = self._douts.get(pin)
+        if chip is not None:
+            return chip.dout()
+        return int(self._levels.get(pin, False))
+
+    def cleanup(self, *pins):
+        self._levels.clear()
+
+    def lgpio(self):
+        """
+        lgpio returns a stand-in lgpio module on the same pins.
+        """
+        module = types.ModuleType("lgpio")
+        module.gpiochip_open = lambda chip: chip
+        module.gpiochip_close = lambda handle: None
+        module.gpio_claim_output = lambda handle, gpio, level=0, lFlags=0: self.output(gpio, level)
+        module.gpio_claim_input = lambda handle, gpio, lFlags=0: None
+        module.gpio_free = lambda handle, gpio: None
+        module.gpio_write = lambda handle, gpio, level: self.output(gpio, level)
+        module.gpio_read = lambda handle, gpio: self.input(gpio)
+        return module
+
+
+# ----------------------------------------------------------------------------
+# I2C
+# ----------------------------------------------------------------------------
+
+class VirtualI2C:
+    """
+    VirtualI2C stands in for a busio / ExtendedI2C bus. Devices are
+    registered by address and every transaction is counted.
+    """
+
+    def __init__(self, bus_id):
+        self.bus_id = bus_id
+        self.devices = {}
+        self.transactions = 0
+        self._lock = threading.Lock()
+
+    def attach(self, address, device):
+        self.devices[address] = device
+
+    def _device(self, address):
+        self.transactions += 1
+        device = self.devices.get(address)
+        if device is None:
+            raise OSError(121, 'Remote I/O error')  # no ACK from the address
+        _wait(device.latency)
+        return device
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._device(address).write(bytes(buffer[start:end]))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        data = self._device(address).read(end - start)
+        buffer[start:end] = data
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        device = self._device(address)
+        device.write(bytes(buffer_out[out_start:out_end]))
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = device.read(in_end - in_start)
+
+    def deinit(self):
+        pass
+
+
+class SimI2CDevice:
+    """
+    SimI2CDevice mirrors adafruit_bus_device.i2c_device.I2CDevice on a
+    VirtualI2C bus.
+    """
+
+    def __init__(self, i2c, device_address):
+        self.i2c = i2c
+        self.device_address = device_address
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            time.sleep(0)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.i2c.unlock()
+        return False
+
+    def write(self, buf, *, start=0, end=None):
+        self.i2c.writeto(self.device_address, buf, start=start, end=end)
+
+    def readinto(self, buf, *, start=0, end=None):
+        self.i2c.readfrom_into(self.device_address, buf, start=start, end=end)
+
+    def write_then_readinto(self, out_buffer, in_buffer, *,
+                            out_start=0, out_end=None, in_start=0, in_end=None):
+        self.i2c.writeto_then_readfrom(self.device_address, out_buffer, in_buffer,
+                                       out_start=out_start, out_end=out_end,
+                                       in_start=in_start, in_end=in_end)
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x131) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class SimSi7021Device:
+    """
+    SimSi7021Device emulates the Si7021 command set on the bus: no-hold
+    humidity and temperature conversions (reads are not acknowledged until
+    the conversion is done), read temperature from the previous RH
+    conversion, reset and the USER1 register.
+    """
+
+    RH_TIME = 0.0225  # 12-bit RH plus 14-bit temperature, worst case
+    TEMPERATURE_TIME = 0.0108
+
+    def __init__(self, environment, noise=0.05, latency=0.0002, fault_rate=0.0, seed=None):
+        """
+        Init a new instance of SimSi7021Device
+
+        Args:
+            environment(Environment): source of temperature and humidity
+            noise(float): Optional, by default 0.05. Standard deviation in C and %RH.
+            latency(float): Optional, by default 0.2 ms per I2C transaction.
+            fault_rate(float): Optional, by default 0. Probability that a
+                conversion result has a bad checksum.
+        """
+        self.environment = environment
+        self.noise = noise
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self._random = random.Random(seed)
+        self._command = None
+        self._ready_at = 0.0
+        self._result = None
+        self._last_temperature = 0
+        self.conversions = 0
+
+    def _raw_temperature(self):
+        value = self._random.gauss(self.environment.temperature(), self.noise)
+        return int((value + 46.85) * 65536 / 175.72) & 0xFFFC
+
+    def _raw_humidity(self):
+        value = self._random.gauss(self.environment.humidity(), self.noise)
+        return int((value + 6.0) * 65536 / 125.0) & 0xFFFC
+
+    def write(self, data):
+        command = data[0]
+        now = time.monotonic()
+        if command == 0xF5:
+            self.conversions += 1
+            self._last_temperature = self._raw_temperature()
+            self._result = self._raw_humidity()
+            self._ready_at = now + self.RH_TIME
+        elif command == 0xF3:
+            self.conversions += 1
+            self._last_temperature = self._raw_temperature()
+            self._result = self._last_temperature
+            self._ready_at = now + self.TEMPERATURE_TIME
+        self._command = command
+
+    def read(self, length):
+        command = self._command
+        if command in (0xF5, 0xF3):
+            if time.monotonic() < self._ready_at:
+                raise OSError(121, 'Remote I/O error')  # still converting
+            data = bytearray(struct.pack(">H", self._result))
+            crc = _crc8(data)
+            if self.fault_rate and self._random.random() < self.fault_rate:
+                crc ^= 0xFF
+            data.append(crc)
+            self._command = None
+            return bytes(data[:length])
+        if command == 0xE0:
+            return struct.pack(">H", self._last_temperature)[:length]
+        if command == 0xE7:
+            return bytes([0x3A])[:length]
+        if command == 0x11:
+            return bytes([0x00])[:length]
+        return bytes([0xFF] * length)
+
+
+class SimSI7021:
+    """
+    SimSI7021 mirrors the adafruit_si7021.SI7021 driver on a VirtualI2C bus.
+    """
+
+    def __init__(self, i2c_bus, address=0x40):
+        self.i2c_device = SimI2CDevice(i2c_bus, address)
+        self.heater_level = 0
+        with self.i2c_device as i2c:
+            i2c.write(bytes([0xFE]))
+
+    def _measure(self, command):
+        with self.i2c_device as i2c:
+            i2c.write(bytes([command]))
+        data = bytearray(3)
+        while True:
+            try:
+                with self.i2c_device as i2c:
+                    i2c.readinto(data)
+            except OSError:
+                pass
+            else:
+                break
+        value, checksum = struct.unpack(">HB", data)
+        if checksum != _crc8(data[:2]):
+            raise ValueError("CRC mismatch")
+        return value
+
+    @property
+    def relative_humidity(self):
+        return min(100.0, self._measure(0xF5) * 125.0 / 65536.0 - 6.0)
+
+    @property
+    def temperature(self):
+        return self._measure(0xF3) * 175.72 / 65536.0 - 46.85
+
+
+class SimNAU7802Device:
+    """
+    SimNAU7802Device emulates the NAU7802 registers the driver uses:
+    PU_CTRL with the power up and cycle ready bits, CTRL1 / CTRL2 with gain,
+    calibration, conversion rate and channel, and the ADCO result registers.
+    Conversions run continuously at the configured rate once started.
+    """
+
+    PU_CTRL = 0x00
+    CTRL2 = 0x02
+    ADCO_B2 = 0x12
+    ADCO_B1 = 0x13
+    ADCO_B0 = 0x14
+    RATES = {0: 10, 1: 20, 2: 40, 3: 80, 7: 320}
+
+    def __init__(self,
+                 environment,
+                 rate_sps=10,
+                 offset=-489440,
+                 ratio=-0.0007049150751308024,
+                 noise=30.0,
+                 latency=0.0002,
+                 fault_rate=0.0,
+                 seed=None):
+        """
+        Init a new instance of SimNAU7802Device
+
+        Args:
+            environment(Environment): source of the weight on the load cell
+            rate_sps(int): Optional, by default 10. Conversions per second the chip
+                comes out of reset with (a real NAU7802 always starts at 10).
+            offset(int), ratio(float): grams = (raw - offset) * ratio, as in DRIP
+            noise(float): Optional, by default 30. Standard deviation in raw counts.
+            latency(float): Optional, by default 0.2 ms per I2C transaction.
+            fault_rate(float): Optional, by default 0. Probability that a
+                conversion is a full-scale spike.
+        """
+        self.environment = environment
+        self.offset = offset
+        self.ratio = ratio
+        self.noise = noise
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self._random = random.Random(seed)
+        self.registers = bytearray(0x20)
+        self._rate_code = {rate: code for code, rate in self.RATES.items()}[rate_sps]
+        self.registers[self.CTRL2] = self._rate_code << 4
+        self._pointer = 0
+        self._start = None  # conversions start when the cycle start bit is set
+        self._consumed = -1
+        self._latched = 0
+        self.conversions = 0
+
+    def _period(self):
+        return 1 / self.RATES.get((self.registers[self.CTRL2] >> 4) & 0x7, 10)
+
+    def _index(self):
+        if self._start is None:
+            return -1
+        return int((time.monotonic() - self._start) / self._period())
+
+    def _sample(self):
+        if self.fault_rate and self._random.random() < self.fault_rate:
+            return self._random.choice((0x7fffff, -0x800000))
+        raw = self.offset + self.environment.grams() / self.ratio
+        return max(-0x800000, min(0x7fffff, int(round(self._random.gauss(raw, self.noise)))))
+
+    def write(self, data):
+        self._pointer = data[0]
+        if len(data) < 2:
+            return
+        value = data[1]
+        if self._pointer == self.PU_CTRL:
+            if value & 0x01:  # register reset
+                self.registers[:] = bytes(len(self.registers))
+                self.registers[self.CTRL2] = self._rate_code << 4
+                self._start = None
+            if value & 0x02:  # digital power up, ready straight away
+                value |= 0x08
+            if value & 0x10 and self._start is None:  # cycle start
+                self._start = time.monotonic()
+                self._consumed = -1
+        elif self._pointer == self.CTRL2:
+            value &= ~0x04  # calibration finishes immediately
+        self.registers[self._pointer] = value
+
+    def read(self, length):
+        out = bytearray()
+        for _ in range(length):
+            register = self._pointer
+            if register == self.PU_CTRL:
+                value = self.registers[register] & ~0x20
+                if self._index() > self._consumed:
+                    value |= 0x20  # cycle ready
+                out.append(value)
+            elif register == self.ADCO_B2:
+                index = self._index()
+                if index > self._consumed:
+                    self._consumed = index
+                    self.conversions += 1
+                    self._latched = self._sample() & 0xffffff
+                out.append((self._latched >> 16) & 0xFF)
+            elif register == self.ADCO_B1:
+                out.append((self._latched >> 8) & 0xFF)
+            elif register == self.ADCO_B0:
+                out.append(self._latched & 0xFF)
+            else:
+                out.append(self.registers[register])
+            self._pointer += 1
+        return bytes(out)
+
+
+class SimNAU7802:
+    """
+    SimNAU7802 mirrors the cedargrove_nau7802.NAU7802 driver on a VirtualI2C bus.
+    """
+
+    def __init__(self, i2c_bus, address=0x2A, active_channels=1):
+        self.i2c_device = SimI2CDevice(i2c_bus, address)
+        self._act_channels = active_channels
+        self._write(0x00, 0x01)  # register reset
+        self._write(0x00, 0x02)  # digital power up
+
+    def _read(self, register):
+        data = bytearray(1)
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(bytes([register]), data)
+        return data[0]
+
+    def _write(self, register, value):
+        with self.i2c_device as i2c:
+            i2c.write(bytes([register, value]))
+
+    @property
+    def channel(self):
+        return ((self._read(0x02) >> 7) & 1) + 1
+
+    @channel.setter
+    def channel(self, chan=1):
+        self.read()
+        if chan not in (1, 2) or chan > self._act_channels:
+            raise ValueError("Invalid Channel Number")
+        value = self._read(0x02)
+        self._write(0x02, (value & 0x7F) | ((chan - 1) << 7))
+
+    @property
+    def poll_rate(self):
+        return (self._read(0x02) >> 4) & 0x7
+
+    @property
+    def gain(self):
+        return 1 << (self._read(0x01) & 0x7)
+
+    def enable(self, power=True):
+        if power:
+            self._write(0x00, self._read(0x00) | 0x06)
+            self._write(0x00, self._read(0x00) | 0x10)  # cycle start
+            return bool(self._read(0x00) & 0x08)
+        self._write(0x00, self._read(0x00) & ~0x16)
+        return False
+
+    def available(self):
+        return bool(self._read(0x00) & 0x20)
+
+    def read(self):
+        adc = self._read(0x12) << 16 | self._read(0x13) << 8 | self._read(0x14)
+        if adc & 0x800000:
+            adc -= 1 << 24
+        return float(adc)
+
+    def calibrate(self, mode="INTERNAL"):
+        modes = {"INTERNAL": 0, "OFFSET": 2, "GAIN": 3}
+        if mode not in modes:
+            raise ValueError("Invalid Calibration Mode")
+        value = self._read(0x02)
+        self._write(0x02, (value & ~0x03) | modes[mode] | 0x04)
+        return not self._read(0x02) & 0x08
+
+
+# ----------------------------------------------------------------------------
+# PZEM-004T
+# ----------------------------------------------------------------------------
+
+def _crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+class SimPZEM:
+    """
+    SimPZEM is one emulated PZEM-004T meter: its input registers, its alarm
+    threshold and address holding registers, and the energy counter.
+    """
+
+    def __init__(self, environment, address=1, noise=0.002, seed=None):
+        self.environment = environment
+        self.address = address
+        self.noise = noise  # relative standard deviation of the readings
+        self.alarm_threshold = 50000
+        self.energy_wh = 0.0
+        self._last = time.monotonic()
+        self._random = random.Random(seed)
+
+    def _jitter(self, value):
+        return value * (1 + self._random.gauss(0, self.noise))
+
+    def input_registers(self):
+        now = time.monotonic()
+        env = self.environment
+        power = self._jitter(env.power())
+        self.energy_wh += power * (now - self._last) / 3600
+        self._last = now
+        voltage = self._jitter(env.voltage_v)
+        current = power / (voltage * env.power_factor)
+        current_raw = int(current * 1000)
+        power_raw = int(power * 10)
+        energy_raw = int(self.energy_wh)
+        return [
+            int(voltage * 10),
+            current_raw & 0xFFFF, current_raw >> 16,
+            power_raw & 0xFFFF, power_raw >> 16,
+            energy_raw & 0xFFFF, energy_raw >> 16,
+            int(env.frequency_hz * 10),
+            int(env.power_factor * 100),
+            0xFFFF if power > self.alarm_threshold else 0,
+        ]
+
+    def holding_register(self, register):
+        if register == 1:
+            return self.alarm_threshold
+        if register == 2:
+            return self.address
+        return None
+
+
+class SimPZEMSlave:
+    """
+    SimPZEMSlave serves one or more SimPZEM meters as Modbus RTU slaves on a
+    pseudo terminal. Open pzem_path with pyserial like a real UART.
+    """
+
+    # function code -> request length in bytes, CRC included
+    REQUEST_LENGTHS = {0x03: 8, 0x04: 8, 0x06: 8, 0x42: 4}
+
+    def __init__(self,
+                 environment,
+                 slaves=(1,),
+                 latency=0.005,
+                 baudrate=9600,
+                 drop_rate=0.0,
+                 corrupt_rate=0.0,
+                 noise=0.002,
+                 seed=None):
+        """
+        Init a new instance of SimPZEMSlave
+
+        Args:
+            environment(Environment): source of the electrical load
+            slaves((int)): Optional, by default (1,). Slave addresses on the bus.
+            latency(float): Optional, by default 5 ms. Processing time before a reply.
+            baudrate(int): Optional, by default 9600. Replies take as long as they
+                would on the wire at this rate. None sends them at once.
+            drop_rate(float): Optional, by default 0. Probability of not replying.
+            corrupt_rate(float): Optional, by default 0. Probability of a reply
+                with a broken CRC.
+            noise(float): Optional, by default 0.2 %. Relative noise of the readings.
+        """
+        self.meters = {
+            address: SimPZEM(environment, address, noise, None if seed is None else seed + address)
+            for address in slaves
+        }
+        self.latency = latency
+        self.baudrate = baudrate
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self._random = random.Random(seed)
+        self.requests = 0
+
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.pzem_path = os.ttyname(self._slave_fd)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name="sim-pzem", daemon=True)
+        self._thread.start()
+
+    def _reply(self, frame):
+        frame = bytearray(frame)
+        crc = _crc16(frame)
+        frame += struct.pack("<H", crc)
+        if self.corrupt_rate and self._random.random() < self.corrupt_rate:
+            frame[-1] ^= 0xFF
+        if self.baudrate:
+            time.sleep(len(frame) * 10 / self.baudrate)
+        os.write(self._master_fd, bytes(frame))
+
+    def _handle(self, request):
+        self.requests += 1
+        address, function = request[0], request[1]
+        if address == 0xF8 and len(self.meters) == 1:
+            meter = next(iter(self.meters.values()))
+        else:
+            meter = self.meters.get(address)
+        if meter is None:
+            return  # nobody answers to this address
+        _wait(self.latency)
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            return
+
+        if function == 0x04:
+            start, count = struct.unpack(">HH", request[2:6])
+            registers = meter.input_registers()
+            if start + count > len(registers):
+                self._reply([address, 0x84, 0x02])
+                return
+            values = registers[start:start + count]
+            self._reply(struct.pack(">BBB", address, 0x04, 2 * count) + struct.pack(f">{count}H", *values))
+        elif function == 0x03:
+            start, count = struct.unpack(">HH", request[2:6])
+            values = [meter.holding_register(register) for register in range(start, start + count)]
+            if None in values:
+                self._reply([address, 0x83, 0x02])
+                return
+            self._reply(struct.pack(">BBB", address, 0x03, 2 * count) + struct.pack(f">{count}H", *values))
+        elif function == 0x06:
+            register, value = struct.unpack(">HH", request[2:6])
+            if register == 1:
+                meter.alarm_threshold = value
+            elif register == 2 and 1 <= value <= 247:
+                del self.meters[meter.address]
+                meter.address = value
+                self.meters[value] = meter
+            else:
+                self._reply([address, 0x86, 0x02])
+                return
+            self._reply(request[:6])
+        elif function == 0x42:
+            meter.energy_wh = 0.0
+            self._reply(request[:2])
+        else:
+            self._reply([address, function | 0x80, 0x01])
+
+    def _serve(self):
+        buffer = bytearray()
+        while self._running:
+            readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+            if not readable:
+                buffer.clear()  # silence on the line ends any partial frame
+                continue
+            try:
+                buffer += os.read(self._master_fd, 256)
+            except OSError:
+                return
+            while len(buffer) >= 2:
+                length = self.REQUEST_LENGTHS.get(buffer[1])
+                if length is None:
+                    buffer.clear()
+                    break
+                if len(buffer) < length:
+                    break
+                request = bytes(buffer[:length])
+                del buffer[:length]
+                if _crc16(request[:-2]) == struct.unpack("<H", request[-2:])[0]:
+                    self._handle(request)
+
+    def close(self):
+        self._running = False
+        self._thread.join(timeout=1)
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+
+# ----------------------------------------------------------------------------
+# Installing the simulation
+# ----------------------------------------------------------------------------
+
+class Simulation:
+    """
+    Simulation owns the simulated parts and the stand-in driver modules.
+    Create it through install().
+    """
+
+    def __init__(self,
+                 seed=None,
+                 environment=None,
+                 gpio=None,
+                 hx711=None,
+                 nau7802=None,
+                 si7021=None,
+                 pzem=None):
+        seed_of = (lambda offset: None) if seed is None else (lambda offset: seed + offset)
+        self.environment = Environment(**(environment or {}))
+
+        self.gpio = SimGPIO(seed=seed_of(1), **(gpio or {}))
+        self.hx711 = SimHX711(self.environment, seed=seed_of(2), **(hx711 or {}))
+        self.gpio.attach(self.hx711)
+
+        self.buses = {}
+        nau7802 = dict(nau7802 or {})
+        nau7802_bus = nau7802.pop("bus", 1)
+        self.nau7802 = SimNAU7802Device(self.environment, seed=seed_of(3), **nau7802)
+        self.i2c_bus(nau7802_bus).attach(0x2A, self.nau7802)
+        si7021 = dict(si7021 or {})
+        si7021_bus = si7021.pop("bus", 10)
+        self.si7021 = SimSi7021Device(self.environment, seed=seed_of(4), **si7021)
+        self.i2c_bus(si7021_bus).attach(0x40, self.si7021)
+
+        self.pzem = SimPZEMSlave(self.environment, seed=seed_of(5), **(pzem or {}))
+        self.pzem_path = self.pzem.pzem_path
+        self._saved_modules = {}
+
+    def i2c_bus(self, bus_id=1):
+        bus_id = int(bus_id)
+        if bus_id not in self.buses:
+            self.buses[bus_id] = VirtualI2C(bus_id)
+        return self.buses[bus_id]
+
+    def modules(self):
+        """
+        modules returns the stand-in driver modules by import name.
+        """
+        rpi = types.ModuleType("RPi")
+        rpi.GPIO = self.gpio
+
+        board = types.ModuleType("board")
+        board.I2C = lambda: self.i2c_bus(1)
+        board.SCL, board.SDA = 3, 2
+
+        extended_bus = types.ModuleType("adafruit_extended_bus")
+        extended_bus.ExtendedI2C = lambda bus_id, frequency=400000: self.i2c_bus(bus_id)
+
+        si7021 = types.ModuleType("adafruit_si7021")
+        si7021.SI7021 = SimSI7021
+        si7021.HUMIDITY = 0xF5
+        si7021.TEMPERATURE = 0xF3
+
+        nau7802 = types.ModuleType("cedargrove_nau7802")
+        nau7802.NAU7802 = SimNAU7802
+
+        return {
+            "RPi": rpi,
+            "RPi.GPIO": self.gpio,
+            "lgpio": self.gpio.lgpio(),
+            "board": board,
+            "adafruit_extended_bus": extended_bus,
+            "adafruit_si7021": si7021,
+            "cedargrove_nau7802": nau7802,
+        }
+
+    def uninstall(self):
+        """
+        uninstall puts back whatever the stand-in modules replaced.
+        """
+        for name, module in self._saved_modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        self._saved_modules = {}
+
+    def close(self):
+        """
+        close stops the PZEM slave and uninstalls the stand-in modules.
+        """
+        self.pzem.close()
+        self.uninstall()
+
+
+def install(**config):
+    """
+    install starts a Simulation and registers its stand-in modules, so the
+    next `import drip` (or hx711, nau7802_calibrate, ...) uses them. Call it
+    before those modules are imported.
+
+    Args:
+        seed(int): Optional. Makes the noise and faults repeatable.
+        environment(dict): Optional. Arguments for Environment.
+        gpio(dict): Optional. Arguments for SimGPIO (latency, stall_rate, stall_time).
+        hx711(dict): Optional. Arguments for SimHX711.
+        nau7802(dict): Optional. Arguments for SimNAU7802Device, plus "bus" (default 1).
+        si7021(dict): Optional. Arguments for SimSi7021Device, plus "bus" (default 10).
+        pzem(dict): Optional. Arguments for SimPZEMSlave.
+
+    Returns: Simulation
+    """
+    sim = Simulation(**config)
+    for name, module in sim.modules().items():
+        sim._saved_modules[name] = sys.modules.get(name)
+        sys.modules[name] = module
+    return sim
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs DRIP against simulated sensors.")
+    parser.add_argument("-n", "--iterations", dest="iterations", type=int, default=20,
+                        help="Number of iterations, defaults to 20")
+    parser.add_argument("-s", "--sleep", dest="sleep", type=float, default=0,
+                        help="Iteration period in seconds, defaults to 0")
+    parser.add_argument("-c", "--concurrent", dest="concurrent", action="store_true",
+                        help="Read the sensors concurrently")
+    parser.add_argument("-f", "--fast", dest="fast", action="store_true",
+                        help="Fastest conversion rates and no bus latencies")
+    parser.add_argument("-o", "--output", dest="output", type=str, default="data_sim.csv",
+                        help="CSV file to write, defaults to data_sim.csv")
+    parser.add_argument("--seed", dest="seed", type=int, default=None,
+                        help="Seed for repeatable noise")
+    args = parser.parse_args()
+
+    config = {"seed": args.seed}
+    if args.fast:
+        config.update(
+            nau7802={"rate_sps": 320, "latency": 0},
+            si7021={"latency": 0},
+            pzem={"latency": 0, "baudrate": None},
+        )
+    sim = install(**config)
+    from drip import DRIP
+
+    drip = DRIP(
+        drip_id=0,
+        si7021_i2c_bus=10,
+        pzem_interface_path=sim.pzem_path,
+        nau7802_offset=sim.nau7802.offset,
+        nau7802_ratio=sim.nau7802.ratio,
+        nau7802_readings=2,
+        file_export=args.output
+    )
+    start = time.perf_counter()
+    rows = drip.run_all(iterations=args.iterations, sleep=args.sleep, concurrent=args.concurrent)
+    elapsed = time.perf_counter() - start
+    drip.close_sensors()
+    sim.close()
+    print(f"--- {rows} rows in {elapsed:.2f} s, {rows / elapsed:.1f} iterations per second")
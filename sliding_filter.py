@@ -0,0 +1,149 @@
+"""
+This file holds SlidingOutlierFilter class
+"""
+from bisect import bisect_left
+from collections import deque
+
+from sortedcontainers import SortedList
+
+from hx711 import invalid_readings
+
+MAD_TO_STDEV = 1.4826  # MAD * 1.4826 estimates the standard deviation of normal data
+
+
+class SlidingOutlierFilter:
+    """
+    SlidingOutlierFilter is the streaming counterpart of HX711.outliers_filter.
+    It keeps the last `window` samples sorted, so the running median and the
+    median absolute deviation (MAD) are found in O(log n) steps per sample
+    instead of rescanning the window. A sample is accepted if its distance
+    from the median is below stdev_thresh robust standard deviations.
+    """
+
+    def __init__(self, window=45, stdev_thresh=1.0):
+        """
+        Init a new instance of SlidingOutlierFilter
+
+        Args:
+            window(int): Optional, by default 45. Number of recent samples kept.
+            stdev_thresh(float): Optional, by default 1.0. Accepted distance from
+                the median in robust standard deviations (1.4826 * MAD).
+
+        Raises:
+            ValueError: if window is smaller than 1
+        """
+        if window < 1:
+            raise ValueError('Parameter "window" has to be 1 or more. '
+                             'Received: {}'.format(window))
+        self.window = window
+        self.stdev_thresh = stdev_thresh
+        self._samples = deque()  # (value, accepted) in arrival order
+        self._sorted = SortedList()
+        self._accepted_sum = 0
+        self._accepted_count = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def _kth_distance(self, median, k):
+        """
+        _kth_distance returns the k-th smallest (0-based) |x - median| in the
+        window. The values below the median give one sorted run of distances
+        and the values from the median up give another, so this is a
+        selection on two sorted sequences: a binary search, O(log n) lookups.
+        """
+        s = self._sorted
+        split = bisect_left(s, median)
+        below = split  # distances median - s[split - 1 - i], ascending in i
+        above = len(s) - split  # distances s[split + j] - median, ascending in j
+
+        def low(i):
+            return median - s[split - 1 - i]
+
+        def high(j):
+            return s[split + j] - median
+
+        lo = max(0, k + 1 - above)
+        hi = min(k + 1, below)
+        while lo < hi:
+            i = (lo + hi) // 2
+            if low(i) < high(k - i):
+                lo = i + 1
+            else:
+                hi = i
+        taken_low, taken_high = lo, k + 1 - lo
+        candidates = []
+        if taken_low:
+            candidates.append(low(taken_low - 1))
+        if taken_high:
+            candidates.append(high(taken_high - 1))
+        return max(candidates)
+
+    def median(self):
+        """
+        median returns the median of the window, None when it is empty.
+        """
+        s = self._sorted
+        n = len(s)
+        if not n:
+            return None
+        if n % 2:
+            return s[n // 2]
+        return (s[n // 2 - 1] + s[n // 2]) / 2
+
+    def mad(self):
+        """
+        mad returns the median absolute deviation from the median of the
+        window, None when it is empty.
+        """
+        n = len(self._sorted)
+        if not n:
+            return None
+        median = self.median()
+        if n % 2:
+            return self._kth_distance(median, n // 2)
+        return (self._kth_distance(median, n // 2 - 1) + self._kth_distance(median, n // 2)) / 2
+
+    def push(self, value):
+        """
+        push adds a sample to the window, dropping the oldest one once the
+        window is full, and checks it against the updated median and MAD.
+        The readings outliers_filter drops (-1, False, True and so 0 and 1,
+        see hx711.invalid_readings) are ignored.
+
+        Args:
+            value(int): new raw sample
+
+        Returns: bool True if the sample was accepted
+        """
+        if invalid_readings(value):
+            return False
+        if len(self._samples) == self.window:
+            old, old_accepted = self._samples.popleft()
+            self._sorted.remove(old)
+            if old_accepted:
+                self._accepted_sum -= old
+                self._accepted_count -= 1
+        self._sorted.add(value)
+
+        median = self.median()
+        scale = MAD_TO_STDEV * self.mad()
+        if scale:
+            accepted = abs(value - median) / scale < self.stdev_thresh
+        else:
+            # most of the window is the same value, only accept that value
+            accepted = value == median
+        self._samples.append((value, accepted))
+        if accepted:
+            self._accepted_sum += value
+            self._accepted_count += 1
+        return accepted
+
+    def mean(self):
+        """
+        mean returns the mean of the accepted samples still in the window,
+        None if there are none.
+        """
+        if not self._accepted_count:
+            return None
+        return self._accepted_sum / self._accepted_count
@@ -0,0 +1,173 @@
+"""
+This file holds StreamWriter class
+"""
+import csv
+import os
+import time
+from datetime import datetime
+
+
+class StreamWriter:
+    """
+    StreamWriter appends rows to a CSV file as they are produced, so a long
+    run keeps a flat memory footprint and a power cut loses at most the rows
+    since the last commit.
+    """
+
+    def __init__(self,
+                 path,
+                 fields,
+                 flush_interval=5.0,
+                 flush_rows=10,
+                 fsync=False,
+                 rotate_bytes=None,
+                 rotate_seconds=None):
+        """
+        Init a new instance of StreamWriter
+
+        Args:
+            path(str): file to write. With rotation enabled every part is
+                named after this path with a timestamp suffix.
+            fields([str]): column names, written as the header of every file.
+            flush_interval(float): Optional, by default 5.0. Seconds between
+                group commits.
+            flush_rows(int): Optional, by default 10. Rows between group commits.
+            fsync(bool): Optional, by default False. If True every commit is
+                also forced to the storage device with os.fsync.
+            rotate_bytes(int): Optional. Start a new file once the current
+                one reaches this size.
+            rotate_seconds(float): Optional. Start a new file once the current
+                one has been open this long.
+        """
+        self.path = path
+        self.fields = fields
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+
+        self.paths = []  # every file written so far, oldest first
+        self.rows_written = 0
+        self._file = None
+        self._writer = None
+        self._opened_at = 0.0
+        self._last_commit = 0.0
+        self._pending = 0  # rows written since the last commit
+        self._open()
+
+    def _next_path(self, new_part=False):
+        """
+        _next_path returns the file name for the next part.
+        Without rotation it is the configured path, unless new_part is True.
+        """
+        if not new_part and self.rotate_bytes is None and self.rotate_seconds is None:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        part = f"{stem}_{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+        counter = 1
+        candidate = part
+        while candidate in self.paths or os.path.exists(candidate):
+            candidate = f"{os.path.splitext(part)[0]}_{counter}{ext}"
+            counter += 1
+        return candidate
+
+    def _open(self):
+        """
+        _open opens the next part in append mode. The header is written
+        only if the file is new or empty, so restarting a run resumes the
+        same file instead of overwriting it. A file with other columns (a
+        run with another configuration) is left alone and a new part with a
+        timestamp suffix is started instead.
+        """
+        path = self._next_path()
+        if not self._appendable(path):
+            new_path = self._next_path(new_part=True)
+            print(f"--- {path} has other columns, writing to {new_path} ---")
+            path = new_path
+        write_header = not os.path.exists(path) or os.stat(path).st_size == 0
+        self._file = self._open_file(path)
+        self._writer = self._make_writer(self._file)
+        if write_header:
+            self._write_header()
+        self.paths.append(path)
+        self._opened_at = time.monotonic()
+        self._last_commit = self._opened_at
+
+    def _appendable(self, path):
+        # new, empty or written with the same header
+        if not os.path.exists(path) or os.stat(path).st_size == 0:
+            return True
+        with open(path, newline='') as f:
+            return next(csv.reader(f), None) == list(self.fields)
+
+    def _open_file(self, path):
+        return open(path, 'a', newline='')
+
+    def _make_writer(self, f):
+        return csv.DictWriter(f, fieldnames=self.fields, extrasaction='ignore')
+
+    def _write_header(self):
+        self._writer.writeheader()
+
+    def _write_row(self, row):
+        self._writer.writerow(row)
+
+    def write(self, row):
+        """
+        write appends one row and commits or rotates when a policy says so.
+
+        Args:
+            row(dict): values keyed by field name. Missing fields are left empty.
+        """
+        self._write_row(row)
+        self.rows_written += 1
+        self._pending += 1
+
+        now = time.monotonic()
+        if (self._pending >= self.flush_rows
+                or now - self._last_commit >= self.flush_interval):
+            self.commit()
+            # the size is only looked at after a commit, asking the buffered
+            # file for its position would force a flush on every row
+            if (self.rotate_bytes is not None
+                    and os.fstat(self._file.fileno()).st_size >= self.rotate_bytes):
+                self.rotate()
+                return
+        if (self.rotate_seconds is not None
+                and now - self._opened_at >= self.rotate_seconds):
+            self.rotate()
+
+    def commit(self):
+        """
+        commit flushes buffered rows to the OS and, if fsync is enabled,
+        to the storage device.
+        """
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def rotate(self):
+        """
+        rotate commits and closes the current file and opens the next part.
+        """
+        self.commit()
+        self._file.close()
+        self._open()
+
+    def close(self):
+        """
+        close commits any pending rows and closes the current file.
+        """
+        if self._file is None or self._file.closed:
+            return
+        self.commit()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,337 @@
+"""
+This file holds Supervisor, which runs several DRIP units from one host.
+
+Every unit runs in its own worker process with its own sensors and its own
+output stream (file_export, default unit_<drip_id>.csv). The workers report
+each row they write; the supervisor records them in one combined index,
+restarts workers that crash and reports throughput and lag per unit.
+
+The config file is JSON:
+
+    {"units": [
+        {"drip_id": 1, "si7021_i2c_bus": 10, "pzem_interface_path": "/dev/ttyUSB0",
+         "run": {"infinite": true, "sleep": 2}},
+        {"drip_id": 2, "si7021_i2c_bus": 11, "simulate": {"seed": 2}}
+    ]}
+
+Every unit takes the DRIP arguments, plus "run" (arguments for run_all) and
+"simulate" (arguments for simulator.install, runs the unit without hardware).
+
+Usage:
+    python supervisor.py units.json --output-dir runs/
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+import traceback
+
+from running_stats import RunningStats
+from stream_writer import StreamWriter
+
+INDEX_FIELDS = ['Time', 'Unit', 'Row', 'File', 'Lag']
+
+
+def _run_unit(config, output_dir, rows):
+    """
+    _run_unit is the body of a worker process: it runs one DRIP unit and
+    puts (drip_id, time of the row, Time column) on rows for every row.
+    """
+    config = dict(config)
+    drip_id = config["drip_id"]
+    run = dict(config.pop("run", {"infinite": True}))
+    simulate = config.pop("simulate", None)
+
+    # the unit prints every reading, keep that out of the supervisor's console
+    log = open(os.path.join(output_dir, f"unit_{drip_id}.log"), 'a', buffering=1)
+    sys.stdout = sys.stderr = log
+    # the supervisor stops workers with SIGINT, run_all then closes its files
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    failed = False
+    try:
+        sim = None
+        if simulate is not None:
+            import simulator
+            sim = simulator.install(**simulate)
+            config["pzem_interface_path"] = sim.pzem_path
+            config.setdefault("nau7802_offset", sim.nau7802.offset)
+            config.setdefault("nau7802_ratio", sim.nau7802.ratio)
+        from drip import DRIP  # after the simulator, drip imports the drivers when DRIP starts
+
+        drip = DRIP(**config)
+        drip.run_all(**run, on_row=lambda row: rows.put((drip_id, time.time(), row.get('Time'))))
+        if not run.get("infinite"):
+            drip.close_sensors()
+        if sim is not None:
+            sim.close()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        failed = True
+    finally:
+        log.flush()
+    if failed or run.get("infinite"):
+        # an infinite run only ends on an error or a stop, exit non-zero so the
+        # supervisor restarts the unit (unless it stopped the unit itself)
+        # os._exit skips the queue's feeder thread, send the rows it still holds first
+        rows.close()
+        rows.join_thread()
+        os._exit(1)
+
+
+class Unit:
+    """
+    Unit is the supervisor's view of one DRIP worker.
+    """
+
+    def __init__(self, config, output_dir):
+        self.config = dict(config)
+        self.drip_id = config["drip_id"]
+        self.config.setdefault("file_export", os.path.join(output_dir, f"unit_{self.drip_id}.csv"))
+        self.file_export = self.config["file_export"]
+        self.process = None
+        self.started = None
+        self.exited = None  # monotonic time the supervisor saw the worker exit
+        self.restarts = 0  # every restart, for the reports
+        self.failures = 0  # restarts since the unit last ran healthy_rows rows
+        self.rows = 0
+        self.rows_since_start = 0
+        self.last_row = None  # monotonic time of the last row
+        self.lag = RunningStats()
+        self.done = False  # finished its iterations or gave up
+        self.exitcode = None
+        self._window_rows = 0  # rows since the last report
+        self._window_start = time.monotonic()
+
+    def throughput(self):
+        """
+        throughput returns rows per second since the last call.
+        """
+        now = time.monotonic()
+        rate = self._window_rows / (now - self._window_start) if now > self._window_start else 0.0
+        self._window_rows = 0
+        self._window_start = now
+        return rate
+
+
+class Supervisor:
+    """
+    Supervisor runs one worker process per DRIP unit and restarts the ones
+    that crash.
+    """
+
+    def __init__(self,
+                 units,
+                 output_dir='.',
+                 max_restarts=5,
+                 restart_delay=5.0,
+                 report_interval=10.0,
+                 stall_timeout=None,
+                 healthy_rows=100):
+        """
+        Init a new instance of Supervisor
+
+        Args:
+            units([dict]): one config per unit, see the top of this file.
+            output_dir(str): Optional, by default '.'. Directory for the unit
+                logs, the default unit streams and index.csv.
+            max_restarts(int): Optional, by default 5. Restarts in a row per
+                unit before the supervisor gives up on it.
+            restart_delay(float): Optional, by default 5. Seconds after a
+                crash before the unit is started again.
+            report_interval(float): Optional, by default 10. Seconds between reports.
+            stall_timeout(float): Optional. A running unit without a new row for
+                this long is stopped and restarted.
+            healthy_rows(int): Optional, by default 100. Rows a restarted unit
+                has to write before its earlier crashes no longer count
+                towards max_restarts.
+
+        Raises:
+            ValueError: if two units share a drip_id or an output file
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.units = [Unit(config, output_dir) for config in units]
+        ids = [unit.drip_id for unit in self.units]
+        files = [unit.file_export for unit in self.units]
+        if len(set(ids)) != len(ids) or len(set(files)) != len(files):
+            raise ValueError('every unit needs its own drip_id and file_export')
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.report_interval = report_interval
+        self.stall_timeout = stall_timeout
+        self.healthy_rows = healthy_rows
+
+        # spawn, so every worker imports its drivers (or the simulator) fresh
+        self._context = multiprocessing.get_context("spawn")
+        self._rows = self._context.Queue()
+        self._by_id = {unit.drip_id: unit for unit in self.units}
+        self.index = StreamWriter(os.path.join(output_dir, 'index.csv'), INDEX_FIELDS)
+        self._stopping = False
+
+    def _start(self, unit):
+        unit.process = self._context.Process(
+            target=_run_unit,
+            args=(unit.config, self.output_dir, self._rows),
+            name=f"drip-{unit.drip_id}",
+            daemon=True
+        )
+        unit.process.start()
+        unit.started = time.monotonic()
+        unit.exited = None
+        unit.rows_since_start = 0
+        unit.last_row = unit.started
+        print(f"--- unit {unit.drip_id} started (pid {unit.process.pid})")
+
+    def _stop(self, unit, timeout=10.0):
+        process = unit.process
+        if process is None or not process.is_alive():
+            return
+        os.kill(process.pid, signal.SIGINT)
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _receive(self, timeout):
+        try:
+            drip_id, written, row_time = self._rows.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            unit = self._by_id[drip_id]
+            lag = time.time() - written
+            unit.rows += 1
+            unit.rows_since_start += 1
+            if unit.failures and unit.rows_since_start >= self.healthy_rows:
+                unit.failures = 0  # running well again, an old crash does not count
+            unit._window_rows += 1
+            unit.last_row = time.monotonic()
+            unit.lag.add(lag)
+            self.index.write({'Time': row_time, 'Unit': drip_id, 'Row': unit.rows,
+                              'File': unit.file_export, 'Lag': f"{lag:.4f}"})
+            try:
+                drip_id, written, row_time = self._rows.get_nowait()
+            except queue.Empty:
+                return
+
+    def _check(self, unit):
+        if unit.done:
+            return
+        process = unit.process
+        stalled = False
+        if process.is_alive():
+            if (self.stall_timeout is None
+                    or time.monotonic() - unit.last_row <= self.stall_timeout):
+                return
+            print(f"--- unit {unit.drip_id} wrote nothing for {self.stall_timeout} s, stopping it")
+            self._stop(unit)
+            stalled = True
+        if unit.exited is None:
+            unit.exited = time.monotonic()
+        unit.exitcode = process.exitcode
+        if process.exitcode == 0 and not stalled:
+            print(f"--- unit {unit.drip_id} finished")
+            unit.done = True
+        elif unit.failures >= self.max_restarts:
+            print(f"--- unit {unit.drip_id} exited with {process.exitcode}, "
+                  f"giving up after {unit.failures} restarts in a row")
+            unit.done = True
+        elif time.monotonic() - unit.exited >= self.restart_delay:
+            unit.restarts += 1
+            unit.failures += 1
+            print(f"--- unit {unit.drip_id} exited with {process.exitcode}, "
+                  f"restart {unit.failures}/{self.max_restarts}")
+            self._start(unit)
+
+    def report(self):
+        """
+        report prints rows, throughput, lag and restarts of every unit.
+        """
+        now = time.monotonic()
+        for unit in self.units:
+            if unit.done:
+                status = "done"
+            elif unit.process is not None and unit.process.is_alive():
+                status = "running"
+            elif self._stopping:
+                status = "stopped"
+            else:
+                status = "restarting"
+            print(f"--- unit {unit.drip_id}: {status}, {unit.rows} rows, "
+                  f"{unit.throughput():.2f} rows/s, lag mean {unit.lag.mean * 1000:.1f} ms "
+                  f"max {max(unit.lag.max, 0) * 1000:.1f} ms, last row {now - unit.last_row:.1f} s ago, "
+                  f"{unit.restarts} restarts")
+
+    def stats(self):
+        """
+        stats returns a dict of drip_id -> rows, restarts, lag_mean, lag_max and exitcode.
+        """
+        return {
+            unit.drip_id: {
+                "rows": unit.rows,
+                "restarts": unit.restarts,
+                "lag_mean": unit.lag.mean,
+                "lag_max": unit.lag.max if unit.lag.count else 0.0,
+                "exitcode": unit.exitcode,
+            }
+            for unit in self.units
+        }
+
+    def run(self):
+        """
+        run starts every unit and supervises them until all are done or
+        the supervisor is interrupted.
+
+        Returns: dict, see stats()
+        """
+        for unit in self.units:
+            self._start(unit)
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while not all(unit.done for unit in self.units):
+                self._receive(timeout=0.2)
+                for unit in self.units:
+                    self._check(unit)
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report += self.report_interval
+        except KeyboardInterrupt:
+            print("\n--- KeyboardInterrupt detected. Stopping units ---")
+        finally:
+            self._stopping = True
+            for unit in self.units:
+                self._stop(unit)
+            self._receive(timeout=0.5)  # rows written while the units stopped
+            self.index.close()
+            self.report()
+        return self.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs several DRIP units in parallel.")
+    parser.add_argument("config", type=str, help="JSON file with the unit configs")
+    parser.add_argument("-d", "--output-dir", dest="output_dir", type=str, default=".",
+                        help="Directory for unit logs, unit streams and index.csv, defaults to .")
+    parser.add_argument("-r", "--max-restarts", dest="max_restarts", type=int, default=5,
+                        help="Restarts in a row per unit before giving up, defaults to 5")
+    parser.add_argument("-i", "--report-interval", dest="report_interval", type=float, default=10.0,
+                        help="Seconds between reports, defaults to 10")
+    parser.add_argument("--stall-timeout", dest="stall_timeout", type=float, default=None,
+                        help="Restart a unit that wrote no row for this many seconds")
+    parser.add_argument("--healthy-rows", dest="healthy_rows", type=int, default=100,
+                        help="Rows after which earlier crashes of a unit are forgiven, defaults to 100")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        units = json.load(f)["units"]
+    supervisor = Supervisor(units, output_dir=args.output_dir, max_restarts=args.max_restarts,
+                            report_interval=args.report_interval, stall_timeout=args.stall_timeout,
+                            healthy_rows=args.healthy_rows)
+    supervisor.run()
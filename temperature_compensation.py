@@ -0,0 +1,171 @@
+"""
+This file holds the temperature compensation of the load cell weight:
+TemperatureCompensation and TemperatureCoefficientEstimator.
+
+The zero and the span of a load cell drift with temperature:
+
+    offset(T) = offset + zero_tc * gain * (T - reference)
+    ratio(T) = ratio / (1 + span_tc * (T - reference))
+
+with zero_tc in grams per C and span_tc per C. In grams, for the NAU7802
+and the HX711 alike, the raw weight G = (raw - offset) * ratio becomes
+
+    grams = (G - zero_tc * dT) / (1 + span_tc * dT)
+
+The coefficients are learned from periods in which the weight does not
+change (the dehumidifier is off, so no water is collected): within such a
+period every change of G is drift, G - W = zero_tc * dT + span_tc * W * dT.
+"""
+import math
+
+IDLE_POWER = 20.0  # W, below this the dehumidifier collects no water
+
+
+class TemperatureCompensation:
+    """
+    TemperatureCompensation corrects raw weights for the temperature of the
+    load cell. It costs two multiplications and a division per reading.
+    """
+
+    def __init__(self, zero_tc=0.0, span_tc=0.0, reference=25.0):
+        """
+        Init a new instance of TemperatureCompensation
+
+        Args:
+            zero_tc(float): Optional, by default 0. Zero drift in grams per C.
+            span_tc(float): Optional, by default 0. Relative span drift per C.
+            reference(float): Optional, by default 25. Temperature in C at
+                which the scale was calibrated.
+        """
+        self.coefficients = (zero_tc, span_tc)  # replaced as one, readers see a matching pair
+        self.reference = reference
+
+    def apply(self, grams, temperature):
+        """
+        apply returns the compensated weight.
+
+        Args:
+            grams(float): raw weight, (raw - offset) * ratio
+            temperature(float): temperature in C, None leaves the weight as it is
+        """
+        if temperature is None or grams is None or grams is False:
+            return grams
+        zero_tc, span_tc = self.coefficients
+        delta = temperature - self.reference
+        return (grams - zero_tc * delta) / (1 + span_tc * delta)
+
+
+class TemperatureCoefficientEstimator:
+    """
+    TemperatureCoefficientEstimator learns zero_tc and span_tc online from
+    raw weights taken while the weight is constant. Each period keeps
+    running sums, and a closed period adds its share to 2 x 2 normal
+    equations, so every reading costs O(1) and nothing is stored.
+    With periods at a single weight the two coefficients cannot be told
+    apart, all drift is then put in zero_tc.
+    """
+
+    def __init__(self, jump=5.0, min_samples=30, max_samples=600):
+        """
+        Init a new instance of TemperatureCoefficientEstimator
+
+        Args:
+            jump(float): Optional, by default 5. A weight change of more grams
+                than this ends the period (something was put on or taken off).
+            min_samples(int): Optional, by default 30. Readings a period needs
+                to be used.
+            max_samples(int): Optional, by default 600. A period is closed and
+                a new one started after this many readings, so a long idle
+                time contributes while it lasts.
+        """
+        self.jump = jump
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.periods = 0  # periods used so far
+        self._a = [0.0, 0.0, 0.0]  # normal equations: sum Sxx, sum W Sxx, sum W^2 Sxx
+        self._c = [0.0, 0.0]  # sum Sxy, sum W Sxy
+        self._start_period()
+
+    def _start_period(self):
+        self._n = 0
+        self._t0 = self._g0 = 0.0
+        self._st = self._sg = self._stt = self._stg = 0.0
+
+    def add(self, temperature, grams, constant=True):
+        """
+        add includes one reading.
+
+        Args:
+            temperature(float): temperature in C
+            grams(float): raw (uncompensated) weight
+            constant(bool): Optional, by default True. False if the weight
+                may be changing, this ends the current period.
+
+        Returns: bool True if a period was closed and the coefficients changed
+        """
+        if not constant or temperature is None or grams is None or grams is False:
+            return self.end_period()
+        changed = False
+        if self._n and abs(grams - self._g0) > self.jump:
+            changed = self.end_period()
+        if not self._n:
+            # sums relative to the first reading keep their precision
+            self._t0, self._g0 = temperature, grams
+        t, g = temperature - self._t0, grams - self._g0
+        self._n += 1
+        self._st += t
+        self._sg += g
+        self._stt += t * t
+        self._stg += t * g
+        if self._n >= self.max_samples:
+            changed = self.end_period() or changed
+        return changed
+
+    def end_period(self):
+        """
+        end_period closes the current period.
+
+        Returns: bool True if the period was long enough to be used
+        """
+        n = self._n
+        used = False
+        if n >= self.min_samples:
+            sxx = self._stt - self._st * self._st / n
+            sxy = self._stg - self._st * self._sg / n
+            if sxx > 0:
+                weight = self._g0 + self._sg / n
+                self._a[0] += sxx
+                self._a[1] += weight * sxx
+                self._a[2] += weight * weight * sxx
+                self._c[0] += sxy
+                self._c[1] += weight * sxy
+                self.periods += 1
+                used = True
+        self._start_period()
+        return used
+
+    def coefficients(self):
+        """
+        coefficients returns the fitted coefficients.
+
+        Returns: ((float, float) || None) zero_tc in g/C and span_tc per C,
+            None before a period with a temperature change was closed
+        """
+        a0, a1, a2 = self._a
+        c0, c1 = self._c
+        if a0 <= 0:
+            return None
+        det = a0 * a2 - a1 * a1
+        # det / (a0 * a2) is the relative spread of the period weights; with
+        # periods at about the same weight the span drift cannot be separated
+        if det <= 0.01 * a0 * a2:
+            return c0 / a0, 0.0
+        return (a2 * c0 - a1 * c1) / det, (a0 * c1 - a1 * c0) / det
+
+
+def idle(power, threshold=IDLE_POWER):
+    """
+    idle returns True if the dehumidifier draws less than threshold W,
+    so the weight of the tank is constant. False if the power is unknown.
+    """
+    return power is not None and not (isinstance(power, float) and math.isnan(power)) and power < threshold
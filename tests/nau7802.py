@@ -13,6 +13,7 @@ import time
 import board
 
 from cedargrove_nau7802 import NAU7802
+from nau7802_sampler import NAU7802Sampler
 
 
 class NAU7802_HELP:
@@ -35,11 +36,4 @@ class NAU7802_HELP:
 
     def read_raw_value(samples=2):
         """Read and average consecutive raw sample values. Return average raw value."""
-        sample_sum = 0
-        sample_count = samples
-        while sample_count > 0:
-            while not nau7802.available():
-                pass
-            sample_sum = sample_sum + nau7802.read()
-            sample_count -= 1
-        return int(sample_sum / samples)
+        return NAU7802Sampler(nau7802).read_mean(samples)
@@ -16,6 +16,9 @@ from modbus_tk import modbus_rtu
 import modbus_tk.exceptions as error
 import serial
 
+from console_display import ConsoleDisplay
+import pzem
+
 """Set up the optional arguments to customize the functions of the script"""
 parser = argparse.ArgumentParser(description = "Reads from a PZEM-004T sensor and displays the results.")
 
@@ -49,6 +52,14 @@ parser.add_argument(
     type    = int,
     default = 50000
     )
+parser.add_argument(
+    "-r", "--refresh",
+    help    = "Sets the most screen redraws per second, defaults to 1",
+    dest    = "refresh",
+    action  = "store",
+    type    = float,
+    default = 1
+    )
 
 args = parser.parse_args()
 
@@ -104,39 +115,29 @@ class Logger:
     def processData(self, data):
         """Takes the data from the sensor and processes it to standard units."""
         
-        self.processed_data = (
-        data[0] / 10,
-        (data[1] + (data[2] << 16)) / 1000,
-        (data[3] + (data[4] << 16)) / 10,
-        data[5] + (data[6] << 16),
-        data[7] / 10,
-        data[8] / 100,
-        0 if data[9] == 0 else 1
-        )
-        print(self.processed_data)
+        self.processed_data = pzem.decode(data)
         
-    def consoleLog(self):
-        """Prints the processed data to the console."""
+    def consoleLog(self, buffer):
+        """Formats the processed data for the console display."""
 
-        buffer = self.processed_data
         output = (
-        f"Voltage:      {buffer[0]: >6.1f}V\n"
-        f"Current:      {buffer[1]: >6.1f}A\n"
-        f"Power:        {buffer[2]: >6.1f}W\n"
-        f"Energy:       {buffer[3]: >6.1f}Wh\n"
-        f"Frequency:    {buffer[4]: >6.1f}Hz\n"
-        f"Power Factor: {buffer[5]: >6}\n\n"
+        f"Voltage:      {buffer['Voltage']: >6.1f}V\n"
+        f"Current:      {buffer['Current']: >6.1f}A\n"
+        f"Power:        {buffer['Power']: >6.1f}W\n"
+        f"Energy:       {buffer['Energy']: >6.1f}Wh\n"
+        f"Frequency:    {buffer['Frequency']: >6.1f}Hz\n"
+        f"Power Factor: {buffer['Power_Factor']: >6}\n\n"
         f"Threshold:    {args.alarm:,}V\n"
-        f"Alarm Status: {'Off' if buffer[6] == 0 else 'Active'}\n\n"
+        f"Alarm Status: {'Off' if buffer['Alarm_Status'] == 0 else 'Active'}\n\n"
         f"Press \"Ctrl + C\" to exit."
         )
-        print(output)
+        return output
 
     def fileLog(self):
         """Prints the processed data to the log file (if enabled)."""
 
         buffer = self.processed_data
-        self.log_file.write(f"{datetime.now()},{buffer[0]},{buffer[1]},{buffer[2]},{buffer[3]},{buffer[4]},{buffer[5]},{args.alarm},{buffer[6]}\n")
+        self.log_file.write(f"{datetime.now()},{buffer['Voltage']},{buffer['Current']},{buffer['Power']},{buffer['Energy']},{buffer['Frequency']},{buffer['Power_Factor']},{args.alarm},{buffer['Alarm_Status']}\n")
 
     def closeLog(self):
         """Closes the log file."""
@@ -151,22 +152,26 @@ def main():
     sensor.setAlarm(args.alarm)
     log = Logger()
     time.sleep(3)
+    # redrawn from its own thread, a slow terminal does not delay the readings
+    display = ConsoleDisplay(refresh = args.refresh, title = f"PZEM-004T {args.port}", formatter = log.consoleLog)
     
     try:
         while True:
             data = sensor.readRegisters()
             log.processData(data)
-            print("\033[2J\033[;H", end = "")
-            log.consoleLog()
+            display.update(log.processed_data)
             if args.logging == True:
                 log.fileLog()
 
             time.sleep(args.interval)
     
     except KeyboardInterrupt:
-        print("Exiting script")
+        pass
    
     finally:
+        # the last frame first, so it does not clear the message
+        display.close()
+        print("Exiting script")
         sensor.close()
         if args.logging == True:
             log.closeLog()